@@ -8,6 +8,7 @@ import cartopy.crs as ccrs
 import cartopy.mpl.ticker as cticker
 import imageio
 from cnmaps import get_adm_maps, draw_maps
+import vector_layer
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -65,13 +66,18 @@ ax.xaxis.set_major_formatter(lon_formatter)
 ax.yaxis.set_major_formatter(lat_formatter)
 ax.gridlines(draw_labels=True)
 
+# 按屏幕均匀间隔抽稀箭头，下标只计算一次
+extent = [110, 115, 32, 37]
+rows, cols = vector_layer.subsample_index(lons, lats, extent, figsize=(12, 8))
+sub_lon_grid, sub_lat_grid = np.meshgrid(lons[cols], lats[rows])
+
 # 初始化风场图
-u = u10[0, :, :]
-v = v10[0, :, :]
+u = u10[0, rows, cols]
+v = v10[0, rows, cols]
 speed = np.sqrt(u ** 2 + v ** 2)
-quiver = ax.quiver(lon_grid, lat_grid, u, v, speed, transform=ccrs.PlateCarree(), scale=50, cmap='coolwarm')
+quiver = ax.quiver(sub_lon_grid, sub_lat_grid, u, v, speed, transform=ccrs.PlateCarree(), scale=50, cmap='coolwarm')
 ax.coastlines()
-ax.set_extent([110, 115, 32, 37], crs=ccrs.PlateCarree())  # 设置经纬度范围
+ax.set_extent(extent, crs=ccrs.PlateCarree())  # 设置经纬度范围
 ax.set_title(f'10m处风场 {time_points[0].strftime("%Y-%m-%d %H:%M")}')
 ax.set_xlabel('经度')
 ax.set_ylabel('纬度')
@@ -89,8 +95,8 @@ draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')  # 修改郑州市界颜
 # 动画更新函数
 def update(frame):
     current_time = time_points[frame]
-    u = u10[frame, :, :]
-    v = v10[frame, :, :]
+    u = u10[frame, rows, cols]
+    v = v10[frame, rows, cols]
     speed = np.sqrt(u ** 2 + v ** 2)
 
     quiver.set_UVC(u, v, speed)
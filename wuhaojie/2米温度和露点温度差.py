@@ -7,6 +7,9 @@ import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import cnmaps
 import pandas as pd  # 导入pandas库
+import contour_cache
+import preview
+import derived
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -23,9 +26,8 @@ def load_dataset(file_path):
     return dataset
 
 def calculate_temperature_difference(t2m, d2m):
-    # 计算2米温度和露点温度的差值
-    temp_diff = t2m - d2m
-    return temp_diff
+    # 计算2米温度和露点温度的差值，按时间块一次完成，不生成整场临时数组
+    return derived.evaluate('dewpoint_depression', t=t2m, td=d2m)
 
 def extract_variables(dataset):
     try:
@@ -38,28 +40,36 @@ def extract_variables(dataset):
         raise KeyError(f"变量未找到: {e}")
     return t2m, d2m, time_var, lats, lons
 
-def save_temp_diff_frames(lon_grid, lat_grid, temp_diff, time_points, output_dir):
-    henan = cnmaps.get_adm_maps(province='河南省')
-    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
-
-    for frame in range(len(time_points)):
+def draw_frame(ax, cache_file, levels, current_time, boundaries, extent=(110, 115, 32, 37)):
+    # 一帧温度露点差：脚本出图和frame_server共用，保证同一时次的图完全一致
+    ax.set_extent(list(extent), crs=ccrs.PlateCarree())  # 设置经纬度范围
+    temp_diff_contour = contour_cache.draw_cached_contours(ax, cache_file, levels, cmap='coolwarm', alpha=0.6)
+    ax.figure.colorbar(temp_diff_contour, ax=ax, orientation='horizontal', pad=0.05, label='温度差 (°C)')
+    ax.set_title(f'2米温度和露点温度差 {current_time.strftime("%Y-%m-%d %H:%M")}')
+    ax.set_xlabel('经度')
+    ax.set_ylabel('纬度')
+    ax.coastlines()
+    ax.add_feature(cfeature.BORDERS, linestyle=':')
+    ax.gridlines(draw_labels=True)
+
+    # 添加河南省和郑州市边界
+    cnmaps.draw_maps(boundaries['henan'], ax=ax, linewidth=1.0, color='black')
+    cnmaps.draw_maps(boundaries['zhengzhou'], ax=ax, linewidth=1.0, color='red')
+
+def save_temp_diff_frames(lon_grid, lat_grid, temp_diff, time_points, output_dir, frames=None):
+    boundaries = {'henan': cnmaps.get_adm_maps(province='河南省'), 'zhengzhou': cnmaps.get_adm_maps(city='郑州市')}
+
+    # 固定层次的等值线在工作进程中预先生成并缓存，只改配色或标题时不再重新计算
+    temp_diff = np.asarray(temp_diff)
+    levels = contour_cache.contour_levels(temp_diff)
+    frames = preview.selected_frames(len(time_points), frames)
+    contour_files = dict(zip(frames, contour_cache.precompute_contours(lon_grid, lat_grid, temp_diff[frames], levels)))
+
+    for frame in frames:
         current_time = pd.to_datetime(time_points[frame])
-        temp_diff_frame = temp_diff[frame, :, :]  # 当前时间帧的温度差
 
         fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
-        ax.set_extent([110, 115, 32, 37], crs=ccrs.PlateCarree())  # 设置经纬度范围
-        temp_diff_contour = ax.contourf(lon_grid, lat_grid, temp_diff_frame, cmap='coolwarm', alpha=0.6, transform=ccrs.PlateCarree())
-        plt.colorbar(temp_diff_contour, ax=ax, orientation='horizontal', pad=0.05, label='温度差 (°C)')
-        ax.set_title(f'2米温度和露点温度差 {current_time.strftime("%Y-%m-%d %H:%M")}')
-        ax.set_xlabel('经度')
-        ax.set_ylabel('纬度')
-        ax.coastlines()
-        ax.add_feature(cfeature.BORDERS, linestyle=':')
-        ax.gridlines(draw_labels=True)
-
-        # 添加河南省和郑州市边界
-        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
-        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+        draw_frame(ax, contour_files[frame], levels, current_time, boundaries)
 
         # 保存图像
         output_file = os.path.join(output_dir, f'frame_{frame:03d}.png')
@@ -83,6 +93,9 @@ def main():
     file_path = r"D:\Git desktop\dongliqixiang\Dongliqixiangxue\xiaochidu.nc"
     temp_diff_output_dir = r"D:\新建文件夹\temp_diff"
     temp_diff_output_file = os.path.join(temp_diff_output_dir, 'temp_diff_animation.gif')
+    # 出图模式：'preview'只生成所有时次的缩略总览图；'full'出完整质量的帧，promote_frames指定只升级部分帧(None为全部)
+    render_mode = 'full'
+    promote_frames = None
 
     os.makedirs(temp_diff_output_dir, exist_ok=True)
 
@@ -94,7 +107,14 @@ def main():
     # 使用pandas处理时间变量
     time_points = pd.to_datetime(time_var)
 
-    save_temp_diff_frames(lon_grid, lat_grid, temp_diff, time_points, temp_diff_output_dir)
+    if render_mode == 'preview':
+        levels = contour_cache.contour_levels(np.asarray(temp_diff))
+        preview.contact_sheet(lon_grid, lat_grid, temp_diff, time_points, levels, 'coolwarm', '2米温度和露点温度差',
+                              '温度差 (°C)', os.path.join(temp_diff_output_dir, 'temp_diff_preview.png'))
+        dataset.close()
+        return
+
+    save_temp_diff_frames(lon_grid, lat_grid, temp_diff, time_points, temp_diff_output_dir, frames=promote_frames)
     create_animation_from_images(temp_diff_output_dir, temp_diff_output_file)
 
     dataset.close()
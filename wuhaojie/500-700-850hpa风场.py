@@ -7,6 +7,11 @@ import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import cnmaps
 import pandas as pd  # 导入pandas库
+import vector_layer
+import contour_cache
+import preview
+import derived
+import features
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -33,37 +38,46 @@ def extract_variables(dataset, level):
         raise KeyError(f"变量未找到: {e}")
     return u, v, time_var, lats, lons
 
-def save_wind_frames(lon_grid, lat_grid, u, v, time_points, output_dir, level):
-    henan = cnmaps.get_adm_maps(province='河南省')
-    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
-
-    for frame in range(len(time_points)):
+def draw_frame(ax, lons, lats, u, v, cache_file, levels, current_time, level, boundaries, extent=(110, 115, 32, 37),
+               feature_table=None):
+    # 一帧风场：脚本出图和frame_server共用，保证同一时次的图完全一致
+    ax.set_extent(list(extent), crs=ccrs.PlateCarree())  # 设置经纬度范围
+    wind_contour = contour_cache.draw_cached_contours(ax, cache_file, levels, cmap='viridis', alpha=0.6)
+    ax.figure.colorbar(wind_contour, ax=ax, orientation='horizontal', pad=0.05, label='风速 (m/s)')
+    # 按屏幕均匀间隔抽稀箭头，绘制耗时与原始网格分辨率无关
+    vector_layer.draw_vectors(ax, lons, lats, u, v, list(extent), (12, 8), scale=150)  # 调整箭头大小
+    ax.set_title(f'{level} hPa 风场 {current_time.strftime("%Y-%m-%d %H:%M")}')
+    ax.coastlines()
+    ax.add_feature(cfeature.BORDERS, linestyle=':', )
+    gl = ax.gridlines(draw_labels=False)
+    gl.top_labels = False
+    gl.right_labels = False
+    gl.xlabel_style = {"size": 10}
+    gl.ylabel_style = {"size": 10}
+    ax.set_xlabel('经度')
+    ax.set_ylabel('纬度')
+
+    # 添加河南省和郑州市边界
+    cnmaps.draw_maps(boundaries['henan'], ax=ax, linewidth=1.0, color='black')
+    cnmaps.draw_maps(boundaries['zhengzhou'], ax=ax, linewidth=1.0, color='red')
+    # 叠加features.py识别的急流核和低涡
+    features.draw_features(ax, feature_table, current_time)
+
+def save_wind_frames(lon_grid, lat_grid, u, v, time_points, output_dir, level, frames=None, feature_table=None):
+    boundaries = {'henan': cnmaps.get_adm_maps(province='河南省'), 'zhengzhou': cnmaps.get_adm_maps(city='郑州市')}
+
+    # 计算风速，固定层次的等值线在工作进程中预先生成并缓存
+    wind_speed = derived.evaluate('wind_speed', u=u, v=v)
+    levels = contour_cache.contour_levels(wind_speed)
+    frames = preview.selected_frames(len(time_points), frames)
+    contour_files = dict(zip(frames, contour_cache.precompute_contours(lon_grid, lat_grid, wind_speed[frames], levels)))
+
+    for frame in frames:
         current_time = pd.to_datetime(time_points[frame])
-        u_frame = u[frame, :, :]  # u-风分量
-        v_frame = v[frame, :, :]  # v-风分量
-
-        # 计算风速
-        wind_speed = np.sqrt(u_frame**2 + v_frame**2)
 
         fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
-        ax.set_extent([110, 115, 32, 37], crs=ccrs.PlateCarree())  # 设置经纬度范围
-        wind_contour = ax.contourf(lon_grid, lat_grid, wind_speed, cmap='viridis', alpha=0.6, transform=ccrs.PlateCarree())
-        plt.colorbar(wind_contour, ax=ax, orientation='horizontal', pad=0.05, label='风速 (m/s)')
-        ax.quiver(lon_grid, lat_grid, u_frame, v_frame, transform=ccrs.PlateCarree(), scale=150)  # 调整箭头大小
-        ax.set_title(f'{level} hPa 风场 {current_time.strftime("%Y-%m-%d %H:%M")}')
-        ax.coastlines()
-        ax.add_feature(cfeature.BORDERS, linestyle=':', )
-        gl = ax.gridlines(draw_labels=False)
-        gl.top_labels = False
-        gl.right_labels = False
-        gl.xlabel_style = {"size": 10}
-        gl.ylabel_style = {"size": 10}
-        ax.set_xlabel('经度')
-        ax.set_ylabel('纬度')
-
-        # 添加河南省和郑州市边界
-        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
-        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+        draw_frame(ax, lon_grid[0, :], lat_grid[:, 0], u[frame, :, :], v[frame, :, :], contour_files[frame], levels,
+                   current_time, level, boundaries, feature_table=feature_table)
 
         # 保存图像
         output_file = os.path.join(output_dir, f'frame_{frame:03d}.png')
@@ -91,6 +105,11 @@ def main():
     wind_500_output_file = os.path.join(wind_500_output_dir, '500hpa_wind_animation.gif')
     wind_700_output_file = os.path.join(wind_700_output_dir, '700hpa_wind_animation.gif')
     wind_850_output_file = os.path.join(wind_850_output_dir, '850hpa_wind_animation.gif')
+    # 出图模式：'preview'只生成所有时次的缩略总览图；'full'出完整质量的帧，promote_frames指定只升级部分帧(None为全部)
+    render_mode = 'full'
+    promote_frames = None
+    # features.py输出的特征表，给出时在风场图上叠加急流核和低涡
+    feature_file = None
 
     os.makedirs(wind_500_output_dir, exist_ok=True)
     os.makedirs(wind_700_output_dir, exist_ok=True)
@@ -105,9 +124,18 @@ def main():
     # 使用pandas处理时间变量
     time_points = pd.to_datetime(time_var)
 
-    save_wind_frames(lon_grid, lat_grid, u500, v500, time_points, wind_500_output_dir, level='500')
-    save_wind_frames(lon_grid, lat_grid, u700, v700, time_points, wind_700_output_dir, level='700')
-    save_wind_frames(lon_grid, lat_grid, u850, v850, time_points, wind_850_output_dir, level='850')
+    if render_mode == 'preview':
+        for u, v, output_dir, level in [(u500, v500, wind_500_output_dir, '500'), (u700, v700, wind_700_output_dir, '700'), (u850, v850, wind_850_output_dir, '850')]:
+            wind_speed = derived.evaluate('wind_speed', u=u, v=v)
+            preview.contact_sheet(lon_grid, lat_grid, wind_speed, time_points, contour_cache.contour_levels(wind_speed), 'viridis',
+                                  f'{level} hPa 风速', '风速 (m/s)', os.path.join(output_dir, f'{level}hpa_wind_preview.png'))
+        dataset.close()
+        return
+
+    feature_table = features.load_features(feature_file) if feature_file is not None else None
+    save_wind_frames(lon_grid, lat_grid, u500, v500, time_points, wind_500_output_dir, level='500', frames=promote_frames)
+    save_wind_frames(lon_grid, lat_grid, u700, v700, time_points, wind_700_output_dir, level='700', frames=promote_frames, feature_table=feature_table)
+    save_wind_frames(lon_grid, lat_grid, u850, v850, time_points, wind_850_output_dir, level='850', frames=promote_frames, feature_table=feature_table)
     create_animation_from_images(wind_500_output_dir, wind_500_output_file)
     create_animation_from_images(wind_700_output_dir, wind_700_output_file)
     create_animation_from_images(wind_850_output_dir, wind_850_output_file)
@@ -6,6 +6,9 @@ import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import cnmaps
 import pandas as pd  # 导入pandas库
+import climatology
+import contour_cache
+import subtropical_high
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -23,25 +26,33 @@ def load_dataset(file_path):
 
 def extract_variable(dataset, level):
     try:
-        hgt = dataset.sel(pressure_level=level).variables['z'][:]  # 指定层次的高度场
+        hgt = dataset.sel(pressure_level=level).variables['z'][:]  # 指定层次的位势 (m^2/s^2)
+        time_var = dataset.variables['valid_time'][:]  # 时间变量
         lats = dataset.variables['latitude'][:]
         lons = dataset.variables['longitude'][:]
     except KeyError as e:
         raise KeyError(f"变量未找到: {e}")
-    return hgt, lats, lons
+    return hgt, time_var, lats, lons
 
-def plot_height_field(lon_grid, lat_grid, hgt, output_file, level):
-    henan = cnmaps.get_adm_maps(province='河南省')
-    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+def height_levels(hgt, anomaly=False):
+    # 距平模式：以0为中心的对称色标；否则取全场范围的固定层次
+    if anomaly:
+        bound = np.nanmax(np.abs(hgt))
+        return np.linspace(-bound, bound, 21)
+    return contour_cache.contour_levels(hgt)
 
-    # 计算时间平均高度场
-    hgt_mean = hgt.mean(axis=0)
-
-    fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
-    ax.set_extent([110, 115, 32, 37], crs=ccrs.PlateCarree())  # 设置经纬度范围
-    height_contour = ax.contourf(lon_grid, lat_grid, hgt_mean, cmap='viridis', alpha=0.6, transform=ccrs.PlateCarree())
-    plt.colorbar(height_contour, ax=ax, orientation='horizontal', pad=0.05, label='高度 (m)')
-    ax.set_title(f'{level} hPa 高度场')
+def draw_frame(ax, cache_file, levels, level, boundaries, current_time=None, anomaly=False, extent=(110, 115, 32, 37)):
+    # 高度场一幅图：时间平均图和frame_server的逐时图共用；current_time为None时标题不带时间
+    ax.set_extent(list(extent), crs=ccrs.PlateCarree())  # 设置经纬度范围
+    time_text = f' {current_time.strftime("%Y-%m-%d %H:%M")}' if current_time is not None else ''
+    if anomaly:
+        height_contour = contour_cache.draw_cached_contours(ax, cache_file, levels, cmap='RdBu_r', alpha=0.6)
+        ax.figure.colorbar(height_contour, ax=ax, orientation='horizontal', pad=0.05, label='位势高度距平 (gpm)')
+        ax.set_title(f'{level} hPa 高度场距平{time_text}')
+    else:
+        height_contour = contour_cache.draw_cached_contours(ax, cache_file, levels, cmap='viridis', alpha=0.6)
+        ax.figure.colorbar(height_contour, ax=ax, orientation='horizontal', pad=0.05, label='位势高度 (gpm)')
+        ax.set_title(f'{level} hPa 高度场{time_text}')
     ax.set_xlabel('经度')
     ax.set_ylabel('纬度')
     ax.coastlines()
@@ -49,8 +60,19 @@ def plot_height_field(lon_grid, lat_grid, hgt, output_file, level):
     ax.gridlines(draw_labels=True)
 
     # 添加河南省和郑州市边界
-    cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
-    cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+    cnmaps.draw_maps(boundaries['henan'], ax=ax, linewidth=1.0, color='black')
+    cnmaps.draw_maps(boundaries['zhengzhou'], ax=ax, linewidth=1.0, color='red')
+
+def plot_height_field(lon_grid, lat_grid, hgt, output_file, level, anomaly=False):
+    boundaries = {'henan': cnmaps.get_adm_maps(province='河南省'), 'zhengzhou': cnmaps.get_adm_maps(city='郑州市')}
+
+    # 计算时间平均高度场
+    hgt_mean = np.asarray(hgt.mean(axis=0))
+    levels = height_levels(hgt_mean, anomaly)
+    cache_file = contour_cache.contour_file(lon_grid, lat_grid, hgt_mean, levels)
+
+    fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+    draw_frame(ax, cache_file, levels, level, boundaries, anomaly=anomaly)
 
     # 保存图像
     plt.savefig(output_file)
@@ -59,12 +81,21 @@ def plot_height_field(lon_grid, lat_grid, hgt, output_file, level):
 def main():
     file_path = r"D:\Git desktop\dongliqixiang\ERA5 hourly data on pressure levels from 1940 to present.nc"
     output_file = r"D:\新建文件夹\500hpa_height_field.png"
+    # 距平模式：指定climatology.py生成的逐日气候态文件，设为None则绘制原始场
+    climatology_file = None
 
     dataset = load_dataset(file_path)
-    hgt, lats, lons = extract_variable(dataset, level=500)
+    hgt, time_var, lats, lons = extract_variable(dataset, level=500)
     lon_grid, lat_grid = np.meshgrid(lons, lats)
 
-    plot_height_field(lon_grid, lat_grid, hgt, output_file, level='500')
+    if climatology_file is not None:
+        clim = climatology.load_climatology(climatology_file)
+        hgt = climatology.anomaly(hgt, pd.to_datetime(time_var), clim, lats, lons)
+        output_file = output_file.replace('.png', '_anomaly.png')
+    # 位势换算为位势高度
+    hgt = subtropical_high.geopotential_height(hgt)
+
+    plot_height_field(lon_grid, lat_grid, hgt, output_file, level='500', anomaly=climatology_file is not None)
 
     dataset.close()
     print(f"Saved 500 hPa height field as {output_file}")
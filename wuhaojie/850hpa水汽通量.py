@@ -6,6 +6,7 @@ import os
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import cnmaps
+import vector_layer
 import pandas as pd
 
 # 设置matplotlib支持中文显示
@@ -44,7 +45,8 @@ def save_frames(lon_grid, lat_grid, tcwv, vimd, time_points, output_dir):
 
         fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
         ax.set_extent([110, 115, 32, 37], crs=ccrs.PlateCarree())  # 设置经纬度范围
-        ax.quiver(lon_grid, lat_grid, u, v, transform=ccrs.PlateCarree())
+        # 按屏幕均匀间隔抽稀箭头，绘制耗时与原始网格分辨率无关
+        vector_layer.draw_vectors(ax, lon_grid[0, :], lat_grid[:, 0], u, v, [110, 115, 32, 37], (12, 8))
         ax.set_title(f'850 hPa 水汽通量矢量场 {current_time.strftime("%Y-%m-%d %H:%M")}')
         ax.set_xlabel('经度')
         ax.set_ylabel('纬度')
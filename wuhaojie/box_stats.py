@@ -0,0 +1,216 @@
+import netCDF4 as nc
+import numpy as np
+import pandas as pd
+import os
+import hashlib
+import json
+import era5_catalog
+
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+# 积分图中的量：源变量、换算系数、单位。水汽通量辐合取垂直积分水汽通量散度的相反数
+QUANTITIES = {
+    'tp': {'source': 'tp', 'scale': 1000.0, 'units': 'mm', 'long_name': '降水量'},
+    'mfc': {'source': 'vimd', 'scale': -1.0, 'units': 'kg m**-2', 'long_name': '水汽通量辐合'},
+    'tcwv': {'source': 'tcwv', 'scale': 1.0, 'units': 'kg m**-2', 'long_name': '整层水汽总量'},
+}
+
+def area_weights(lats, lons):
+    # cos(纬度)面积权重，形状(纬度, 经度)
+    return np.repeat(np.cos(np.radians(np.asarray(lats, dtype=np.float64)))[:, np.newaxis], len(lons), axis=1)
+
+def summed_area(block):
+    # 每个时次的二维积分图，前面各补一行一列0，使任意框的和只需四个角
+    table = np.zeros(block.shape[:-2] + (block.shape[-2] + 1, block.shape[-1] + 1))
+    np.cumsum(block, axis=-2, out=table[..., 1:, 1:])
+    np.cumsum(table[..., 1:, 1:], axis=-1, out=table[..., 1:, 1:])
+    return table
+
+def build_tables(catalog, quantities=('tp', 'mfc', 'tcwv'), start=None, end=None, chunk_hours=744):
+    # 逐块读取，每个时次做二维积分图后再沿时间累加：table[t]为前t个时次、左上角到(y, x)的加权和。
+    # ERA5单层场无缺测，缺测值按0计入
+    entry = era5_catalog.select_files(catalog, QUANTITIES[quantities[0]]['source'], start, end)[0]
+    dataset = era5_catalog.load_dataset(entry['path'])
+    lats = dataset.variables['latitude'][:].astype(np.float64)
+    lons = dataset.variables['longitude'][:].astype(np.float64)
+    dataset.close()
+    weights = area_weights(lats, lons)
+
+    tables = {}
+    times = None
+    for name in quantities:
+        spec = QUANTITIES[name]
+        blocks = [np.zeros((1, lats.size + 1, lons.size + 1))]
+        block_times = []
+        carry = blocks[0][0]
+        for chunk_times, block in era5_catalog.iter_variable_chunks(catalog, spec['source'], start, end,
+                                                                    chunk_hours=chunk_hours):
+            block = np.nan_to_num(block, nan=0.0)
+            block *= spec['scale'] * weights
+            table = summed_area(block)
+            np.cumsum(table, axis=0, out=table)
+            table += carry
+            carry = table[-1]
+            blocks.append(table)
+            block_times.append(chunk_times)
+        tables[name] = np.concatenate(blocks)
+        if times is None:
+            times = pd.DatetimeIndex(np.concatenate([t.values for t in block_times]))
+        elif tables[name].shape[0] != times.size + 1:
+            raise ValueError(f"{name} 与其他变量的时次数不一致")
+
+    return {
+        'times': times,
+        'latitude': lats,
+        'longitude': lons,
+        'weights': summed_area(weights),
+        'tables': tables,
+    }
+
+def save_tables(tables, output_file):
+    dataset = nc.Dataset(output_file, 'w')
+    try:
+        dataset.createDimension('time', tables['times'].size)
+        dataset.createDimension('step', tables['times'].size + 1)
+        dataset.createDimension('latitude', tables['latitude'].size)
+        dataset.createDimension('longitude', tables['longitude'].size)
+        dataset.createDimension('row', tables['latitude'].size + 1)
+        dataset.createDimension('col', tables['longitude'].size + 1)
+        time_var = dataset.createVariable('time', 'f8', ('time',))
+        time_var.units = 'hours since 1970-01-01 00:00:00'
+        time_var.calendar = 'standard'
+        time_var[:] = nc.date2num(tables['times'].to_pydatetime(), time_var.units, 'standard')
+        dataset.createVariable('latitude', 'f4', ('latitude',))[:] = tables['latitude']
+        dataset.createVariable('longitude', 'f4', ('longitude',))[:] = tables['longitude']
+        dataset.createVariable('weights', 'f8', ('row', 'col'))[:] = tables['weights']
+        for name, table in tables['tables'].items():
+            var = dataset.createVariable(name, 'f8', ('step', 'row', 'col'), zlib=True, complevel=4)
+            var[:] = table
+            var.units = QUANTITIES[name]['units']
+    finally:
+        dataset.close()
+
+def load_tables(file_path):
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        tables = {
+            'times': era5_catalog.read_times(dataset),
+            'latitude': dataset.variables['latitude'][:].astype(np.float64),
+            'longitude': dataset.variables['longitude'][:].astype(np.float64),
+            'weights': np.asarray(dataset.variables['weights'][:], dtype=np.float64),
+            'tables': {name: np.asarray(dataset.variables[name][:], dtype=np.float64)
+                       for name in QUANTITIES if name in dataset.variables},
+        }
+    finally:
+        dataset.close()
+    return tables
+
+def cache_file_name(catalog, quantities, start=None, end=None):
+    # 缓存键：参与计算的文件(路径、大小、修改时间)、变量及时间范围
+    entries = era5_catalog.select_files(catalog, QUANTITIES[quantities[0]]['source'], start, end)
+    signature = json.dumps([[e['path'], e['size'], e['mtime']] for e in entries] + list(quantities) + [str(start), str(end)])
+    digest = hashlib.sha1(signature.encode('utf-8')).hexdigest()[:12]
+    return f'sat_{"_".join(quantities)}_{digest}.nc'
+
+def get_tables(catalog, quantities=('tp', 'mfc', 'tcwv'), start=None, end=None, cache_dir='box_stats'):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, cache_file_name(catalog, quantities, start, end))
+    if os.path.exists(cache_file):
+        return load_tables(cache_file)
+    tables = build_tables(catalog, quantities, start, end)
+    save_tables(tables, cache_file)
+    print(f"Saved summed-area tables as {cache_file}")
+    return tables
+
+def coordinate_bounds(coords, lower, upper):
+    # 坐标落在[lower, upper]内的格点行(列)号范围[i0, i1)，坐标升序降序均可，lower/upper可为数组
+    coords = np.asarray(coords, dtype=np.float64)
+    lower = np.asarray(lower, dtype=np.float64)
+    upper = np.asarray(upper, dtype=np.float64)
+    if coords[0] > coords[-1]:
+        n = coords.size
+        ascending = coords[::-1]
+        return n - np.searchsorted(ascending, upper, side='right'), n - np.searchsorted(ascending, lower, side='left')
+    return np.searchsorted(coords, lower, side='left'), np.searchsorted(coords, upper, side='right')
+
+def box_index(tables, lon_min, lon_max, lat_min, lat_max, start, end):
+    y0, y1 = coordinate_bounds(tables['latitude'], lat_min, lat_max)
+    x0, x1 = coordinate_bounds(tables['longitude'], lon_min, lon_max)
+    times = tables['times'].values
+    t0 = np.searchsorted(times, pd.DatetimeIndex(np.atleast_1d(start)).values, side='left')
+    t1 = np.searchsorted(times, pd.DatetimeIndex(np.atleast_1d(end)).values, side='right')
+    return t0, t1, y0, y1, x0, x1
+
+def box_sum(table, y0, y1, x0, x1, *leading):
+    # 四角相减；leading为前导维(如时间)的索引，与框数组逐元素配对，只取角点不展开整幅表
+    return table[leading + (y1, x1)] - table[leading + (y0, x1)] - table[leading + (y1, x0)] + table[leading + (y0, x0)]
+
+def box_mean(tables, name, lon_min, lon_max, lat_min, lat_max, start, end):
+    # 任意框、任意时段的面积加权时空平均(每小时)；所有参数可为等长数组，一次查表返回全部结果
+    t0, t1, y0, y1, x0, x1 = box_index(tables, lon_min, lon_max, lat_min, lat_max, start, end)
+    table = tables['tables'][name]
+    total = box_sum(table, y0, y1, x0, x1, t1) - box_sum(table, y0, y1, x0, x1, t0)
+    weight = box_sum(tables['weights'], y0, y1, x0, x1) * (t1 - t0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(weight > 0, total / weight, np.nan)
+
+def sweep(tables, lon_centers, lat_centers, widths, heights, starts, durations, baseline=None):
+    # 敏感性试验：区域中心、宽度、高度、起始时间、时长的全部组合一次查表。
+    # baseline给出(lon_min, lon_max, lat_min, lat_max, start, end)时，同时给出相对基准的变化率。
+    # 时段超出记录范围或含缺测时次时complete为False，covered_hours为实际参与平均的时次数
+    grids = np.meshgrid(np.asarray(lon_centers, dtype=np.float64), np.asarray(lat_centers, dtype=np.float64),
+                        np.asarray(widths, dtype=np.float64), np.asarray(heights, dtype=np.float64),
+                        np.arange(len(starts)), np.asarray(durations, dtype=np.float64), indexing='ij')
+    lon_c, lat_c, width, height, start_index, duration = [g.ravel() for g in grids]
+    start = pd.DatetimeIndex(starts)[start_index]
+    end = start + pd.to_timedelta(duration - 1, unit='h')
+    result = pd.DataFrame({
+        'lon_min': lon_c - width / 2,
+        'lon_max': lon_c + width / 2,
+        'lat_min': lat_c - height / 2,
+        'lat_max': lat_c + height / 2,
+        'start': start,
+        'end': end,
+        'hours': duration,
+    })
+    t0, t1 = box_index(tables, result['lon_min'], result['lon_max'], result['lat_min'], result['lat_max'],
+                       result['start'], result['end'])[:2]
+    result['covered_hours'] = t1 - t0
+    result['complete'] = result['covered_hours'] == duration
+    for name in tables['tables']:
+        mean = box_mean(tables, name, result['lon_min'], result['lon_max'], result['lat_min'], result['lat_max'],
+                        result['start'], result['end'])
+        result[name] = mean
+        if name == 'tp':
+            result['tp_total'] = mean * result['covered_hours']  # 时段累计降水的区域平均 (mm)
+        if baseline is not None:
+            reference = box_mean(tables, name, *baseline)[0]
+            result[f'{name}_change'] = (mean - reference) / abs(reference) if reference != 0 else np.nan
+    return result
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\single levels.nc"
+    output_dir = r"D:\新建文件夹\box_stats"
+    # 河南省范围与暴雨时段作为基准
+    baseline = (110.36, 116.64, 31.38, 36.37, '2021-07-17 00:00', '2021-07-18 23:00')
+
+    os.makedirs(output_dir, exist_ok=True)
+    data_dir = os.path.dirname(file_path) or '.'
+    catalog = era5_catalog.build_catalog(data_dir, pattern=os.path.basename(file_path))
+    tables = get_tables(catalog, cache_dir=output_dir)
+
+    result = sweep(tables,
+                   lon_centers=np.arange(112.0, 115.01, 0.25),
+                   lat_centers=np.arange(33.0, 35.51, 0.25),
+                   widths=[2.0, 3.0, 4.0, 5.0, 6.0],
+                   heights=[2.0, 3.0, 4.0, 5.0],
+                   starts=pd.date_range('2021-07-16', '2021-07-19', freq='6h'),
+                   durations=[24, 48, 72],
+                   baseline=baseline)
+    output_file = os.path.join(output_dir, 'sensitivity.csv')
+    result.to_csv(output_file, index=False, encoding='utf-8-sig')
+    print(f"Saved {len(result)} box/period combinations as {output_file}")
+    print(result[result['complete']].sort_values('tp_total', ascending=False).head(10))
+
+if __name__ == "__main__":
+    main()
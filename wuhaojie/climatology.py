@@ -0,0 +1,184 @@
+import netCDF4 as nc
+import numpy as np
+import pandas as pd
+import os
+import hashlib
+import json
+import era5_catalog
+
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+# 气候态分组方式：逐时(hour of day)与逐日(day of year)
+N_BINS = {'hour': 24, 'doy': 366}
+
+def climatology_keys(times, kind):
+    times = pd.DatetimeIndex(times)
+    if kind == 'hour':
+        return times.hour.to_numpy()
+    if kind == 'doy':
+        # 平年3月1日以后的日序加1，使同一日历日在平年和闰年落在同一组
+        doy = times.dayofyear.to_numpy() - 1
+        shift = (~times.is_leap_year) & (times.month > 2)
+        return doy + shift.astype(int)
+    raise ValueError(f"不支持的气候态类型: {kind}")
+
+def empty_state(kind, shape):
+    n_bins = N_BINS[kind]
+    return {
+        'count': np.zeros(n_bins, dtype=np.int64),
+        'mean': np.zeros((n_bins,) + shape),
+        'm2': np.zeros((n_bins,) + shape),
+    }
+
+def update_state(state, block, keys):
+    # 分组Welford：块内两遍法求各组均值和离差平方和，再用Chan公式与已有统计量合并
+    groups, inverse = np.unique(keys, return_inverse=True)
+    flat = block.reshape(block.shape[0], -1)
+    onehot = np.zeros((groups.size, flat.shape[0]))
+    onehot[inverse, np.arange(flat.shape[0])] = 1.0
+
+    n_b = onehot.sum(axis=1)
+    mean_b = (onehot @ flat) / n_b[:, None]
+    m2_b = onehot @ (flat - mean_b[inverse]) ** 2
+
+    n_a = state['count'][groups].astype(np.float64)
+    mean_a = state['mean'][groups].reshape(groups.size, -1)
+    m2_a = state['m2'][groups].reshape(groups.size, -1)
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)[:, None]
+    m2 = m2_a + m2_b + delta ** 2 * (n_a * n_b / n)[:, None]
+
+    state['count'][groups] = n.astype(np.int64)
+    state['mean'][groups] = mean.reshape((groups.size,) + block.shape[1:])
+    state['m2'][groups] = m2.reshape((groups.size,) + block.shape[1:])
+    return state
+
+def finalize_state(state):
+    count = state['count'].reshape((-1,) + (1,) * (state['m2'].ndim - 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = state['m2'] / np.where(count > 1, count - 1, np.nan)
+    mean = np.where(count > 0, state['mean'], np.nan)
+    return mean, variance
+
+def build_climatology(catalog, variable, kind='doy', level=None, start=None, end=None, chunk_hours=744):
+    # 一次分块扫描多年文件，内存只占一个时间块和气候态本身
+    entry = era5_catalog.select_files(catalog, variable, start, end)[0]
+    dataset = era5_catalog.load_dataset(entry['path'])
+    lats = dataset.variables['latitude'][:].astype(np.float64)
+    lons = dataset.variables['longitude'][:].astype(np.float64)
+    dataset.close()
+
+    state = empty_state(kind, (lats.size, lons.size))
+    first_time = last_time = None
+    for times, block in era5_catalog.iter_variable_chunks(catalog, variable, start, end, level=level,
+                                                          chunk_hours=chunk_hours):
+        update_state(state, block, climatology_keys(times, kind))
+        first_time = times[0] if first_time is None else first_time
+        last_time = times[-1]
+
+    mean, variance = finalize_state(state)
+    return {
+        'variable': variable,
+        'level': level,
+        'kind': kind,
+        'start': str(first_time),
+        'end': str(last_time),
+        'latitude': lats,
+        'longitude': lons,
+        'count': state['count'],
+        'mean': mean,
+        'variance': variance,
+    }
+
+def save_climatology(clim, output_file):
+    # 以float32写成紧凑的NetCDF派生文件
+    dataset = nc.Dataset(output_file, 'w')
+    try:
+        dataset.createDimension('bin', clim['count'].size)
+        dataset.createDimension('latitude', clim['latitude'].size)
+        dataset.createDimension('longitude', clim['longitude'].size)
+        dataset.createVariable('latitude', 'f4', ('latitude',))[:] = clim['latitude']
+        dataset.createVariable('longitude', 'f4', ('longitude',))[:] = clim['longitude']
+        dataset.createVariable('count', 'i4', ('bin',))[:] = clim['count']
+        for name in ('mean', 'variance'):
+            var = dataset.createVariable(name, 'f4', ('bin', 'latitude', 'longitude'), zlib=True, complevel=4)
+            var[:] = clim[name]
+        dataset.variable = clim['variable']
+        dataset.level = 'none' if clim['level'] is None else float(clim['level'])
+        dataset.kind = clim['kind']
+        dataset.start = clim['start']
+        dataset.end = clim['end']
+    finally:
+        dataset.close()
+
+def load_climatology(file_path):
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        clim = {
+            'variable': dataset.variable,
+            'level': None if dataset.level == 'none' else float(dataset.level),
+            'kind': dataset.kind,
+            'start': dataset.start,
+            'end': dataset.end,
+            'latitude': dataset.variables['latitude'][:].astype(np.float64),
+            'longitude': dataset.variables['longitude'][:].astype(np.float64),
+            'count': dataset.variables['count'][:],
+        }
+        for name in ('mean', 'variance'):
+            clim[name] = np.ma.filled(dataset.variables[name][:].astype(np.float64), np.nan)
+    finally:
+        dataset.close()
+    return clim
+
+def cache_file_name(catalog, variable, kind, level=None, start=None, end=None):
+    # 缓存键：变量/层次/分组方式 + 参与计算的文件(路径、大小、修改时间)及时间范围
+    entries = era5_catalog.select_files(catalog, variable, start, end)
+    signature = json.dumps([[e['path'], e['size'], e['mtime']] for e in entries] + [str(start), str(end)])
+    digest = hashlib.sha1(signature.encode('utf-8')).hexdigest()[:12]
+    level_tag = f'_{int(level)}hPa' if level is not None else ''
+    return f'clim_{variable}{level_tag}_{kind}_{digest}.nc'
+
+def get_climatology(catalog, variable, kind='doy', level=None, start=None, end=None, cache_dir='climatology'):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, cache_file_name(catalog, variable, kind, level, start, end))
+    if os.path.exists(cache_file):
+        return load_climatology(cache_file)
+    clim = build_climatology(catalog, variable, kind, level, start, end)
+    save_climatology(clim, cache_file)
+    print(f"Saved {variable} {kind} climatology as {cache_file}")
+    return clim
+
+def coordinate_index(source, target):
+    # 在气候态网格中找到产品网格各点的位置
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    index = np.abs(source[None, :] - target[:, None]).argmin(axis=1)
+    if not np.allclose(source[index], target, atol=1e-3):
+        raise ValueError("产品网格与气候态网格不一致")
+    return index
+
+def anomaly(data, times, clim, lats, lons, standardize=False):
+    # data: (time, lat, lon)，返回相对于对应时刻气候态的距平(可选标准化距平)
+    keys = climatology_keys(times, clim['kind'])
+    groups, position = np.unique(keys, return_inverse=True)
+    lat_index = coordinate_index(clim['latitude'], lats)
+    lon_index = coordinate_index(clim['longitude'], lons)
+    mean = clim['mean'][np.ix_(groups, lat_index, lon_index)]
+    result = np.asarray(data, dtype=np.float64) - mean[position]
+    if standardize:
+        variance = clim['variance'][np.ix_(groups, lat_index, lon_index)]
+        result /= np.sqrt(variance[position])
+    return result
+
+def main():
+    data_dir = r"D:\pycharm\dongliqixiangxue\era5"
+    cache_dir = r"D:\pycharm\dongliqixiangxue\climatology"
+
+    catalog = era5_catalog.build_catalog(data_dir, catalog_file=os.path.join(data_dir, 'era5_catalog.json'))
+    get_climatology(catalog, 'z', kind='doy', level=500, cache_dir=cache_dir)
+    get_climatology(catalog, 'r', kind='doy', level=500, cache_dir=cache_dir)
+    get_climatology(catalog, 'tp', kind='hour', cache_dir=cache_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import numpy as np
+import os
+import hashlib
+import threading
+import contourpy
+import matplotlib.pyplot as plt
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import BoundaryNorm
+from matplotlib.collections import PathCollection
+from matplotlib.path import Path
+from matplotlib.ticker import MaxNLocator
+import cartopy.crs as ccrs
+import shared_data
+
+# 默认缓存目录，与产品输出目录分开，换配色/标题/尺寸重新出图时直接复用
+CACHE_DIR = 'contour_cache'
+
+def contour_levels(data, n_levels=10):
+    # 与contourf默认方式一致的固定层次，但取全时段的范围，保证各帧一致
+    return MaxNLocator(n_levels + 1).tick_values(np.nanmin(data), np.nanmax(data))
+
+def frame_key(x, y, z, levels):
+    digest = hashlib.sha1()
+    for array in (x, y, z, levels):
+        digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def compute_polygons(x, y, z, levels):
+    # 每个层次区间的填色多边形，格式为(顶点, 路径码)，无多边形时为None
+    generator = contourpy.contour_generator(x, y, np.ma.masked_invalid(z),
+                                            fill_type=contourpy.FillType.ChunkCombinedCode)
+    bands = []
+    for lower, upper in zip(levels[:-1], levels[1:]):
+        points, codes = generator.filled(lower, upper)
+        bands.append(None if points[0] is None else (points[0], codes[0]))
+    return bands
+
+def save_polygons(bands, cache_file):
+    arrays = {}
+    for i, band in enumerate(bands):
+        if band is not None:
+            arrays[f'points_{i}'] = band[0].astype(np.float32)
+            arrays[f'codes_{i}'] = band[1]
+    # 先写临时文件再改名，避免并行时读到半个文件；临时文件名带进程和线程号，同一帧可被并发写入
+    temp_file = f'{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+    np.savez_compressed(temp_file, n_bands=len(bands), **arrays)
+    os.replace(temp_file, cache_file)
+
+def load_polygons(cache_file):
+    with np.load(cache_file) as data:
+        return [(data[f'points_{i}'], data[f'codes_{i}']) if f'points_{i}' in data else None
+                for i in range(int(data['n_bands']))]
+
+def contour_file(x, y, z, levels, cache_dir=CACHE_DIR):
+    # 单帧：生成多边形并写入缓存，已存在则跳过，返回缓存文件。逐帧按需出图(如frame_server)时直接调用
+    os.makedirs(cache_dir, exist_ok=True)
+    levels = np.asarray(levels, dtype=np.float64)
+    cache_file = os.path.join(cache_dir, f'{frame_key(x, y, z, levels)}.npz')
+    if not os.path.exists(cache_file):
+        save_polygons(compute_polygons(x, y, z, levels), cache_file)
+    return cache_file
+
+def _contour_frame(frame, levels, cache_dir):
+    # 工作进程：从共享内存取出一帧，生成多边形并写入缓存
+    return contour_file(shared_data.get('x'), shared_data.get('y'), shared_data.get('frames')[frame], levels, cache_dir)
+
+def precompute_contours(x, y, frames, levels, cache_dir=CACHE_DIR, workers=None):
+    # frames: (time, lat, lon)，所有帧在工作进程中生成等值线，返回每帧的缓存文件；
+    # 数据只放一份在共享内存中，不向每个工作进程序列化传送
+    os.makedirs(cache_dir, exist_ok=True)
+    levels = np.asarray(levels, dtype=np.float64)
+    with shared_data.SharedArrayBroker() as broker:
+        broker.put('x', x, dtype=np.float64)
+        broker.put('y', y, dtype=np.float64)
+        n_frames = broker.put('frames', frames, dtype=np.float64).shape[0]
+        with broker.pool(workers) as executor:
+            futures = [executor.submit(_contour_frame, frame, levels, cache_dir) for frame in range(n_frames)]
+            return [future.result() for future in futures]
+
+def draw_cached_contours(ax, cache_file, levels, cmap='viridis', alpha=None, transform=ccrs.PlateCarree()):
+    # 把缓存的多边形作为预先构建的路径集合加入坐标轴，返回可用于colorbar的对象
+    cmap = plt.get_cmap(cmap)
+    norm = BoundaryNorm(levels, cmap.N)
+    centers = 0.5 * (np.asarray(levels[:-1]) + np.asarray(levels[1:]))
+    for band, center in zip(load_polygons(cache_file), centers):
+        if band is None:
+            continue
+        collection = PathCollection([Path(band[0], band[1])], facecolors=[cmap(norm(center))],
+                                    edgecolors='none', alpha=alpha, transform=transform)
+        ax.add_collection(collection)
+    mappable = ScalarMappable(norm=norm, cmap=cmap)
+    mappable.set_array([])
+    return mappable
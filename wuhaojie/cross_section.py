@@ -0,0 +1,215 @@
+import xarray as xr
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import os
+import pandas as pd
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+EARTH_RADIUS = 6371.0  # 地球半径 (km)
+
+# 郑州市的经纬度
+ZHENGZHOU = (113.65, 34.76)
+
+# 已构建的剖面，键为(网格, 折线, 采样点数)，同一网格上的同一剖面只算一次权重
+_section_cache = {}
+
+def load_dataset(file_path):
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件未找到: {file_path}")
+    try:
+        dataset = xr.open_dataset(file_path)
+    except OSError as e:
+        raise RuntimeError(f"无法打开文件: {e}")
+    return dataset
+
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.deg2rad, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+def sample_path(points, n_points):
+    # 按距离在折线上等间距取样，返回采样点经纬度和沿线距离 (km)
+    points = np.asarray(points, dtype=np.float64)
+    segment = haversine(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    vertex_distance = np.concatenate(([0.0], np.cumsum(segment)))
+    distance = np.linspace(0.0, vertex_distance[-1], n_points)
+    lon = np.interp(distance, vertex_distance, points[:, 0])
+    lat = np.interp(distance, vertex_distance, points[:, 1])
+    return lon, lat, distance
+
+def path_direction(lon, lat):
+    # 采样点处沿剖面方向的单位向量(东分量, 北分量)
+    dx = np.gradient(lon) * np.cos(np.deg2rad(lat))
+    dy = np.gradient(lat)
+    norm = np.hypot(dx, dy)
+    return dx / norm, dy / norm
+
+def bilinear_weights(lats, lons, lon, lat):
+    # 每个采样点周围4个格点的一维展开下标和双线性权重，形状均为(4, n)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if np.any(lat < lats.min()) or np.any(lat > lats.max()) or np.any(lon < lons.min()) or np.any(lon > lons.max()):
+        raise ValueError("剖面超出数据的经纬度范围")
+
+    # ERA5纬度为降序，统一在升序坐标上定位
+    lat_order = np.argsort(lats)
+    lon_order = np.argsort(lons)
+    lat_sorted = lats[lat_order]
+    lon_sorted = lons[lon_order]
+    i = np.clip(np.searchsorted(lat_sorted, lat) - 1, 0, lats.size - 2)
+    j = np.clip(np.searchsorted(lon_sorted, lon) - 1, 0, lons.size - 2)
+    wy = (lat - lat_sorted[i]) / (lat_sorted[i + 1] - lat_sorted[i])
+    wx = (lon - lon_sorted[j]) / (lon_sorted[j + 1] - lon_sorted[j])
+
+    rows = np.stack([lat_order[i], lat_order[i], lat_order[i + 1], lat_order[i + 1]])
+    cols = np.stack([lon_order[j], lon_order[j + 1], lon_order[j], lon_order[j + 1]])
+    index = rows * lons.size + cols
+    weight = np.stack([(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx])
+    return index, weight
+
+def build_section(lats, lons, points, n_points=200):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    key = (lats.size, lats[0], lats[-1], lons.size, lons[0], lons[-1],
+           tuple(map(tuple, np.asarray(points, dtype=np.float64))), n_points)
+    if key in _section_cache:
+        return _section_cache[key]
+
+    lon, lat, distance = sample_path(points, n_points)
+    index, weight = bilinear_weights(lats, lons, lon, lat)
+    along_east, along_north = path_direction(lon, lat)
+    section = {
+        'lon': lon,
+        'lat': lat,
+        'distance': distance,
+        'index': index,
+        'weight': weight,
+        'along_east': along_east,
+        'along_north': along_north,
+    }
+    _section_cache[key] = section
+    return section
+
+def extract(section, field):
+    # field: (..., lat, lon)，所有时次和层次一次性聚合，返回(..., n_points)
+    field = np.asarray(field)
+    flat = field.reshape(field.shape[:-2] + (-1,))
+    return (flat[..., section['index']] * section['weight']).sum(axis=-2)
+
+def project_wind(section, u_section, v_section):
+    # 沿剖面分量与垂直剖面分量(指向剖面左侧为正)
+    along = u_section * section['along_east'] + v_section * section['along_north']
+    across = -u_section * section['along_north'] + v_section * section['along_east']
+    return along, across
+
+def extract_sections(dataset, sections, variables=('t', 'q', 'r', 'u', 'v', 'w')):
+    # 每个4D变量只读取一次(限于所有剖面的外接范围)，再对所有剖面做聚合
+    lats = dataset['latitude'].values
+    lons = dataset['longitude'].values
+    lon_all = np.concatenate([section['lon'] for section in sections.values()])
+    lat_all = np.concatenate([section['lat'] for section in sections.values()])
+    lat_keep = np.flatnonzero((lats >= lat_all.min() - 1) & (lats <= lat_all.max() + 1))
+    lon_keep = np.flatnonzero((lons >= lon_all.min() - 1) & (lons <= lon_all.max() + 1))
+    lat_slice = slice(lat_keep[0], lat_keep[-1] + 1)
+    lon_slice = slice(lon_keep[0], lon_keep[-1] + 1)
+    sub_sections = {name: build_section(lats[lat_slice], lons[lon_slice], section['points'], section['lon'].size)
+                    for name, section in sections.items()}
+
+    results = {name: {} for name in sections}
+    for variable in variables:
+        if variable not in dataset:
+            continue
+        field = dataset[variable].isel(latitude=lat_slice, longitude=lon_slice).values
+        for name, section in sub_sections.items():
+            results[name][variable] = extract(section, field)
+        del field
+
+    for name, section in sub_sections.items():
+        if 'u' in results[name] and 'v' in results[name]:
+            along, across = project_wind(section, results[name]['u'], results[name]['v'])
+            results[name]['along'] = along
+            results[name]['across'] = across
+    return results
+
+def define_section(lats, lons, points, n_points=200):
+    section = dict(build_section(lats, lons, points, n_points))
+    section['points'] = points
+    return section
+
+def save_section_frames(distance, pressure, data, time_points, output_dir, title, label, cmap):
+    # 所有帧使用相同的色标层次
+    levels = np.linspace(np.nanmin(data), np.nanmax(data), 21)
+    for frame in range(len(time_points)):
+        current_time = pd.to_datetime(time_points[frame])
+
+        fig, ax1 = plt.subplots(figsize=(10, 8))
+        contour = ax1.contourf(distance, pressure, data[frame], levels=levels, cmap=cmap, alpha=0.6)
+        plt.colorbar(contour, ax=ax1, orientation='horizontal', pad=0.05, label=label)
+        ax1.set_title(f'{title} {current_time.strftime("%Y-%m-%d %H:%M")}')
+        ax1.set_xlabel('沿剖面距离 (km)')
+        ax1.set_ylabel('气压 (hPa)')
+        ax1.invert_yaxis()  # 翻转y轴，使气压从大到小
+
+        # 保存图像
+        output_file = os.path.join(output_dir, f'frame_{frame:03d}.png')
+        plt.savefig(output_file)
+        plt.close(fig)
+
+def create_animation_from_images(output_dir, output_file):
+    fig, ax = plt.subplots(figsize=(12, 8))
+    images = []
+
+    for frame in sorted(os.listdir(output_dir)):
+        if frame.endswith('.png'):
+            img = plt.imread(os.path.join(output_dir, frame))
+            images.append([plt.imshow(img, animated=True)])
+
+    ani = animation.ArtistAnimation(fig, images, interval=200, repeat=False)
+    ani.save(output_file, writer='pillow', fps=3)
+    plt.close(fig)
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\ERA5 hourly data on pressure levels from 1940 to present.nc"
+    output_dir = r"D:\新建文件夹\cross_section"
+
+    dataset = load_dataset(file_path)
+    lats = dataset['latitude'].values
+    lons = dataset['longitude'].values
+    pressure = dataset['pressure_level'].values
+    time_points = pd.to_datetime(dataset['valid_time'].values)
+
+    # 过郑州的西南—东北向剖面和沿35°N的纬向剖面
+    sections = {
+        'sw_ne': define_section(lats, lons, [(111.0, 32.5), ZHENGZHOU, (116.0, 37.0)]),
+        'lat35': define_section(lats, lons, [(110.0, 35.0), (115.0, 35.0)]),
+    }
+    results = extract_sections(dataset, sections)
+
+    products = {
+        't': ('温度垂直剖面', '温度 (K)', 'coolwarm'),
+        'q': ('比湿垂直剖面', '比湿 (kg/kg)', 'Blues'),
+        'r': ('相对湿度垂直剖面', '相对湿度 (%)', 'viridis'),
+        'along': ('沿剖面风速', '风速 (m/s)', 'RdBu_r'),
+        'across': ('垂直剖面风速', '风速 (m/s)', 'RdBu_r'),
+        'w': ('垂直速度剖面', '垂直速度 (Pa/s)', 'RdBu_r'),
+    }
+    for name, section in sections.items():
+        for variable, (title, label, cmap) in products.items():
+            if variable not in results[name]:
+                continue
+            product_dir = os.path.join(output_dir, f'{name}_{variable}')
+            os.makedirs(product_dir, exist_ok=True)
+            save_section_frames(section['distance'], pressure, results[name][variable], time_points,
+                                product_dir, title, label, cmap)
+            create_animation_from_images(product_dir, os.path.join(product_dir, f'{name}_{variable}_animation.gif'))
+            print(f"Saved {name} {variable} cross-section animation in {product_dir}")
+
+    dataset.close()
+
+if __name__ == "__main__":
+    main()
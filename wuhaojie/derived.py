@@ -0,0 +1,195 @@
+import numpy as np
+
+# 物理常数
+P0 = 100000.0  # 参考压强 (Pa)
+RD = 287.04  # 干空气气体常数 J/(kg·K)
+CP = 1004.0  # 干空气定压比热 J/(kg·K)
+KAPPA = RD / CP
+EPSILON = 0.622  # 水汽与干空气分子量之比
+T0 = 273.15
+
+# 计算核：结果直接写入out，只使用预先分配的工作数组work，不产生新的整块临时数组
+
+def _saturation_vapor_pressure(t, out, work):
+    # Bolton (1980) 饱和水汽压 (Pa)，t为开尔文
+    np.subtract(t, T0, out=work)
+    np.add(work, 243.5, out=out)
+    np.divide(work, out, out=out)
+    np.multiply(out, 17.67, out=out)
+    np.exp(out, out=out)
+    np.multiply(out, 611.2, out=out)
+    return out
+
+def _potential_temperature(out, work, t, p):
+    np.divide(P0, p, out=out)
+    np.power(out, KAPPA, out=out)
+    np.multiply(out, t, out=out)
+
+def _equivalent_potential_temperature(out, work, t, td, p):
+    # Bolton (1980) 公式(43)，先算混合比r，再算抬升凝结温度TL
+    w0, w1 = work
+    _saturation_vapor_pressure(td, out, w0)
+    np.subtract(p, out, out=w0)
+    np.divide(out, w0, out=out)
+    np.multiply(out, EPSILON, out=out)  # out = r (kg/kg)
+
+    np.subtract(td, 56.0, out=w0)
+    np.reciprocal(w0, out=w0)
+    np.divide(t, td, out=w1)
+    np.log(w1, out=w1)
+    np.divide(w1, 800.0, out=w1)
+    np.add(w0, w1, out=w0)
+    np.reciprocal(w0, out=w0)
+    np.add(w0, 56.0, out=w0)  # w0 = TL
+
+    np.divide(3376.0, w0, out=w0)
+    np.subtract(w0, 2.54, out=w0)
+    np.multiply(w0, out, out=w0)
+    np.multiply(out, 0.81, out=w1)
+    np.add(w1, 1.0, out=w1)
+    np.multiply(w0, w1, out=w0)
+    np.exp(w0, out=w0)  # w0 = 水汽项
+
+    np.multiply(out, -0.28, out=w1)
+    np.add(w1, 1.0, out=w1)
+    np.multiply(w1, 0.2854, out=w1)  # w1 = 指数
+    np.divide(P0, p, out=out)
+    np.power(out, w1, out=out)
+    np.multiply(out, t, out=out)
+    np.multiply(out, w0, out=out)
+
+def _dewpoint_depression(out, work, t, td):
+    np.subtract(t, td, out=out)
+
+def _relative_humidity(out, work, q, t, p):
+    # 水汽压 e = q*p/(ε+(1-ε)q)，相对湿度 = e/es
+    _saturation_vapor_pressure(t, out, work)
+    np.multiply(q, 1.0 - EPSILON, out=work)
+    np.add(work, EPSILON, out=work)
+    np.divide(q, work, out=work)
+    np.multiply(work, p, out=work)
+    np.divide(work, out, out=out)
+    np.multiply(out, 100.0, out=out)
+
+def _specific_humidity(out, work, td, p):
+    # q = εe/(p-(1-ε)e)，e为露点对应的饱和水汽压
+    _saturation_vapor_pressure(td, out, work)
+    np.multiply(out, EPSILON - 1.0, out=work)
+    np.add(work, p, out=work)
+    np.divide(out, work, out=out)
+    np.multiply(out, EPSILON, out=out)
+
+def _wind_speed(out, work, u, v):
+    np.hypot(u, v, out=out)
+
+def _wind_direction(out, work, u, v):
+    # 气象风向：风的来向，正北为0度，顺时针
+    np.negative(u, out=out)
+    np.negative(v, out=work)
+    np.arctan2(out, work, out=out)
+    np.degrees(out, out=out)
+    np.mod(out, 360.0, out=out)
+
+# 派生变量只在这里定义一次：输入及默认对应的ERA5变量名(None表示必须给出)、单位、计算核和所需工作数组个数
+DERIVED = {
+    'potential_temperature': {'inputs': {'t': 't2m', 'p': 'sp'}, 'units': 'K', 'long_name': '位温',
+                              'kernel': _potential_temperature, 'work': 0},
+    'equivalent_potential_temperature': {'inputs': {'t': 't2m', 'td': 'd2m', 'p': 'sp'}, 'units': 'K', 'long_name': '相当位温',
+                                         'kernel': _equivalent_potential_temperature, 'work': 2},
+    'dewpoint_depression': {'inputs': {'t': 't2m', 'td': 'd2m'}, 'units': 'K', 'long_name': '温度露点差',
+                            'kernel': _dewpoint_depression, 'work': 0},
+    'relative_humidity': {'inputs': {'q': 'q', 't': 't', 'p': None}, 'units': '%', 'long_name': '相对湿度',
+                          'kernel': _relative_humidity, 'work': 1},
+    'specific_humidity': {'inputs': {'td': 'd2m', 'p': 'sp'}, 'units': 'kg kg**-1', 'long_name': '比湿',
+                          'kernel': _specific_humidity, 'work': 1},
+    'wind_speed': {'inputs': {'u': 'u10', 'v': 'v10'}, 'units': 'm s**-1', 'long_name': '风速',
+                   'kernel': _wind_speed, 'work': 0},
+    'wind_direction': {'inputs': {'u': 'u10', 'v': 'v10'}, 'units': 'degree', 'long_name': '风向',
+                       'kernel': _wind_direction, 'work': 1},
+}
+
+class DerivedField:
+    # 惰性的派生场：定义时不读数据，compute()按时间块读入各输入一次，计算核在块上原地完成
+    # 输入可以是source中的变量名(netCDF4/xarray变量)、数组(第一维为时间)或标量(如气压层的压强Pa)
+    # index为时间维之后各维的下标，例如(level_index, lat_slice, lon_slice)，对所有非标量输入一致使用
+
+    def __init__(self, name, source=None, index=(), **inputs):
+        if name not in DERIVED:
+            raise KeyError(f"未定义的派生变量: {name}")
+        self.name = name
+        self.spec = DERIVED[name]
+        self.units = self.spec['units']
+        self.long_name = self.spec['long_name']
+        self.index = tuple(index)
+        self.inputs = {}
+        for key, default in self.spec['inputs'].items():
+            value = inputs.get(key, default)
+            if value is None:
+                raise KeyError(f"派生变量 {name} 缺少输入: {key}")
+            if isinstance(value, str):
+                if source is None:
+                    raise KeyError(f"变量未找到: {value}")
+                try:
+                    value = source[value]
+                except (KeyError, IndexError) as e:
+                    raise KeyError(f"变量未找到: {e}")
+            self.inputs[key] = value
+
+        fields = [value for value in self.inputs.values() if np.ndim(value) > 0]
+        if not fields:
+            raise ValueError(f"派生变量 {name} 至少需要一个场输入")
+        # 用零步长视图求出取下标后的形状，不读数据
+        self.shape = np.broadcast_to(np.float64(0), fields[0].shape)[(slice(None),) + self.index].shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read_inputs(self, time_slice):
+        values = {}
+        for key, value in self.inputs.items():
+            if np.ndim(value) == 0:
+                values[key] = float(value)
+            else:
+                block = value[(time_slice,) + self.index]
+                values[key] = np.ma.filled(np.ma.asarray(block, dtype=np.float64), np.nan)
+        return values
+
+    def evaluate_block(self, time_slice, out=None, work=None):
+        values = self.read_inputs(time_slice)
+        shape = np.broadcast_shapes(*[np.shape(value) for value in values.values()])
+        if out is None:
+            out = np.empty(shape)
+        if work is None:
+            work = [np.empty(shape) for _ in range(self.spec['work'])]
+        work = work[0] if len(work) == 1 else work
+        self.spec['kernel'](out, work, **values)
+        return out
+
+    def __getitem__(self, time_key):
+        if isinstance(time_key, (int, np.integer)):
+            return self.evaluate_block(slice(time_key, time_key + 1))[0]
+        return self.evaluate_block(time_key)
+
+    def compute(self, out=None, chunk=24, dtype=np.float32):
+        # 逐块计算，块缓冲和工作数组只分配一次；out为float64时直接写入结果，不再经过缓冲
+        if out is None:
+            out = np.empty(self.shape, dtype=dtype)
+        n_times = self.shape[0]
+        block_shape = (min(chunk, n_times),) + self.shape[1:]
+        direct = out.dtype == np.float64
+        buffer = None if direct else np.empty(block_shape)
+        work = [np.empty(block_shape) for _ in range(self.spec['work'])]
+        for start in range(0, n_times, chunk):
+            stop = min(start + chunk, n_times)
+            length = stop - start
+            target = out[start:stop] if direct else buffer[:length]
+            self.evaluate_block(slice(start, stop), target, [array[:length] for array in work])
+            if not direct:
+                out[start:stop] = target
+        return out
+
+def derive(name, source=None, index=(), **inputs):
+    return DerivedField(name, source, index, **inputs)
+
+def evaluate(name, source=None, index=(), chunk=24, dtype=np.float32, **inputs):
+    return DerivedField(name, source, index, **inputs).compute(chunk=chunk, dtype=dtype)
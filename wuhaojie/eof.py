@@ -0,0 +1,235 @@
+import netCDF4 as nc
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+import era5_catalog
+import contour_cache
+import vector_layer
+from climatology import anomaly
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+# 常用分析对象：(变量, 气压层)列表，多个变量拼接为联合EOF
+FIELD_SETS = {
+    'z500': [('z', 500)],
+    'wind850': [('u', 850), ('v', 850)],
+    'tp': [('tp', None)],
+}
+
+def field_name(variable, level):
+    return variable if level is None else f'{variable}{int(level)}'
+
+def field_chunks(catalog, fields, start=None, end=None, lat_slice=slice(None), lon_slice=slice(None), chunk_hours=744):
+    # 多个变量同步逐块读取，每次产出(times, [各变量块])
+    streams = [era5_catalog.iter_variable_chunks(catalog, variable, start, end, level, lat_slice, lon_slice, chunk_hours)
+               for variable, level in fields]
+    for parts in zip(*streams):
+        times = parts[0][0]
+        for other_times, _ in parts[1:]:
+            if not times.equals(other_times):
+                raise ValueError("各变量的时次不一致")
+        yield times, [block for _, block in parts]
+
+def time_mean(catalog, fields, start=None, end=None, lat_slice=slice(None), lon_slice=slice(None), chunk_hours=744):
+    # 第一遍：各变量的时间平均，只保留累加量
+    sums, counts = None, None
+    for _, blocks in field_chunks(catalog, fields, start, end, lat_slice, lon_slice, chunk_hours):
+        if sums is None:
+            sums = [np.zeros(block.shape[1:]) for block in blocks]
+            counts = [np.zeros(block.shape[1:]) for block in blocks]
+        for total, count, block in zip(sums, counts, blocks):
+            total += np.nansum(block, axis=0)
+            count += np.isfinite(block).sum(axis=0)
+    return [total / count for total, count in zip(sums, counts)]
+
+def anomaly_chunks(catalog, fields, weights, means=None, clims=None, start=None, end=None,
+                   lat_slice=slice(None), lon_slice=slice(None), chunk_hours=744, lats=None, lons=None):
+    # 逐块产出加权距平矩阵(时间, 空间)。距平相对时间平均，或给定clims时相对逐日气候态；
+    # 乘以sqrt(cos纬度)，使协方差按面积加权
+    for times, blocks in field_chunks(catalog, fields, start, end, lat_slice, lon_slice, chunk_hours):
+        columns = []
+        for i, block in enumerate(blocks):
+            if clims is not None:
+                block = anomaly(block, times, clims[i], lats, lons)
+            else:
+                block = block - means[i]
+            columns.append(np.nan_to_num(block * weights).reshape(block.shape[0], -1))
+        yield times, np.concatenate(columns, axis=1)
+
+def randomized_eof(chunks, n_modes=10, oversample=10, n_iter=2, seed=0):
+    # 流式随机SVD：chunks()每次返回一个新的(times, A块)迭代器，A为(时间, 空间)。
+    # 只保存(空间, k+p)的子空间基和(k+p, k+p)的小矩阵，内存与记录长度无关；
+    # 共需2+n_iter遍数据：求值域、幂迭代、最后一遍得到奇异值和PC
+    rank = n_modes + oversample
+    rng = np.random.default_rng(seed)
+    basis = None
+    total_variance = 0.0
+    n_times = 0
+
+    # 第一遍：Z = AᵀAΩ，同时累计总方差
+    for _, block in chunks():
+        if basis is None:
+            omega = rng.standard_normal((block.shape[1], rank))
+            basis = np.zeros((block.shape[1], rank))
+        basis += block.T @ (block @ omega)
+        total_variance += np.einsum('ij,ij->', block, block)
+        n_times += block.shape[0]
+
+    # 幂迭代提高小奇异值处的精度，每次先正交化
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(basis)
+        basis = np.zeros_like(q)
+        for _, block in chunks():
+            basis += block.T @ (block @ q)
+    q, _ = np.linalg.qr(basis)
+
+    # 最后一遍：投影系数Y = AQ和小矩阵YᵀY，特征分解后旋转回原空间
+    gram = np.zeros((rank, rank))
+    projections, times = [], []
+    for chunk_times, block in chunks():
+        projection = block @ q
+        gram += projection.T @ projection
+        projections.append(projection)
+        times.append(chunk_times.values)
+    eigenvalues, vectors = np.linalg.eigh(gram)
+    order = np.argsort(eigenvalues)[::-1][:n_modes]
+    eigenvalues = np.maximum(eigenvalues[order], 0.0)
+    vectors = vectors[:, order]
+
+    singular = np.sqrt(eigenvalues)
+    eofs = (q @ vectors).T  # (模态, 空间)，单位向量
+    pcs = np.concatenate(projections) @ vectors / singular  # 单位范数的PC
+    return {
+        'times': pd.DatetimeIndex(np.concatenate(times)),
+        'eofs': eofs,
+        'pcs': pcs * np.sqrt(n_times),  # 标准化为单位方差
+        'singular_values': singular,
+        'explained_variance_ratio': eigenvalues / total_variance,
+    }
+
+def eof_from_catalog(catalog, fields, n_modes=10, start=None, end=None, lon_range=None, lat_range=None,
+                     clims=None, oversample=10, n_iter=2, chunk_hours=744):
+    # 目录中的多年逐时资料：逐块流式分解，返回各变量的EOF型(按PC一个标准差的回归图)、PC和方差贡献
+    entry = era5_catalog.select_files(catalog, fields[0][0], start, end)[0]
+    dataset = era5_catalog.load_dataset(entry['path'])
+    lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+    lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+    dataset.close()
+    lat_slice, lon_slice = era5_catalog.mask_bounds(era5_catalog.region_mask(lats, lons, lon_range=lon_range,
+                                                                             lat_range=lat_range))
+    lats, lons = lats[lat_slice], lons[lon_slice]
+    weights = np.sqrt(np.clip(np.cos(np.radians(lats)), 0.0, None))[:, np.newaxis]
+
+    means = None
+    if clims is None:
+        means = time_mean(catalog, fields, start, end, lat_slice, lon_slice, chunk_hours)
+
+    def chunks():
+        return anomaly_chunks(catalog, fields, weights, means, clims, start, end, lat_slice, lon_slice,
+                              chunk_hours, lats, lons)
+
+    result = randomized_eof(chunks, n_modes, oversample, n_iter)
+    n_times = len(result['times'])
+    # 还原权重并换算为PC每变化一个标准差对应的场(原单位)
+    scale = result['singular_values'] / np.sqrt(n_times)
+    patterns = {}
+    size = lats.size * lons.size
+    for i, (variable, level) in enumerate(fields):
+        part = result['eofs'][:, i * size:(i + 1) * size].reshape(-1, lats.size, lons.size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            patterns[field_name(variable, level)] = part * scale[:, None, None] / weights
+    result.update({'fields': fields, 'latitude': lats, 'longitude': lons, 'patterns': patterns})
+    return result
+
+def save_eof(result, output_file):
+    dataset = nc.Dataset(output_file, 'w')
+    try:
+        n_modes = result['singular_values'].size
+        dataset.createDimension('mode', n_modes)
+        dataset.createDimension('time', len(result['times']))
+        dataset.createDimension('latitude', result['latitude'].size)
+        dataset.createDimension('longitude', result['longitude'].size)
+        dataset.createVariable('mode', 'i4', ('mode',))[:] = np.arange(1, n_modes + 1)
+        time_var = dataset.createVariable('time', 'f8', ('time',))
+        time_var.units = 'hours since 1970-01-01 00:00:00'
+        time_var.calendar = 'standard'
+        time_var[:] = nc.date2num(result['times'].to_pydatetime(), time_var.units, 'standard')
+        dataset.createVariable('latitude', 'f4', ('latitude',))[:] = result['latitude']
+        dataset.createVariable('longitude', 'f4', ('longitude',))[:] = result['longitude']
+        dataset.createVariable('explained_variance_ratio', 'f8', ('mode',))[:] = result['explained_variance_ratio']
+        dataset.createVariable('pc', 'f4', ('time', 'mode'), zlib=True, complevel=4)[:] = result['pcs']
+        for name, pattern in result['patterns'].items():
+            var = dataset.createVariable(f'eof_{name}', 'f4', ('mode', 'latitude', 'longitude'), zlib=True, complevel=4)
+            var[:] = pattern
+    finally:
+        dataset.close()
+    print(f"Saved EOF result as {output_file}")
+
+def plot_patterns(result, output_dir, n_plot=3, extent=(110, 115, 32, 37), figsize=(12, 8)):
+    # 每个模态一张图：单变量用缓存填色等值线，风场(u, v)联合模态用矢量图层叠加全风速填色
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+    lon_grid, lat_grid = np.meshgrid(result['longitude'], result['latitude'])
+    names = list(result['patterns'])
+    is_wind = len(names) == 2 and names[0].startswith('u') and names[1].startswith('v')
+    if is_wind:
+        u, v = result['patterns'][names[0]][:n_plot], result['patterns'][names[1]][:n_plot]
+        filled = np.hypot(u, v)
+    else:
+        filled = result['patterns'][names[0]][:n_plot]
+    limit = np.nanmax(np.abs(filled))
+    levels = contour_cache.contour_levels(np.array([0.0 if is_wind else -limit, limit]))
+    cache_files = contour_cache.precompute_contours(lon_grid, lat_grid, filled, levels)
+
+    for mode, cache_file in enumerate(cache_files):
+        fig, ax = plt.subplots(figsize=figsize, subplot_kw={'projection': ccrs.PlateCarree()})
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        contour = contour_cache.draw_cached_contours(ax, cache_file, levels, cmap='YlOrRd' if is_wind else 'RdBu_r')
+        plt.colorbar(contour, ax=ax, orientation='horizontal', pad=0.05, label='每个PC标准差对应的距平')
+        if is_wind:
+            vector_layer.draw_vectors(ax, result['longitude'], result['latitude'], u[mode], v[mode], list(extent), figsize)
+        ratio = result['explained_variance_ratio'][mode] * 100
+        ax.set_title(f'{"+".join(names)} EOF{mode + 1} (方差贡献 {ratio:.1f}%)')
+        ax.set_xlabel('经度')
+        ax.set_ylabel('纬度')
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+        output_file = os.path.join(output_dir, f'eof{mode + 1}.png')
+        fig.savefig(output_file)
+        plt.close(fig)
+        print(f"Saved EOF{mode + 1} pattern as {output_file}")
+
+    fig, ax = plt.subplots(figsize=(12, 5))
+    for mode in range(len(cache_files)):
+        ax.plot(result['times'], result['pcs'][:, mode], label=f'PC{mode + 1}')
+    ax.set_xlabel('时间')
+    ax.set_ylabel('标准化PC')
+    ax.legend()
+    ax.grid(True)
+    output_file = os.path.join(output_dir, 'pcs.png')
+    fig.savefig(output_file)
+    plt.close(fig)
+    print(f"Saved PC time series as {output_file}")
+
+def main():
+    data_dir = r"D:\pycharm\dongliqixiangxue"
+    output_dir = r"D:\新建文件夹\eof"
+    n_modes = 10
+
+    catalog = era5_catalog.build_catalog(data_dir, catalog_file=os.path.join(data_dir, 'era5_catalog.json'))
+    for name, fields in FIELD_SETS.items():
+        field_dir = os.path.join(output_dir, name)
+        os.makedirs(field_dir, exist_ok=True)
+        result = eof_from_catalog(catalog, fields, n_modes=n_modes)
+        save_eof(result, os.path.join(field_dir, f'eof_{name}.nc'))
+        plot_patterns(result, field_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import netCDF4 as nc
+import numpy as np
+import pandas as pd
+import os
+import glob
+import json
+from concurrent.futures import ProcessPoolExecutor
+import shapely
+import cnmaps
+from sparse_precip import SparseFrames
+
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+# 时间变量名：新版CDS文件为valid_time，xiaochidu.nc等旧文件为time
+TIME_NAMES = ('valid_time', 'time')
+# 坐标变量，不计入目录中的物理量
+COORD_NAMES = ('valid_time', 'time', 'latitude', 'longitude', 'pressure_level', 'level', 'number', 'expver')
+
+def load_dataset(file_path):
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件未找到: {file_path}")
+    try:
+        dataset = nc.Dataset(file_path)
+    except OSError as e:
+        raise RuntimeError(f"无法打开文件: {e}")
+    return dataset
+
+def get_time_variable(dataset):
+    for name in TIME_NAMES:
+        if name in dataset.variables:
+            return dataset.variables[name]
+    raise KeyError(f"变量未找到: {'/'.join(TIME_NAMES)}")
+
+def read_times(dataset, index=slice(None)):
+    time_var = get_time_variable(dataset)
+    time_calendar = time_var.calendar if hasattr(time_var, 'calendar') else 'standard'
+    time_points = nc.num2date(time_var[index], units=time_var.units, calendar=time_calendar,
+                              only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    return pd.to_datetime(np.atleast_1d(time_points))
+
+def scan_file(file_path):
+    # 只读取元数据和首末时刻，不读取数据本身
+    dataset = load_dataset(file_path)
+    try:
+        time_var = get_time_variable(dataset)
+        n_times = len(time_var)
+        times = read_times(dataset, [0, n_times - 1])
+        lats = dataset.variables['latitude'][:]
+        lons = dataset.variables['longitude'][:]
+        levels = []
+        for name in ('pressure_level', 'level'):
+            if name in dataset.variables:
+                levels = [float(p) for p in dataset.variables[name][:]]
+        variables = [name for name in dataset.variables if name not in COORD_NAMES]
+    finally:
+        dataset.close()
+    stat = os.stat(file_path)
+    return {
+        'path': os.path.abspath(file_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'start': times[0].isoformat(),
+        'end': times[-1].isoformat(),
+        'n_times': n_times,
+        'variables': variables,
+        'levels': levels,
+        'lat_range': [float(lats.min()), float(lats.max())],
+        'lon_range': [float(lons.min()), float(lons.max())],
+    }
+
+def build_catalog(data_dir, pattern='*.nc', catalog_file=None, workers=None):
+    # 按时间覆盖和变量索引目录下的逐月/逐年ERA5文件，未变化的文件直接复用旧目录记录
+    file_paths = sorted(glob.glob(os.path.join(data_dir, '**', pattern), recursive=True))
+    if not file_paths:
+        raise FileNotFoundError(f"目录中没有匹配 {pattern} 的文件: {data_dir}")
+
+    cached = {}
+    if catalog_file is not None and os.path.exists(catalog_file):
+        with open(catalog_file, 'r', encoding='utf-8') as f:
+            cached = {entry['path']: entry for entry in json.load(f)}
+
+    entries = []
+    pending = []
+    for file_path in file_paths:
+        entry = cached.get(os.path.abspath(file_path))
+        stat = os.stat(file_path)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            entries.append(entry)
+        else:
+            pending.append(file_path)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            entries.extend(executor.map(scan_file, pending))
+
+    entries.sort(key=lambda entry: (entry['start'], entry['path']))
+    if catalog_file is not None:
+        with open(catalog_file, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=1)
+    return entries
+
+def select_files(catalog, variable, start=None, end=None):
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    selected = []
+    for entry in catalog:
+        if variable not in entry['variables']:
+            continue
+        if start is not None and pd.Timestamp(entry['end']) < start:
+            continue
+        if end is not None and pd.Timestamp(entry['start']) > end:
+            continue
+        selected.append(entry)
+    if not selected:
+        raise KeyError(f"目录中没有包含变量 {variable} 的文件")
+    return selected
+
+def region_mask(lats, lons, province=None, city=None, lon_range=None, lat_range=None):
+    # 返回(lat, lon)布尔掩膜；给定省/市时按cnmaps边界判断，否则按经纬度范围
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    if province is not None or city is not None:
+        region = cnmaps.get_adm_maps(province=province, city=city, record='first', only_polygon=True)
+        geom = getattr(region, 'geom', region)
+        return shapely.contains_xy(geom, lon_grid, lat_grid)
+    mask = np.ones(lon_grid.shape, dtype=bool)
+    if lon_range is not None:
+        mask &= (lon_grid >= lon_range[0]) & (lon_grid <= lon_range[1])
+    if lat_range is not None:
+        mask &= (lat_grid >= lat_range[0]) & (lat_grid <= lat_range[1])
+    return mask
+
+def mask_bounds(mask):
+    # 掩膜的外接行列范围，用于只读取区域所在的子块
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        raise ValueError("区域掩膜为空，请检查区域与数据范围是否重叠")
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+def level_index(dataset, level):
+    for name in ('pressure_level', 'level'):
+        if name in dataset.variables:
+            levels = dataset.variables[name][:]
+            matches = np.flatnonzero(np.isclose(levels, level))
+            if matches.size == 0:
+                raise KeyError(f"气压层未找到: {level} hPa")
+            return int(matches[0])
+    raise KeyError("变量未找到: pressure_level")
+
+def read_block(dataset, variable, time_slice, lat_slice=slice(None), lon_slice=slice(None), level=None):
+    var = dataset.variables[variable]
+    if level is not None:
+        data = var[time_slice, level_index(dataset, level), lat_slice, lon_slice]
+    else:
+        data = var[time_slice, lat_slice, lon_slice]
+    return np.ma.filled(data.astype(np.float64), np.nan)
+
+def iter_variable_chunks(catalog, variable, start=None, end=None, level=None,
+                         lat_slice=slice(None), lon_slice=slice(None), chunk_hours=744):
+    # 逐文件、逐时间块读取，内存只占一个块
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    for entry in select_files(catalog, variable, start, end):
+        dataset = load_dataset(entry['path'])
+        try:
+            times = read_times(dataset)
+            keep = np.ones(len(times), dtype=bool)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times <= end
+            indices = np.flatnonzero(keep)
+            for i in range(0, indices.size, chunk_hours):
+                chunk = indices[i:i + chunk_hours]
+                time_slice = slice(chunk[0], chunk[-1] + 1)
+                block = read_block(dataset, variable, time_slice, lat_slice, lon_slice, level)
+                yield times[time_slice], block
+        finally:
+            dataset.close()
+
+def _hourly_region_series(file_path, variable, mask, chunk_hours):
+    # 工作进程：逐块读取一个文件，只返回区域逐时统计量，不返回格点场
+    dataset = load_dataset(file_path)
+    try:
+        times = read_times(dataset)
+        lat_slice, lon_slice = mask_bounds(mask)
+        lats = dataset.variables['latitude'][lat_slice].astype(np.float64)
+        lons = dataset.variables['longitude'][lon_slice].astype(np.float64)
+        sub_mask = mask[lat_slice, lon_slice]
+        # 面积权重cos(lat)，掩膜外权重为0
+        weights = np.where(sub_mask, np.cos(np.deg2rad(lats))[:, None], 0.0)
+        lat_grid = np.broadcast_to(lats[:, None], weights.shape)
+        lon_grid = np.broadcast_to(lons[None, :], weights.shape)
+        # ERA5的tp单位为m，统一换算为mm
+        units = getattr(dataset.variables[variable], 'units', '')
+        scale = 1000.0 if units == 'm' else 1.0
+
+        # 逐块读取后只保留有降水的格点，统计量直接在稀疏数据上计算，内存只占一个块；去掉GRIB打包产生的微小负值
+        parts = []
+        for start in range(0, len(times), chunk_hours):
+            time_slice = slice(start, min(start + chunk_hours, len(times)))
+            frames = SparseFrames.from_variable(dataset.variables[variable], (lat_slice, lon_slice), time_slice,
+                                                chunk=chunk_hours, scale=scale).clip(0.0)
+            mean_rate = frames.weighted_series(weights)
+            parts.append(pd.DataFrame({
+                'mean_rate': mean_rate,
+                'max_rate': frames.frame_maximum(sub_mask),
+                'wsum': mean_rate * weights.sum(),
+                'wlat': frames.weighted_series(weights * lat_grid) * (weights * lat_grid).sum(),
+                'wlon': frames.weighted_series(weights * lon_grid) * (weights * lon_grid).sum(),
+            }, index=times[time_slice]))
+    finally:
+        dataset.close()
+    if not parts:
+        return pd.DataFrame(columns=['mean_rate', 'max_rate', 'wsum', 'wlat', 'wlon'], index=times[:0])
+    return pd.concat(parts)
+
+def region_hourly_series(catalog, mask, variable='tp', start=None, end=None, chunk_hours=744, workers=None):
+    # 并行扫描所有文件，拼成区域逐时序列；重叠时刻(如ERA5T与ERA5)保留较新文件
+    entries = select_files(catalog, variable, start, end)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_hourly_region_series, entry['path'], variable, mask, chunk_hours)
+                   for entry in entries]
+        parts = [future.result() for future in futures]
+    hourly = pd.concat(parts).sort_index(kind='stable')
+    hourly = hourly[~hourly.index.duplicated(keep='last')]
+    if start is not None:
+        hourly = hourly[hourly.index >= pd.Timestamp(start)]
+    if end is not None:
+        hourly = hourly[hourly.index <= pd.Timestamp(end)]
+    return hourly
+
+def detect_events(hourly, threshold=20.0, field='max_rate', max_gap=0, min_duration=1):
+    # 区域内逐时降水超过阈值的连续时段视为一次过程；相隔不超过max_gap小时的过程合并
+    columns = ['start', 'end', 'duration_h', 'peak_time', 'peak_rate', 'total', 'centroid_lat', 'centroid_lon']
+    if hourly.empty:
+        return pd.DataFrame(columns=columns)
+    times = hourly.index
+    active = (hourly[field].to_numpy() >= threshold).astype(np.int8)
+
+    # 把max_gap以内的空档填上
+    if max_gap > 0:
+        padded = np.concatenate(([0], active, [0]))
+        starts = np.flatnonzero(np.diff(padded) == 1)
+        ends = np.flatnonzero(np.diff(padded) == -1)
+        gaps = starts[1:] - ends[:-1]
+        for gap_start, gap_end in zip(ends[:-1][gaps <= max_gap], starts[1:][gaps <= max_gap]):
+            active[gap_start:gap_end] = 1
+
+    # 数据缺测(时间不连续)处强制断开
+    hours = (times - times[0]) / pd.Timedelta(hours=1)
+    breaks = np.concatenate(([True], np.diff(hours.to_numpy()) > 1))
+    run_start = (active == 1) & (breaks | (np.concatenate(([0], active[:-1])) == 0))
+    run_id = np.cumsum(run_start)
+    run_id[active == 0] = 0
+
+    starts = np.flatnonzero(run_start)
+    if starts.size == 0:
+        return pd.DataFrame(columns=columns)
+
+    # 用reduceat一次算出所有过程的统计量
+    order = np.flatnonzero(active)
+    segment_starts = np.searchsorted(order, starts)
+    ends = order[np.append(segment_starts[1:], order.size) - 1]
+    duration = ends - starts + 1
+    max_rate = hourly['max_rate'].to_numpy()[order]
+    peak = np.maximum.reduceat(max_rate, segment_starts)
+    total = np.add.reduceat(hourly['mean_rate'].to_numpy()[order], segment_starts)
+    wsum = np.add.reduceat(hourly['wsum'].to_numpy()[order], segment_starts)
+    wlat = np.add.reduceat(hourly['wlat'].to_numpy()[order], segment_starts)
+    wlon = np.add.reduceat(hourly['wlon'].to_numpy()[order], segment_starts)
+    # 每个过程内按雨强降序排序，取第一个即峰值时刻
+    ranked = np.lexsort((-max_rate, run_id[order]))
+    peak_pos = order[ranked[segment_starts]]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        events = pd.DataFrame({
+            'start': times[starts],
+            'end': times[ends],
+            'duration_h': duration,
+            'peak_time': times[peak_pos],
+            'peak_rate': peak,
+            'total': total,
+            'centroid_lat': wlat / wsum,
+            'centroid_lon': wlon / wsum,
+        })
+    return events[events['duration_h'] >= min_duration].reset_index(drop=True)
+
+def main():
+    data_dir = r"D:\pycharm\dongliqixiangxue\era5"
+    catalog_file = os.path.join(data_dir, 'era5_catalog.json')
+    output_file = r"D:\新建文件夹\henan_rain_events.csv"
+
+    catalog = build_catalog(data_dir, catalog_file=catalog_file)
+    print(f"目录共 {len(catalog)} 个文件，时间范围 {catalog[0]['start']} - {catalog[-1]['end']}")
+
+    # 以第一个含tp的文件的网格构建河南省掩膜
+    dataset = load_dataset(select_files(catalog, 'tp')[0]['path'])
+    lats = dataset.variables['latitude'][:]
+    lons = dataset.variables['longitude'][:]
+    dataset.close()
+    mask = region_mask(lats, lons, province='河南省')
+
+    hourly = region_hourly_series(catalog, mask, variable='tp')
+    events = detect_events(hourly, threshold=20.0, max_gap=6, min_duration=3)
+    events.to_csv(output_file, index=False, encoding='utf-8-sig')
+    print(f"Saved {len(events)} heavy-rain events as {output_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import netCDF4 as nc
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+import os
+from concurrent.futures import ProcessPoolExecutor
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+from scipy.special import gamma
+import era5_catalog
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+DURATIONS = (1, 3, 6, 24)  # 滑动累计时长 (小时)
+RETURN_PERIODS = (10, 20, 50, 100)  # 重现期 (年)
+MIN_YEARS = 10  # 拟合所需的最少年数
+MIN_COVERAGE = 0.9  # 参与拟合的年份至少要有的逐时资料比例，不足的年份(当年、缺月)最大值偏小
+
+def window_sums(block, durations):
+    # block: (时间, ...)。各时长的滑动累计量，第i个元素对应以block[i]结束的窗口；不足一个窗口处为NaN
+    cumulative = np.concatenate([np.zeros((1,) + block.shape[1:]), np.cumsum(block, axis=0)])
+    sums = {}
+    for duration in durations:
+        result = np.full(block.shape, np.nan)
+        if duration <= block.shape[0]:
+            result[duration - 1:] = cumulative[duration:] - cumulative[:block.shape[0] - duration + 1]
+        sums[duration] = result
+    return sums
+
+def update_maxima(maxima, sums, times):
+    # 按窗口结束时刻所在年份更新年最大值
+    years = pd.DatetimeIndex(times).year.to_numpy()
+    for year in np.unique(years):
+        selected = years == year
+        for duration, values in sums.items():
+            block_max = np.nanmax(values[selected], axis=0) if np.isfinite(values[selected]).any() else None
+            if block_max is None:
+                continue
+            current = maxima.setdefault(year, {}).get(duration)
+            maxima[year][duration] = block_max if current is None else np.fmax(current, block_max)
+    return maxima
+
+def _file_maxima(file_path, variable, durations, lat_slice, lon_slice, chunk_hours, scale, start=None, end=None):
+    # 工作进程：一个文件内的逐年最大值；块间用前一块末尾max(durations)-1小时衔接。
+    # 同时返回文件首尾的这段数据，供主进程补算跨文件的窗口，以及文件的全部时次，用于统计各年资料覆盖率
+    keep = max(durations) - 1
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        times = era5_catalog.read_times(dataset)
+        # 只统计[start, end]内的时次
+        selected = np.ones(len(times), dtype=bool)
+        if start is not None:
+            selected &= times >= pd.Timestamp(start)
+        if end is not None:
+            selected &= times <= pd.Timestamp(end)
+        index = np.flatnonzero(selected)
+        first, last = (index[0], index[-1] + 1) if index.size else (0, 0)
+        maxima = {}
+        tail_times, tail = times[:0], None
+        head = None
+        for i in range(first, last, chunk_hours):
+            time_slice = slice(i, min(i + chunk_hours, last))
+            block = np.maximum(era5_catalog.read_block(dataset, variable, time_slice, lat_slice, lon_slice), 0.0) * scale
+            if head is None:
+                head = (times[time_slice][:keep], block[:keep])
+            elif head[1].shape[0] < keep:
+                need = keep - head[1].shape[0]
+                head = (head[0].append(times[time_slice][:need]), np.concatenate([head[1], block[:need]]))
+            if tail is not None:
+                window_times = tail_times.append(times[time_slice])
+                window = np.concatenate([tail, block])
+            else:
+                window_times, window = times[time_slice], block
+            sums = window_sums(window, durations)
+            offset = window.shape[0] - block.shape[0]
+            update_maxima(maxima, {d: s[offset:] for d, s in sums.items()}, times[time_slice])
+            split = max(0, window.shape[0] - keep)
+            tail_times, tail = window_times[split:], window[split:]
+    finally:
+        dataset.close()
+    return maxima, head, (tail_times, tail), times[first:last]
+
+def year_coverage(times, years):
+    # 各年有资料的时次占全年小时数的比例，重叠文件中的同一时次只算一次
+    counts = pd.Series(pd.DatetimeIndex(times).unique().year).value_counts()
+    hours = np.array([(pd.Timestamp(year + 1, 1, 1) - pd.Timestamp(year, 1, 1)) / pd.Timedelta(hours=1) for year in years])
+    return counts.reindex(years, fill_value=0).to_numpy() / hours
+
+def annual_maxima(catalog, variable='tp', durations=DURATIONS, start=None, end=None, lon_range=None, lat_range=None,
+                  chunk_hours=744, workers=None, scale=1000.0, min_coverage=MIN_COVERAGE):
+    # 多年文件并行扫描，返回(年份, 时长, 纬度, 经度)的年最大滑动累计量，scale为单位换算(tp: m -> mm)。
+    # 资料覆盖率低于min_coverage的年份不返回
+    entries = era5_catalog.select_files(catalog, variable, start, end)
+    dataset = era5_catalog.load_dataset(entries[0]['path'])
+    lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+    lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+    dataset.close()
+    lat_slice, lon_slice = era5_catalog.mask_bounds(era5_catalog.region_mask(lats, lons, lon_range=lon_range,
+                                                                             lat_range=lat_range))
+    entries = sorted(entries, key=lambda entry: entry['start'])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_file_maxima, entry['path'], variable, durations, lat_slice, lon_slice, chunk_hours,
+                                   scale, start, end) for entry in entries]
+        parts = [future.result() for future in futures]
+
+    maxima = {}
+    for part, _, _, _ in parts:
+        for year, values in part.items():
+            for duration, value in values.items():
+                current = maxima.setdefault(year, {}).get(duration)
+                maxima[year][duration] = value if current is None else np.fmax(current, value)
+    # 跨文件的窗口：前一文件末尾与后一文件开头相接且时间连续时补算
+    for (_, _, (tail_times, tail), _), (_, (head_times, head), _, _) in zip(parts[:-1], parts[1:]):
+        if tail is None or head is None or len(tail_times) == 0:
+            continue
+        if head_times[0] - tail_times[-1] != pd.Timedelta(hours=1):
+            continue
+        window = np.concatenate([tail, head])
+        sums = window_sums(window, durations)
+        update_maxima(maxima, {d: s[tail.shape[0]:] for d, s in sums.items()}, head_times)
+
+    years = np.array(sorted(maxima))
+    coverage = year_coverage(np.concatenate([part[3].values for part in parts]), years)
+    dropped = years[coverage < min_coverage]
+    if dropped.size:
+        print(f"资料不足{min_coverage:.0%}的年份不参与统计: {', '.join(str(year) for year in dropped)}")
+    years = years[coverage >= min_coverage]
+    data = np.full((years.size, len(durations), lats[lat_slice].size, lons[lon_slice].size), np.nan)
+    for i, year in enumerate(years):
+        for j, duration in enumerate(durations):
+            if duration in maxima[year]:
+                data[i, j] = maxima[year][duration]
+    return {'years': years, 'durations': np.asarray(durations), 'latitude': lats[lat_slice],
+            'longitude': lons[lon_slice], 'maxima': data, 'coverage': coverage[coverage >= min_coverage]}
+
+def fit_gev(samples, min_years=MIN_YEARS):
+    # 按L矩法对所有格点同时拟合GEV(Hosking 1985)。samples: (年, ...)，NaN为缺测年。
+    # 返回位置ξ、尺度α、形状k(Hosking符号，k<0为厚尾，与scipy.stats.genextreme的c相同)
+    x = np.sort(np.asarray(samples, dtype=np.float64), axis=0)  # NaN排在最后
+    n = np.isfinite(x).sum(axis=0).astype(np.float64)
+    rank = np.arange(x.shape[0], dtype=np.float64).reshape((-1,) + (1,) * (x.ndim - 1))
+    values = np.nan_to_num(x)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 无偏概率权重矩b0, b1, b2
+        b0 = values.sum(axis=0) / n
+        b1 = (values * rank / (n - 1)).sum(axis=0) / n
+        b2 = (values * rank * (rank - 1) / ((n - 1) * (n - 2))).sum(axis=0) / n
+        l1 = b0
+        l2 = 2 * b1 - b0
+        l3 = 6 * b2 - 6 * b1 + b0
+        t3 = l3 / l2
+        c = 2.0 / (3.0 + t3) - np.log(2.0) / np.log(3.0)
+        k = 7.8590 * c + 2.9554 * c ** 2
+        gumbel = np.abs(k) < 1e-6
+        safe_k = np.where(gumbel, 1.0, k)
+        alpha = np.where(gumbel, l2 / np.log(2.0), l2 * safe_k / ((1 - 2.0 ** -safe_k) * gamma(1 + safe_k)))
+        xi = np.where(gumbel, l1 - 0.5772156649 * alpha, l1 - alpha * (1 - gamma(1 + safe_k)) / safe_k)
+    invalid = (n < min_years) | ~(l2 > 0)
+    for array in (xi, alpha, k):
+        array[invalid] = np.nan
+    return xi, alpha, k
+
+def return_level(xi, alpha, k, periods=RETURN_PERIODS):
+    # 重现期T年的重现水平，返回(重现期, ...)
+    periods = np.asarray(periods, dtype=np.float64).reshape((-1,) + (1,) * np.ndim(xi))
+    y = -np.log(1 - 1 / periods)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gumbel = np.abs(k) < 1e-6
+        safe_k = np.where(gumbel, 1.0, k)
+        return np.where(gumbel, xi - alpha * np.log(y), xi + alpha / safe_k * (1 - y ** safe_k))
+
+def return_period(value, xi, alpha, k):
+    # 给定量值(如本次过程的最大累计量)的重现期 (年)；超出分布上界时为inf
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        gumbel = np.abs(k) < 1e-6
+        safe_k = np.where(gumbel, 1.0, k)
+        z = np.where(gumbel, (value - xi) / alpha, -np.log(np.maximum(1 - safe_k * (value - xi) / alpha, 0.0)) / safe_k)
+        exceedance = -np.expm1(-np.exp(-z))
+        return 1 / exceedance
+
+def fit_chunks(maxima, chunk=20000, min_years=MIN_YEARS):
+    # maxima: (年, 时长, 纬度, 经度)。按格点分块拟合，全部为数组运算
+    shape = maxima.shape[1:]
+    flat = maxima.reshape(maxima.shape[0], -1)
+    params = np.empty((3, flat.shape[1]))
+    for start in range(0, flat.shape[1], chunk):
+        columns = slice(start, start + chunk)
+        params[:, columns] = fit_gev(flat[:, columns], min_years)
+    return params.reshape((3,) + shape)
+
+def event_maxima(file_path, durations=DURATIONS, start=None, end=None, lon_range=None, lat_range=None, lats=None,
+                 lons=None):
+    # 一次过程(如2021年7月)各时长的最大滑动累计降水 (mm)。给定lats/lons(拟合所用网格)时只读取该范围，
+    # 并检查两者格点一一对应，避免与GEV参数错位
+    if lats is not None and lons is not None:
+        margin = 0.5 * min(np.abs(np.diff(lats[:2])).max(initial=0.0), np.abs(np.diff(lons[:2])).max(initial=0.0))
+        lon_range = (np.min(lons) - margin, np.max(lons) + margin)
+        lat_range = (np.min(lats) - margin, np.max(lats) + margin)
+    catalog = era5_catalog.build_catalog(os.path.dirname(file_path) or '.', pattern=os.path.basename(file_path))
+    result = annual_maxima(catalog, 'tp', durations, start, end, lon_range, lat_range, workers=1, min_coverage=0.0)
+    if lats is not None and lons is not None:
+        if (result['latitude'].shape != np.shape(lats) or result['longitude'].shape != np.shape(lons)
+                or not np.allclose(result['latitude'], lats) or not np.allclose(result['longitude'], lons)):
+            raise ValueError(f"过程资料与拟合资料的网格不一致: {file_path}")
+    return np.nanmax(result['maxima'], axis=0)
+
+def save_extremes(result, params, levels, output_file, periods=RETURN_PERIODS):
+    dataset = nc.Dataset(output_file, 'w')
+    try:
+        dataset.createDimension('year', result['years'].size)
+        dataset.createDimension('duration', result['durations'].size)
+        dataset.createDimension('period', len(periods))
+        dataset.createDimension('latitude', result['latitude'].size)
+        dataset.createDimension('longitude', result['longitude'].size)
+        dataset.createVariable('year', 'i4', ('year',))[:] = result['years']
+        dataset.createVariable('duration', 'i4', ('duration',))[:] = result['durations']
+        dataset.createVariable('period', 'i4', ('period',))[:] = periods
+        dataset.createVariable('latitude', 'f4', ('latitude',))[:] = result['latitude']
+        dataset.createVariable('longitude', 'f4', ('longitude',))[:] = result['longitude']
+        dims = ('duration', 'latitude', 'longitude')
+        dataset.createVariable('annual_max', 'f4', ('year',) + dims, zlib=True, complevel=4)[:] = result['maxima']
+        for name, values in zip(('location', 'scale', 'shape'), params):
+            dataset.createVariable(name, 'f4', dims)[:] = values
+        dataset.createVariable('return_level', 'f4', ('period',) + dims, zlib=True, complevel=4)[:] = levels
+    finally:
+        dataset.close()
+    print(f"Saved GEV fits as {output_file}")
+
+def plot_maps(lons, lats, panels, output_file, extent=(110, 115, 32, 37), norm=None, cmap='YlGnBu'):
+    # panels: [(数据, 标题, 色标标签)]，一行排开
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+    fig, axes = plt.subplots(1, len(panels), figsize=(6 * len(panels), 6), squeeze=False,
+                             subplot_kw={'projection': ccrs.PlateCarree()})
+    for ax, (data, title, label) in zip(axes[0], panels):
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        mesh = ax.pcolormesh(lons, lats, data, cmap=cmap, norm=norm, shading='auto', transform=ccrs.PlateCarree())
+        fig.colorbar(mesh, ax=ax, orientation='horizontal', pad=0.05, label=label)
+        ax.set_title(title)
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+    fig.savefig(output_file)
+    plt.close(fig)
+    print(f"Saved map as {output_file}")
+
+def main():
+    data_dir = r"D:\pycharm\dongliqixiangxue\era5"
+    event_file = r"D:\pycharm\dongliqixiangxue\single levels.nc"
+    output_dir = r"D:\新建文件夹\extremes"
+    event_start, event_end = '2021-07-17 00:00', '2021-07-22 23:00'
+
+    os.makedirs(output_dir, exist_ok=True)
+    catalog = era5_catalog.build_catalog(data_dir, catalog_file=os.path.join(data_dir, 'era5_catalog.json'))
+    result = annual_maxima(catalog)
+    params = fit_chunks(result['maxima'])
+    levels = return_level(*params)
+    save_extremes(result, params, levels, os.path.join(output_dir, 'gev_tp.nc'))
+
+    lons, lats = result['longitude'], result['latitude']
+    event = event_maxima(event_file, result['durations'], event_start, event_end, lats=lats, lons=lons)
+    for j, duration in enumerate(result['durations']):
+        panels = [(levels[i, j], f'{duration}小时降水 {period}年一遇', '重现水平 (mm)')
+                  for i, period in enumerate(RETURN_PERIODS)]
+        plot_maps(lons, lats, panels, os.path.join(output_dir, f'return_level_{duration}h.png'))
+    periods = return_period(event, *params)
+    panels = [(np.clip(periods[j], 1, 1e4), f'本次过程{duration}小时最大降水的重现期', '重现期 (年)')
+              for j, duration in enumerate(result['durations'])]
+    plot_maps(lons, lats, panels, os.path.join(output_dir, 'event_return_period.png'),
+              norm=LogNorm(vmin=1, vmax=1e4), cmap='magma_r')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+import shapely
+import era5_catalog
+import shared_data
+import preview
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+MARGIN = 0.5  # 区域外接范围的边距 (度)
+
+# 每个区域输出的产品：中间场名称、标题、色标标签、色表
+PRODUCTS = {
+    'cumulative_precipitation': {'field': 'total', 'title': '累计降水量图', 'label': '累计降水量 (mm)', 'cmap': 'Blues'},
+    'max_hourly_precipitation': {'field': 'max_hourly', 'title': '最大小时降水量图', 'label': '最大小时降水量 (mm)', 'cmap': 'Blues'},
+}
+
+def resolve_region(name):
+    # 区域名先按省、再按市查找，返回查询参数和边界几何
+    for query in ({'province': name}, {'city': name}):
+        try:
+            polygon = cnmaps.get_adm_maps(record='first', only_polygon=True, **query)
+        except Exception:
+            continue
+        return {'name': name, 'query': query, 'geometry': getattr(polygon, 'geom', polygon)}
+    raise KeyError(f"区域未找到: {name}")
+
+def resolve_regions(names):
+    # names为区域名列表；'全部省份'展开为cnmaps中的全部省级行政区
+    regions = []
+    for name in names:
+        if name == '全部省份':
+            regions.extend(resolve_region(province) for province in cnmaps.get_adm_names(level='省'))
+        else:
+            regions.append(resolve_region(name))
+    return regions
+
+def region_extent(region, margin=MARGIN):
+    lon_min, lat_min, lon_max, lat_max = region['geometry'].bounds
+    return [lon_min - margin, lon_max + margin, lat_min - margin, lat_max + margin]
+
+def union_extent(regions, margin=MARGIN):
+    extents = np.array([region_extent(region, margin) for region in regions])
+    return [extents[:, 0].min(), extents[:, 1].max(), extents[:, 2].min(), extents[:, 3].max()]
+
+def region_masks(regions, lats, lons):
+    # (区域, 纬度, 经度)布尔掩膜；小于一个格点的区域取离其代表点最近的格点
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    masks = np.zeros((len(regions),) + lon_grid.shape, dtype=bool)
+    for i, region in enumerate(regions):
+        masks[i] = shapely.contains_xy(region['geometry'], lon_grid, lat_grid)
+        if not masks[i].any():
+            point = region['geometry'].representative_point()
+            nearest = np.argmin((lon_grid - point.x) ** 2 + (lat_grid - point.y) ** 2)
+            masks[i].flat[nearest] = True
+    return masks
+
+def read_union(file_path, extent, variable='tp', start=None, end=None):
+    # 所有区域的并集范围只读一次
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        times = era5_catalog.read_times(dataset)
+        keep = np.ones(len(times), dtype=bool)
+        if start is not None:
+            keep &= times >= pd.Timestamp(start)
+        if end is not None:
+            keep &= times <= pd.Timestamp(end)
+        index = np.flatnonzero(keep)
+        time_slice = slice(index[0], index[-1] + 1)
+        try:
+            lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+            lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+        except KeyError as e:
+            raise KeyError(f"变量未找到: {e}")
+        mask = era5_catalog.region_mask(lats, lons, lon_range=extent[:2], lat_range=extent[2:])
+        lat_slice, lon_slice = era5_catalog.mask_bounds(mask)
+        if variable not in dataset.variables:
+            raise KeyError(f"变量未找到: {variable}")
+        data = era5_catalog.read_block(dataset, variable, time_slice, lat_slice, lon_slice)
+    finally:
+        dataset.close()
+    return times[time_slice], lats[lat_slice], lons[lon_slice], data
+
+def region_statistics(precip, times, lats, masks, names):
+    # 全部区域一次矩阵乘：面积加权的区域平均逐时降水(时间, 区域)，以及各区域的汇总表
+    weights = masks * np.cos(np.radians(lats))[np.newaxis, :, np.newaxis]
+    weights = weights.reshape(len(names), -1)
+    flat = np.nan_to_num(precip.reshape(precip.shape[0], -1))
+    hourly = pd.DataFrame(flat @ weights.T / weights.sum(axis=1), index=times, columns=names)
+
+    total = flat.sum(axis=0)
+    peak = flat.max(axis=0)
+    peak_time = flat.argmax(axis=0)
+    rows = []
+    for name, mask in zip(names, masks.reshape(len(names), -1)):
+        cell = np.flatnonzero(mask)[np.argmax(peak[mask])]
+        rows.append({
+            'region': name,
+            'n_cells': int(mask.sum()),
+            'mean_total_mm': hourly[name].sum(),
+            'max_total_mm': total[mask].max(),
+            'max_hourly_mm': peak[cell],
+            'max_hourly_time': times[peak_time[cell]],
+            'mean_peak_hour': hourly[name].idxmax(),
+        })
+    return hourly, pd.DataFrame(rows)
+
+def _render_region(region, extent, levels, output_dir):
+    # 工作进程：从共享内存中裁出本区域范围，绘制各产品
+    lons = shared_data.get('lons')
+    lats = shared_data.get('lats')
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    boundary = cnmaps.get_adm_maps(**region['query'])
+    written = []
+    for product, spec in PRODUCTS.items():
+        crop_lons, crop_lats, data = preview.crop_to_extent(lon_grid, lat_grid, shared_data.get(spec['field']), extent)
+        fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+        mesh = ax.pcolormesh(crop_lons, crop_lats, data, cmap=spec['cmap'], shading='auto', transform=ccrs.PlateCarree(),
+                             vmin=levels[product][0], vmax=levels[product][1])
+        fig.colorbar(mesh, ax=ax, label=spec['label'])
+        ax.set_title(f"{region['name']}{spec['title']}")
+        ax.set_xlabel('经度')
+        ax.set_ylabel('纬度')
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(boundary, ax=ax, linewidth=1.0, color='black')
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        output_file = os.path.join(output_dir, f'{product}.png')
+        fig.savefig(output_file)
+        plt.close(fig)
+        written.append(output_file)
+    return written
+
+def fan_out(file_path, region_names, output_dir, start=None, end=None, workers=None):
+    # 读取一次、中间场计算一次，各区域的裁剪出图在进程池中并行
+    regions = resolve_regions(region_names)
+    names = [region['name'] for region in regions]
+    times, lats, lons, tp = read_union(file_path, union_extent(regions), 'tp', start, end)
+    precip = tp * 1000.0  # m -> mm
+    fields = {'total': np.nansum(precip, axis=0), 'max_hourly': np.nanmax(precip, axis=0)}
+
+    masks = region_masks(regions, lats, lons)
+    hourly, summary = region_statistics(precip, times, lats, masks, names)
+    os.makedirs(output_dir, exist_ok=True)
+    hourly.to_csv(os.path.join(output_dir, 'region_hourly_precipitation.csv'), encoding='utf-8-sig')
+    summary.to_csv(os.path.join(output_dir, 'region_summary.csv'), index=False, encoding='utf-8-sig')
+
+    # 色标范围对所有区域统一，区域间可直接比较
+    levels = {product: (float(np.nanmin(fields[spec['field']])), float(np.nanmax(fields[spec['field']])))
+              for product, spec in PRODUCTS.items()}
+    tasks = []
+    for region in regions:
+        region_dir = os.path.join(output_dir, region['name'])
+        os.makedirs(region_dir, exist_ok=True)
+        task = {'name': region['name'], 'query': region['query']}
+        tasks.append((task, region_extent(region), region_dir))
+
+    with shared_data.SharedArrayBroker() as broker:
+        broker.put('lons', lons)
+        broker.put('lats', lats)
+        for name, field in fields.items():
+            broker.put(name, field, dtype=np.float32)
+        with broker.pool(workers) as executor:
+            futures = [executor.submit(_render_region, task, extent, levels, region_dir)
+                       for task, extent, region_dir in tasks]
+            for (task, _, region_dir), future in zip(tasks, futures):
+                future.result()
+                print(f"Saved {task['name']} products in {region_dir}")
+    return summary
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\single levels.nc"
+    output_dir = r"D:\新建文件夹\fanout"
+    region_names = ['河南省', '河北省', '山西省', '湖北省', '郑州市']  # 或 ['全部省份']
+
+    summary = fan_out(file_path, region_names, output_dir)
+    print(summary)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import cartopy.crs as ccrs
+import pandas as pd
+from scipy import ndimage
+import derived
+import era5_catalog
+from cross_section import haversine
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+EARTH_RADIUS = 6371000.0  # 地球半径 (m)
+JET_SPEED = 12.0  # 低空急流核风速下限 (m/s)
+JET_SHEAR = 4.0  # 急流层与上层风速差下限 (m/s)
+VORTICITY = 3e-5  # 低涡相对涡度下限 (s-1)
+
+# 时间方向不连通，每个时次内8邻域连通；一次label即可得到所有时次的特征
+STRUCTURE = np.zeros((3, 3, 3), dtype=bool)
+STRUCTURE[1] = True
+
+FEATURE_COLUMNS = ['time', 'kind', 'n_cells', 'area_km2', 'peak', 'peak_lat', 'peak_lon', 'centroid_lat', 'centroid_lon']
+
+def relative_vorticity(u, v, lats, lons):
+    # 球面相对涡度 ζ = [∂v/∂λ - ∂(u·cosφ)/∂φ] / (R·cosφ)，对所有时次一次计算
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat_rad)[:, np.newaxis]
+    dvdl = np.gradient(np.asarray(v, dtype=np.float64), lon_rad, axis=-1)
+    dudp = np.gradient(np.asarray(u, dtype=np.float64) * cos_lat, lat_rad, axis=-2)
+    dvdl -= dudp
+    dvdl /= EARTH_RADIUS * cos_lat
+    return dvdl
+
+def cell_area(lats, lons):
+    # 每个格点代表的面积 (km2)，形状(纬度, 经度)
+    dlat = np.radians(np.abs(np.gradient(np.asarray(lats, dtype=np.float64))))
+    dlon = np.radians(np.abs(np.gradient(np.asarray(lons, dtype=np.float64))))
+    return (EARTH_RADIUS / 1000.0) ** 2 * np.outer(dlat * np.cos(np.radians(lats)), dlon)
+
+def label_features(mask, values, times, lats, lons, kind, min_cells=4):
+    # mask/values: (时间, 纬度, 经度)。连通区域统计全部用bincount按标签一次完成，不按时次或特征循环
+    labels, n_features = ndimage.label(mask, structure=STRUCTURE)
+    if n_features == 0:
+        return pd.DataFrame(columns=FEATURE_COLUMNS)
+    t, y, x = np.nonzero(labels)
+    label = labels[t, y, x]
+    value = np.asarray(values)[t, y, x]
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    n_cells = np.bincount(label, minlength=n_features + 1)[1:]
+    area = np.bincount(label, weights=cell_area(lats, lons)[y, x], minlength=n_features + 1)[1:]
+    weight = np.abs(value)
+    weight_sum = np.bincount(label, weights=weight, minlength=n_features + 1)[1:]
+    centroid_lat = np.bincount(label, weights=weight * lats[y], minlength=n_features + 1)[1:] / weight_sum
+    centroid_lon = np.bincount(label, weights=weight * lons[x], minlength=n_features + 1)[1:] / weight_sum
+    time_index = np.bincount(label, weights=t, minlength=n_features + 1)[1:] / n_cells
+
+    # 每个特征的极值格点：按(标签, 数值)排序后取每组最后一个
+    order = np.lexsort((value, label))
+    last = order[np.r_[np.flatnonzero(np.diff(label[order])), order.size - 1]]
+
+    features = pd.DataFrame({
+        'time': pd.to_datetime(np.asarray(times))[np.round(time_index).astype(int)],
+        'kind': kind,
+        'n_cells': n_cells,
+        'area_km2': area,
+        'peak': value[last],
+        'peak_lat': lats[y[last]],
+        'peak_lon': lons[x[last]],
+        'centroid_lat': centroid_lat,
+        'centroid_lon': centroid_lon,
+    })
+    return features[features['n_cells'] >= min_cells].reset_index(drop=True)
+
+def detect_jets(u, v, u_upper, v_upper, times, lats, lons, speed=JET_SPEED, shear=JET_SHEAR, min_cells=4):
+    # 低空急流核：急流层风速≥speed，且比上层(如500 hPa)风速大shear以上
+    jet_speed = derived.evaluate('wind_speed', u=u, v=v)
+    upper_speed = derived.evaluate('wind_speed', u=u_upper, v=v_upper)
+    mask = (jet_speed >= speed) & (jet_speed - upper_speed >= shear)
+    return label_features(mask, jet_speed, times, lats, lons, 'jet', min_cells)
+
+def detect_vortices(u, v, times, lats, lons, threshold=VORTICITY, min_cells=4):
+    # 低涡：相对涡度超过阈值的连通区，特征强度为区内涡度极大值
+    vorticity = relative_vorticity(u, v, lats, lons)
+    return label_features(vorticity >= threshold, vorticity, times, lats, lons, 'vortex', min_cells)
+
+def link_tracks(features, max_distance_km=300.0, step=pd.Timedelta(hours=1)):
+    # 相邻时次的特征按质心距离就近配对，再用指针跳跃把配对链接成轨迹，全程向量化
+    features = features.sort_values('time').reset_index(drop=True)
+    n = len(features)
+    if n == 0:
+        return features.assign(track_id=pd.Series(dtype=np.int64))
+    times = features['time'].values
+    lat = features['centroid_lat'].to_numpy()
+    lon = features['centroid_lon'].to_numpy()
+
+    # 每个特征与下一时次所有特征组成候选对
+    starts = np.searchsorted(times, times + step.to_timedelta64(), side='left')
+    ends = np.searchsorted(times, times + step.to_timedelta64(), side='right')
+    counts = ends - starts
+    i = np.repeat(np.arange(n), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = starts[i] + offsets
+    distance = haversine(lon[i], lat[i], lon[j], lat[j])
+    pairs = pd.DataFrame({'i': i, 'j': j, 'distance': distance})
+    pairs = pairs[pairs['distance'] <= max_distance_km].sort_values('distance')
+    pairs = pairs.drop_duplicates('i').drop_duplicates('j')
+
+    previous = np.arange(n)
+    previous[pairs['j'].to_numpy()] = pairs['i'].to_numpy()
+    root = previous
+    while True:
+        next_root = root[root]
+        if np.array_equal(next_root, root):
+            break
+        root = next_root
+    features['track_id'] = pd.factorize(root)[0]
+    return features
+
+def summarize_tracks(features):
+    # 轨迹表：起止时间、持续时长、最强值及其时间、起止位置、移动距离
+    if features.empty:
+        return pd.DataFrame()
+    ordered = features.sort_values(['track_id', 'time'])
+    grouped = ordered.groupby('track_id')
+    strongest = ordered.loc[grouped['peak'].idxmax()].set_index('track_id')
+    first = grouped.first()
+    last = grouped.last()
+    tracks = pd.DataFrame({
+        'kind': first['kind'],
+        'start': first['time'],
+        'end': last['time'],
+        'duration_h': (last['time'] - first['time']) / pd.Timedelta(hours=1) + 1,
+        'max_peak': strongest['peak'],
+        'max_peak_time': strongest['time'],
+        'max_area_km2': grouped['area_km2'].max(),
+        'start_lat': first['centroid_lat'],
+        'start_lon': first['centroid_lon'],
+        'end_lat': last['centroid_lat'],
+        'end_lon': last['centroid_lon'],
+    })
+    tracks['distance_km'] = haversine(tracks['start_lon'], tracks['start_lat'], tracks['end_lon'], tracks['end_lat'])
+    return tracks.reset_index()
+
+def detect_from_catalog(catalog, start=None, end=None, jet_level=850, upper_level=500, vortex_level=850,
+                        lat_slice=slice(None), lon_slice=slice(None), chunk_hours=744):
+    # 多年运行：逐块读取各层u/v并检测，特征表拼接后统一追踪，跨块的轨迹也能连上
+    def chunks(variable, level):
+        return era5_catalog.iter_variable_chunks(catalog, variable, start, end, level, lat_slice, lon_slice, chunk_hours)
+
+    dataset = era5_catalog.load_dataset(era5_catalog.select_files(catalog, 'u')[0]['path'])
+    lats = np.asarray(dataset.variables['latitude'][:])[lat_slice]
+    lons = np.asarray(dataset.variables['longitude'][:])[lon_slice]
+    dataset.close()
+
+    tables = []
+    streams = zip(chunks('u', jet_level), chunks('v', jet_level), chunks('u', upper_level), chunks('v', upper_level))
+    for (times, u), (_, v), (_, u_upper), (_, v_upper) in streams:
+        tables.append(detect_jets(u, v, u_upper, v_upper, times, lats, lons))
+        if vortex_level == jet_level:
+            tables.append(detect_vortices(u, v, times, lats, lons))
+    if vortex_level != jet_level:
+        for (times, u), (_, v) in zip(chunks('u', vortex_level), chunks('v', vortex_level)):
+            tables.append(detect_vortices(u, v, times, lats, lons))
+    tables = [table for table in tables if not table.empty]
+    if not tables:
+        return pd.DataFrame(columns=FEATURE_COLUMNS + ['track_id'])
+    features = pd.concat(tables, ignore_index=True)
+    jets = link_tracks(features[features['kind'] == 'jet'])
+    vortices = link_tracks(features[features['kind'] == 'vortex'])
+    vortices['track_id'] += jets['track_id'].max() + 1 if len(jets) else 0
+    return pd.concat([jets, vortices], ignore_index=True)
+
+def draw_features(ax, features, current_time, history_hours=12):
+    # 叠加图层：当前时次的急流核(三角)和低涡(圆点)，以及过去history_hours小时的轨迹
+    if features is None or features.empty:
+        return
+    current_time = pd.Timestamp(current_time)
+    recent = features[(features['time'] <= current_time) &
+                      (features['time'] > current_time - pd.Timedelta(hours=history_hours))]
+    styles = {'jet': ('^', 'magenta', '急流核'), 'vortex': ('o', 'red', '低涡')}
+    for kind, (marker, color, label) in styles.items():
+        subset = recent[recent['kind'] == kind].sort_values('time')
+        now = subset[subset['time'] == current_time]
+        for _, track in subset.groupby('track_id'):
+            ax.plot(track['centroid_lon'], track['centroid_lat'], color=color, linewidth=1.2,
+                    transform=ccrs.PlateCarree())
+        if not now.empty:
+            ax.scatter(now['peak_lon'], now['peak_lat'], marker=marker, s=80, color=color, edgecolors='black',
+                       label=label, zorder=5, transform=ccrs.PlateCarree())
+
+def load_features(feature_file):
+    if not os.path.exists(feature_file):
+        raise FileNotFoundError(f"文件未找到: {feature_file}")
+    return pd.read_csv(feature_file, parse_dates=['time'])
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\ERA5 hourly data on pressure levels from 1940 to present.nc"
+    output_dir = r"D:\新建文件夹\features"
+    jet_level, upper_level, vortex_level = 850, 500, 850
+
+    os.makedirs(output_dir, exist_ok=True)
+    # 单个文件也按目录方式处理，多年数据只需把路径换成数据目录
+    data_dir = os.path.dirname(file_path) or '.'
+    catalog = era5_catalog.build_catalog(data_dir, pattern=os.path.basename(file_path))
+    features = detect_from_catalog(catalog, jet_level=jet_level, upper_level=upper_level, vortex_level=vortex_level)
+    tracks = summarize_tracks(features)
+
+    feature_file = os.path.join(output_dir, 'features.csv')
+    track_file = os.path.join(output_dir, 'tracks.csv')
+    features.to_csv(feature_file, index=False, encoding='utf-8-sig')
+    tracks.to_csv(track_file, index=False, encoding='utf-8-sig')
+    print(f"Saved {len(features)} features as {feature_file}")
+    print(f"Saved {len(tracks)} tracks as {track_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import xarray as xr
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import os
+import io
+import json
+import importlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+import contour_cache
+import subtropical_high
+import derived
+import watch
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+DEFAULT_EXTENT = [110, 115, 32, 37]
+
+# 产品定义：数据文件、变量、是否分层、标题、出图模块。
+# 每帧由出图模块的draw_frame绘制，与脚本生成的动图使用同一套色标层次、配色和图面
+PRODUCTS = {
+    'wind': {'source': 'pressure', 'variables': ('u', 'v'), 'level': True, 'title': '风场', 'module': '500-700-850hpa风场'},
+    'rh': {'source': 'pressure', 'variables': ('r',), 'level': True, 'title': '相对湿度', 'module': '相对湿度场'},
+    'height': {'source': 'pressure', 'variables': ('z',), 'level': True, 'title': '位势高度', 'module': '500hpa高度场'},
+    'tp': {'source': 'single', 'variables': ('tp',), 'level': False, 'title': '降水量', 'module': 'watch'},
+    'temp_diff': {'source': 'single', 'variables': ('t2m', 'd2m'), 'level': False, 'title': '2米温度和露点温度差', 'module': '2米温度和露点温度差'},
+}
+# 出图脚本的文件名不是合法的标识符，用importlib导入
+PRODUCT_MODULES = {name: importlib.import_module(spec['module']) for name, spec in PRODUCTS.items()}
+
+class LRUCache:
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+def load_dataset(file_path):
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件未找到: {file_path}")
+    try:
+        dataset = xr.open_dataset(file_path)
+    except OSError as e:
+        raise RuntimeError(f"无法打开文件: {e}")
+    return dataset
+
+def time_name(dataset):
+    return 'valid_time' if 'valid_time' in dataset.coords else 'time'
+
+def product_field(product, fields):
+    # 由原始变量得到绘制的物理量，fields中的数组第一维为时间
+    if product == 'wind':
+        return derived.evaluate('wind_speed', u=fields['u'], v=fields['v'])
+    if product == 'height':
+        return subtropical_high.geopotential_height(fields['z'])
+    if product == 'tp':
+        return fields['tp'] * watch.PRODUCTS['tp']['scale']  # m -> mm
+    if product == 'temp_diff':
+        return derived.evaluate('dewpoint_depression', t=fields['t2m'], td=fields['d2m'])
+    return fields[PRODUCTS[product]['variables'][0]]
+
+def region_extent(region):
+    # 区域名(省/市)或None；用行政边界外接范围并留0.5度边距
+    if region is None:
+        return DEFAULT_EXTENT
+    for query in ({'province': region}, {'city': region}):
+        try:
+            polygon = cnmaps.get_adm_maps(record='first', only_polygon=True, **query)
+        except Exception:
+            continue
+        lon_min, lat_min, lon_max, lat_max = getattr(polygon, 'geom', polygon).bounds
+        return [lon_min - 0.5, lon_max + 0.5, lat_min - 0.5, lat_max + 0.5]
+    raise KeyError(f"区域未找到: {region}")
+
+class FrameRenderer:
+    # 常驻进程：数据集只打开一次，渲染结果和中间场放在LRU缓存中，多请求由线程池并发处理
+
+    def __init__(self, file_paths, workers=4, max_frames=256, max_fields=64):
+        self.datasets = {source: load_dataset(path) for source, path in file_paths.items()}
+        self.frames = LRUCache(max_frames)
+        self.fields = LRUCache(max_fields)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._read_lock = threading.Lock()  # HDF5读取不是线程安全的
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._boundaries = {}
+        self._levels = {}
+        self._levels_lock = threading.Lock()
+
+    def close(self):
+        self.executor.shutdown()
+        for dataset in self.datasets.values():
+            dataset.close()
+
+    def read_fields(self, product, time, level):
+        key = (product, time, level)
+        fields = self.fields.get(key)
+        if fields is not None:
+            return fields
+        spec = PRODUCTS[product]
+        dataset = self.datasets[spec['source']]
+        selection = {time_name(dataset): time}
+        if spec['level']:
+            selection['pressure_level'] = level
+        with self._read_lock:
+            subset = dataset.sel(selection)
+            fields = {name: subset[name].values.astype(np.float64) for name in spec['variables']}
+            fields['lons'] = dataset['longitude'].values
+            fields['lats'] = dataset['latitude'].values
+        self.fields.put(key, fields)
+        return fields
+
+    def boundaries(self):
+        if not self._boundaries:
+            self._boundaries['henan'] = cnmaps.get_adm_maps(province='河南省')
+            self._boundaries['zhengzhou'] = cnmaps.get_adm_maps(city='郑州市')
+        return self._boundaries
+
+    def levels(self, product, level):
+        # 色标层次与脚本出图相同：降水用watch的固定层次，其余取整个时段的范围；每个(产品, 层次)只算一次
+        key = (product, level)
+        with self._levels_lock:
+            if key in self._levels:
+                return self._levels[key]
+            if product == 'tp':
+                levels = np.asarray(watch.PRODUCTS['tp']['levels'], dtype=np.float64)
+            else:
+                spec = PRODUCTS[product]
+                dataset = self.datasets[spec['source']]
+                with self._read_lock:
+                    subset = dataset.sel(pressure_level=level) if spec['level'] else dataset
+                    fields = {name: subset[name].values.astype(np.float64) for name in spec['variables']}
+                series = product_field(product, fields)
+                if product == 'rh':
+                    levels = PRODUCT_MODULES['rh'].humidity_levels(series)
+                elif product == 'height':
+                    levels = PRODUCT_MODULES['height'].height_levels(series)
+                else:
+                    levels = contour_cache.contour_levels(series)
+            self._levels[key] = levels
+        return levels
+
+    def render(self, product, time, level, region):
+        fields = self.read_fields(product, time, level)
+        spec = PRODUCTS[product]
+        module = PRODUCT_MODULES[product]
+        extent = region_extent(region)
+        levels = self.levels(product, level)
+        data = product_field(product, {name: fields[name][np.newaxis] for name in spec['variables']})[0]
+        if product == 'tp':
+            # 与watch.update相同：超过最高层次的值归入最高一档
+            data = np.minimum(data, levels[-1])
+        lon_grid, lat_grid = np.meshgrid(fields['lons'], fields['lats'])
+        cache_file = contour_cache.contour_file(lon_grid, lat_grid, data, levels)
+
+        # 使用Figure对象而非pyplot，多个线程可同时渲染
+        fig = Figure(figsize=(12, 8))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(projection=ccrs.PlateCarree())
+        current_time = pd.Timestamp(time)
+        level_text = f'{level:g}' if spec['level'] else None
+        boundaries = self.boundaries()
+        if product == 'wind':
+            module.draw_frame(ax, fields['lons'], fields['lats'], fields['u'], fields['v'], cache_file, levels,
+                              current_time, level_text, boundaries, extent)
+        elif product == 'rh':
+            module.draw_frame(ax, cache_file, levels, current_time, level_text, boundaries, extent=extent)
+        elif product == 'height':
+            module.draw_frame(ax, cache_file, levels, level_text, boundaries, current_time, extent=extent)
+        elif product == 'tp':
+            module.draw_frame(ax, cache_file, levels, current_time, watch.PRODUCTS['tp'], boundaries, extent)
+        else:
+            module.draw_frame(ax, cache_file, levels, current_time, boundaries, extent)
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        return buffer.getvalue()
+
+    def get_frame(self, product, time, level=None, region=None):
+        if product not in PRODUCTS:
+            raise KeyError(f"未知产品: {product}")
+        if PRODUCTS[product]['level'] and level is None:
+            raise ValueError(f"产品 {product} 需要指定气压层 level")
+        time = pd.Timestamp(time).to_datetime64()
+        level = float(level) if level is not None else None
+        key = (product, time, level, region)
+        png = self.frames.get(key)
+        if png is not None:
+            return png
+
+        # 同一帧的并发请求只渲染一次；结果先放入缓存再移出等待表，任何时刻都能在两者之一找到
+        with self._pending_lock:
+            png = self.frames.get(key)
+            if png is not None:
+                return png
+            future = self._pending.get(key)
+            if future is None:
+                future = self.executor.submit(self.render, product, time, level, region)
+                self._pending[key] = future
+        try:
+            png = future.result()
+        except Exception:
+            with self._pending_lock:
+                self._pending.pop(key, None)
+            raise
+        with self._pending_lock:
+            self.frames.put(key, png)
+            self._pending.pop(key, None)
+        return png
+
+def make_handler(renderer):
+    class FrameHandler(BaseHTTPRequestHandler):
+        # GET /frame?product=wind&time=2021-07-20T08:00&level=850&region=河南省
+        # GET /products
+
+        def send_text(self, status, text, content_type='text/plain; charset=utf-8'):
+            body = text.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            if url.path == '/products':
+                self.send_text(200, json.dumps(PRODUCTS, ensure_ascii=False), 'application/json; charset=utf-8')
+                return
+            if url.path != '/frame':
+                self.send_text(404, f"路径不存在: {url.path}")
+                return
+            try:
+                png = renderer.get_frame(query['product'], query['time'], query.get('level'), query.get('region'))
+            except KeyError as e:
+                self.send_text(404, f"未找到: {e}")
+                return
+            except ValueError as e:
+                self.send_text(400, f"请求参数错误: {e}")
+                return
+            except Exception as e:
+                self.send_text(500, f"渲染失败: {e}")
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(png)))
+            self.end_headers()
+            self.wfile.write(png)
+
+    return FrameHandler
+
+def main():
+    file_paths = {
+        'pressure': r"D:\pycharm\dongliqixiangxue\ERA5 hourly data on pressure levels from 1940 to present.nc",
+        'single': r"D:\pycharm\dongliqixiangxue\single levels.nc",
+    }
+    host, port = '127.0.0.1', 8765
+
+    renderer = FrameRenderer(file_paths)
+    server = ThreadingHTTPServer((host, port), make_handler(renderer))
+    print(f"Serving frames on http://{host}:{port}/frame?product=wind&time=2021-07-20T08:00&level=850")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        renderer.close()
+
+if __name__ == "__main__":
+    main()
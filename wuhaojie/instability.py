@@ -0,0 +1,312 @@
+import xarray as xr
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import os
+import hashlib
+import json
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+import era5_catalog
+import shared_data
+import contour_cache
+import preview
+from derived import RD, CP, KAPPA, EPSILON, T0
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+G0 = 9.80665  # 重力加速度 (m/s2)
+LV = 2.501e6  # 汽化潜热 (J/kg)
+
+# 输出的指数：名称、单位、色标
+INDICES = {
+    'cape': ('对流有效位能 CAPE', 'J/kg', 'YlOrRd'),
+    'cin': ('对流抑制能量 CIN', 'J/kg', 'Blues_r'),
+    'lcl_pressure': ('抬升凝结高度气压', 'hPa', 'viridis_r'),
+    'lcl_height': ('抬升凝结高度', 'm', 'viridis'),
+    'k_index': ('K指数', '°C', 'RdYlBu_r'),
+    'lifted_index': ('抬升指数 LI', '°C', 'RdBu'),
+    'pw': ('大气可降水量', 'mm', 'GnBu'),
+}
+
+def saturation_vapor_pressure(t):
+    # Bolton (1980)，t为开尔文，返回Pa
+    return 611.2 * np.exp(17.67 * (t - T0) / (t - T0 + 243.5))
+
+def saturation_mixing_ratio(t, p):
+    es = saturation_vapor_pressure(t)
+    return EPSILON * es / np.maximum(p - es, 1.0)
+
+def dewpoint(q, p):
+    # 由比湿和气压求露点 (K)
+    e = np.maximum(q, 1e-10) * p / (EPSILON + (1.0 - EPSILON) * np.maximum(q, 1e-10))
+    ln_ratio = np.log(e / 611.2)
+    return 243.5 * ln_ratio / (17.67 - ln_ratio) + T0
+
+def virtual_temperature(t, r):
+    return t * (1.0 + r / EPSILON) / (1.0 + r)
+
+def moist_lapse_rate(t, p):
+    # 假绝热过程 dT/dp
+    rs = saturation_mixing_ratio(t, p)
+    return (RD * t + LV * rs) / (p * (CP + LV * LV * rs * EPSILON / (RD * t * t)))
+
+def lifting_condensation_level(t, td, p):
+    # Bolton (1980) 公式(15)的抬升凝结温度，以及沿干绝热线到达该温度的气压
+    t_lcl = 1.0 / (1.0 / (td - 56.0) + np.log(t / td) / 800.0) + 56.0
+    p_lcl = p * (t_lcl / t) ** (1.0 / KAPPA)
+    return t_lcl, p_lcl
+
+def level_index(levels, level):
+    matches = np.flatnonzero(np.isclose(levels, level * 100.0))
+    return int(matches[0]) if matches.size else None
+
+def column_indices(t, q, z, levels, sp=None, substeps=4):
+    # t/q/z: (层, 列)，层按气压从大到小排列，levels单位Pa；sp为地面气压(列)，低于地面的层不参与计算。
+    # 气块抬升对所有列同时进行，只在层之间循环
+    n_levels, n_columns = t.shape
+    p = levels[:, np.newaxis]
+    columns = np.arange(n_columns)
+    if sp is None:
+        start = np.zeros(n_columns, dtype=np.int64)
+    else:
+        start = np.minimum(np.argmax(levels[:, np.newaxis] <= sp[np.newaxis, :], axis=0), n_levels - 2)
+    above = np.arange(n_levels)[:, np.newaxis] >= start[np.newaxis, :]
+
+    # 起始气块取地面以上第一层
+    t0 = t[start, columns]
+    q0 = np.maximum(q[start, columns], 1e-10)
+    p0 = levels[start]
+    r0 = q0 / (1.0 - q0)
+    td0 = dewpoint(q0, p0)
+    t_lcl, p_lcl = lifting_condensation_level(t0, np.minimum(td0, t0), p0)
+
+    # 气块温度：LCL以下沿干绝热，以上沿湿绝热逐层积分(RK2，层间再细分substeps步)
+    parcel = np.empty_like(t)
+    moist_t = t_lcl.copy()
+    moist_p = p_lcl.copy()
+    for k in range(n_levels):
+        target = np.minimum(levels[k], moist_p)
+        dp = (target - moist_p) / substeps
+        for _ in range(substeps):
+            half = moist_t + 0.5 * dp * moist_lapse_rate(moist_t, moist_p)
+            moist_t = moist_t + dp * moist_lapse_rate(half, moist_p + 0.5 * dp)
+            moist_p = moist_p + dp
+        dry = t0 * (levels[k] / p0) ** KAPPA
+        parcel[k] = np.where(levels[k] >= p_lcl, dry, moist_t)
+
+    r_parcel = np.where(p >= p_lcl, r0, saturation_mixing_ratio(parcel, p))
+    r_env = np.maximum(q, 0.0) / (1.0 - np.maximum(q, 0.0))
+    buoyancy = virtual_temperature(parcel, r_parcel) - virtual_temperature(t, r_env)
+
+    # 层积分：相邻两层梯形，dlnp加权；只累计起始层以上的层
+    valid = above[:-1] & above[1:]
+    layer = RD * 0.5 * (buoyancy[:-1] + buoyancy[1:]) * np.log(levels[:-1] / levels[1:])[:, np.newaxis]
+    layer = np.where(valid, layer, 0.0)
+    free = (layer > 0) & (levels[1:, np.newaxis] <= p_lcl)
+    reached = np.cumsum(free, axis=0) > 0
+    has_lfc = reached[-1]
+    cape = np.where(has_lfc, np.sum(np.where(reached & (layer > 0), layer, 0.0), axis=0), 0.0)
+    cin = np.where(has_lfc, np.sum(np.where(~reached & (layer < 0), layer, 0.0), axis=0), 0.0)
+
+    # 可降水量 (mm)
+    pw = np.sum(np.where(valid, 0.5 * (q[:-1] + q[1:]) * (levels[:-1] - levels[1:])[:, np.newaxis], 0.0), axis=0) / G0
+
+    # LCL高度：在相邻层间按lnp插值位势，减去起始层
+    k = np.clip(np.sum(levels[:, np.newaxis] >= p_lcl, axis=0) - 1, start, n_levels - 2)
+    weight = np.log(levels[k] / p_lcl) / np.log(levels[k] / levels[k + 1])
+    z_lcl = z[k, columns] + weight * (z[k + 1, columns] - z[k, columns])
+    lcl_height = (z_lcl - z[start, columns]) / G0
+
+    result = {
+        'cape': cape,
+        'cin': cin,
+        'lcl_pressure': p_lcl / 100.0,
+        'lcl_height': lcl_height,
+        'pw': pw,
+    }
+    i850, i700, i500 = (level_index(levels, level) for level in (850, 700, 500))
+    if None not in (i850, i700, i500):
+        td = dewpoint(q, p)
+        result['k_index'] = (t[i850] - t[i500]) + (td[i850] - T0) - (t[i700] - td[i700])
+        result['lifted_index'] = t[i500] - parcel[i500]
+    else:
+        result['k_index'] = np.full(n_columns, np.nan)
+        result['lifted_index'] = np.full(n_columns, np.nan)
+    return result
+
+def _indices_chunk(time_slice, order, levels, substeps, has_sp):
+    # 工作进程：从共享内存取一个时间块，按气压从大到小整理成(层, 列)后计算
+    fields = [shared_data.get(name)[time_slice] for name in ('t', 'q', 'z')]
+    shape = fields[0].shape
+    columns = [np.moveaxis(field[:, order], 1, 0).reshape(shape[1], -1).astype(np.float64) for field in fields]
+    sp = shared_data.get('sp')[time_slice].reshape(-1).astype(np.float64) if has_sp else None
+    result = column_indices(*columns, levels[order], sp=sp, substeps=substeps)
+    return {name: value.reshape((shape[0],) + shape[2:]).astype(np.float32) for name, value in result.items()}
+
+def load_surface_pressure(broker, surface_file, times, lats, lons):
+    # 从单层文件读取与气压层数据相同时次、相同格点的地面气压sp (Pa)，放入共享内存
+    dataset = era5_catalog.load_dataset(surface_file)
+    try:
+        if 'sp' not in dataset.variables:
+            raise KeyError("变量未找到: sp")
+        position = era5_catalog.read_times(dataset).get_indexer(times)
+        if (position < 0).any() or np.any(np.diff(position) != 1):
+            raise ValueError(f"地面气压文件缺少部分时次: {surface_file}")
+        sp_lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+        sp_lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+        mask = era5_catalog.region_mask(sp_lats, sp_lons, lon_range=(lons.min(), lons.max()),
+                                        lat_range=(lats.min(), lats.max()))
+        lat_slice, lon_slice = era5_catalog.mask_bounds(mask)
+        if sp_lats[lat_slice].size != lats.size or sp_lons[lon_slice].size != lons.size:
+            raise ValueError(f"地面气压与气压层数据的网格不一致: {surface_file}")
+        broker.load_variable('sp', dataset.variables['sp'], (lat_slice, lon_slice),
+                             time_slice=slice(position[0], position[-1] + 1))
+    finally:
+        dataset.close()
+
+def compute_indices(file_path, start=None, end=None, lon_range=None, lat_range=None, chunk=6, workers=None, substeps=4,
+                    surface_file=None):
+    # surface_file为含sp的单层文件：气块从地面以上第一层起抬升，地形以下的层(外推值)不参与计算
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        times = era5_catalog.read_times(dataset)
+        keep = np.ones(len(times), dtype=bool)
+        if start is not None:
+            keep &= times >= pd.Timestamp(start)
+        if end is not None:
+            keep &= times <= pd.Timestamp(end)
+        time_index = np.flatnonzero(keep)
+        time_slice = slice(time_index[0], time_index[-1] + 1)
+        try:
+            lats = dataset.variables['latitude'][:]
+            lons = dataset.variables['longitude'][:]
+            levels = np.asarray(dataset.variables['pressure_level'][:], dtype=np.float64)
+        except KeyError as e:
+            raise KeyError(f"变量未找到: {e}")
+        lat_slice, lon_slice = era5_catalog.mask_bounds(era5_catalog.region_mask(lats, lons, lon_range=lon_range, lat_range=lat_range))
+        order = np.argsort(-levels)  # 气压从大到小(自下而上)
+
+        with shared_data.SharedArrayBroker() as broker:
+            for name in ('t', 'q', 'z'):
+                if name not in dataset.variables:
+                    raise KeyError(f"变量未找到: {name}")
+                broker.load_variable(name, dataset.variables[name], (slice(None), lat_slice, lon_slice), time_slice=time_slice)
+            if surface_file is not None:
+                load_surface_pressure(broker, surface_file, times[time_slice], np.asarray(lats[lat_slice], dtype=np.float64),
+                                      np.asarray(lons[lon_slice], dtype=np.float64))
+            n_times = time_index.size
+            with broker.pool(workers) as executor:
+                futures = [executor.submit(_indices_chunk, slice(i, i + chunk), order, levels * 100.0, substeps,
+                                           surface_file is not None)
+                           for i in range(0, n_times, chunk)]
+                parts = [future.result() for future in futures]
+    finally:
+        dataset.close()
+
+    coords = {'time': times[time_slice], 'latitude': np.asarray(lats[lat_slice]), 'longitude': np.asarray(lons[lon_slice])}
+    variables = {}
+    for name, (long_name, units, _) in INDICES.items():
+        data = np.concatenate([part[name] for part in parts])
+        variables[name] = (('time', 'latitude', 'longitude'), data, {'long_name': long_name, 'units': units})
+    return xr.Dataset(variables, coords=coords)
+
+def cache_file_name(file_path, start=None, end=None, lon_range=None, lat_range=None, surface_file=None):
+    # 缓存键：源文件(路径、大小、修改时间)+地面气压文件+时段+区域
+    stat = os.stat(file_path)
+    surface = None
+    if surface_file is not None:
+        surface_stat = os.stat(surface_file)
+        surface = [surface_file, surface_stat.st_size, surface_stat.st_mtime]
+    signature = json.dumps([file_path, stat.st_size, stat.st_mtime, surface, str(start), str(end), lon_range, lat_range])
+    return f'instability_{hashlib.sha1(signature.encode("utf-8")).hexdigest()[:12]}.nc'
+
+def get_indices(file_path, start=None, end=None, lon_range=None, lat_range=None, cache_dir='instability', workers=None,
+                surface_file=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, cache_file_name(file_path, start, end, lon_range, lat_range, surface_file))
+    if os.path.exists(cache_file):
+        return xr.open_dataset(cache_file)
+    indices = compute_indices(file_path, start, end, lon_range, lat_range, workers=workers, surface_file=surface_file)
+    encoding = {name: {'zlib': True, 'complevel': 4} for name in INDICES}
+    indices.to_netcdf(cache_file, encoding=encoding)
+    print(f"Saved instability indices as {cache_file}")
+    return indices
+
+def save_index_frames(lon_grid, lat_grid, field, time_points, output_dir, name, frames=None, extent=(110, 115, 32, 37)):
+    long_name, units, cmap = INDICES[name]
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+
+    # 与其它产品相同：固定层次的等值线在工作进程中预先生成并缓存
+    field = np.asarray(field)
+    levels = contour_cache.contour_levels(field)
+    frames = preview.selected_frames(len(time_points), frames)
+    contour_files = dict(zip(frames, contour_cache.precompute_contours(lon_grid, lat_grid, field[frames], levels)))
+
+    for frame in frames:
+        current_time = pd.to_datetime(time_points[frame])
+
+        fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+        ax.set_extent(extent, crs=ccrs.PlateCarree())  # 设置经纬度范围
+        contour = contour_cache.draw_cached_contours(ax, contour_files[frame], levels, cmap=cmap, alpha=0.7)
+        plt.colorbar(contour, ax=ax, orientation='horizontal', pad=0.05, label=f'{long_name} ({units})')
+        ax.set_title(f'{long_name} {current_time.strftime("%Y-%m-%d %H:%M")}')
+        ax.set_xlabel('经度')
+        ax.set_ylabel('纬度')
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+
+        fig.savefig(os.path.join(output_dir, f'{name}_{current_time.strftime("%Y%m%d%H%M")}.png'))
+        plt.close(fig)
+
+def create_animation_from_images(output_dir, output_file):
+    fig, ax = plt.subplots(figsize=(12, 8))
+    images = []
+
+    for frame in sorted(os.listdir(output_dir)):
+        if frame.endswith('.png'):
+            img = plt.imread(os.path.join(output_dir, frame))
+            images.append([plt.imshow(img, animated=True)])
+
+    ani = animation.ArtistAnimation(fig, images, interval=200, repeat=False)
+    ani.save(output_file, writer='pillow', fps=3)
+    plt.close(fig)
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\ERA5 hourly data on pressure levels from 1940 to present.nc"
+    surface_file = r"D:\pycharm\dongliqixiangxue\single levels.nc"
+    output_dir = r"D:\新建文件夹\instability"
+    start, end = '2021-07-17', '2021-07-23'
+    products = ('cape', 'k_index', 'pw')
+    # 出图模式：'preview'只生成所有时次的缩略总览图；'full'出完整质量的帧，promote_frames指定只升级部分帧(None为全部)
+    render_mode = 'full'
+    promote_frames = None
+
+    os.makedirs(output_dir, exist_ok=True)
+    indices = get_indices(file_path, start, end, cache_dir=os.path.join(output_dir, 'cache'), surface_file=surface_file)
+    lon_grid, lat_grid = np.meshgrid(indices['longitude'].values, indices['latitude'].values)
+    time_points = pd.to_datetime(indices['time'].values)
+
+    for name in products:
+        field = indices[name].values
+        if render_mode == 'preview':
+            long_name, units, cmap = INDICES[name]
+            preview.contact_sheet(lon_grid, lat_grid, field, time_points, contour_cache.contour_levels(field), cmap,
+                                  long_name, units, os.path.join(output_dir, f'{name}_preview.png'))
+            continue
+        frames_dir = os.path.join(output_dir, name)
+        os.makedirs(frames_dir, exist_ok=True)
+        save_index_frames(lon_grid, lat_grid, field, time_points, frames_dir, name, frames=promote_frames)
+        output_file = os.path.join(output_dir, f'{name}_animation.gif')
+        create_animation_from_images(frames_dir, output_file)
+        print(f"Saved {name} animation as {output_file}")
+    indices.close()
+
+if __name__ == "__main__":
+    main()
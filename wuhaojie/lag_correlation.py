@@ -0,0 +1,265 @@
+import netCDF4 as nc
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+from scipy import fft
+import era5_catalog
+from box_stats import QUANTITIES
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+# 约定：滞后k>0表示y落后x k小时，即corr(x[t], y[t+k])
+
+def lagged_products(x, y, max_lag):
+    # x, y: (时间, 格点)。用FFT一次得到所有滞后的Σx[t]·y[t+k]，补零长度≥T+max_lag避免循环卷绕
+    n = x.shape[0]
+    size = fft.next_fast_len(n + max_lag, real=True)
+    spectrum = np.conj(fft.rfft(x, size, axis=0))
+    spectrum *= fft.rfft(y, size, axis=0)
+    cross = fft.irfft(spectrum, size, axis=0)
+    lags = np.arange(-max_lag, max_lag + 1)
+    return lags, np.concatenate([cross[size - max_lag:], cross[:max_lag + 1]])
+
+def lagged_covariance(x, y, max_lag):
+    # x, y: (时间, 格点)距平，返回各滞后的互协方差
+    lags, cov = lagged_products(x, y, max_lag)
+    cov /= (x.shape[0] - np.abs(lags))[:, np.newaxis]
+    return lags, cov
+
+def lagged_statistics(x, y, max_lag=24, chunk=4096):
+    # x, y: (时间, ...)。按格点分块做FFT，返回各滞后的相关系数和y对x的回归系数，形状(滞后, ...)
+    shape = x.shape[1:]
+    x = np.asarray(x, dtype=np.float64).reshape(x.shape[0], -1)
+    y = np.asarray(y, dtype=np.float64).reshape(y.shape[0], -1)
+    corr = np.empty((2 * max_lag + 1, x.shape[1]))
+    slope = np.empty_like(corr)
+    for start in range(0, x.shape[1], chunk):
+        columns = slice(start, start + chunk)
+        xa = np.nan_to_num(x[:, columns] - np.nanmean(x[:, columns], axis=0))
+        ya = np.nan_to_num(y[:, columns] - np.nanmean(y[:, columns], axis=0))
+        lags, cov = lagged_covariance(xa, ya, max_lag)
+        var_x = (xa ** 2).mean(axis=0)
+        var_y = (ya ** 2).mean(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr[:, columns] = cov / np.sqrt(var_x * var_y)
+            slope[:, columns] = cov / var_x
+    return lags, corr.reshape((-1,) + shape), slope.reshape((-1,) + shape)
+
+def aligned_chunks(catalog, x_name, y_name, start=None, end=None, chunk_hours=744):
+    # x、y同步逐块读取并换算单位，每次产出(times, x块, y块)
+    def chunks(name):
+        return era5_catalog.iter_variable_chunks(catalog, QUANTITIES[name]['source'], start, end,
+                                                 chunk_hours=chunk_hours)
+
+    for (times, x), (y_times, y) in zip(chunks(x_name), chunks(y_name)):
+        if not times.equals(y_times):
+            raise ValueError(f"{x_name} 与 {y_name} 的时次不一致")
+        yield times, x * QUANTITIES[x_name]['scale'], y * QUANTITIES[y_name]['scale']
+
+def hourly_means(catalog, x_name, y_name, start=None, end=None, chunk_hours=744, diurnal=True):
+    # 第一遍：x、y逐时(hour of day)平均，diurnal=False时24个时刻合为一个总平均，形状(24, 纬度, 经度)
+    sums, counts = None, None
+    for times, x, y in aligned_chunks(catalog, x_name, y_name, start, end, chunk_hours):
+        hours = times.hour.to_numpy() if diurnal else np.zeros(len(times), dtype=np.int64)
+        if sums is None:
+            sums = [np.zeros((24,) + x.shape[1:]) for _ in range(2)]
+            counts = [np.zeros((24,) + x.shape[1:]) for _ in range(2)]
+        for total, count, block in zip(sums, counts, (x, y)):
+            np.add.at(total, hours, np.nan_to_num(block))
+            np.add.at(count, hours, np.isfinite(block))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = [total / count for total, count in zip(sums, counts)]
+    if not diurnal:
+        means = [np.broadcast_to(mean[:1], mean.shape) for mean in means]
+    return means
+
+def lagged_from_catalog(catalog, x_name='mfc', y_name='tp', max_lag=24, start=None, end=None, chunk_hours=744,
+                        diurnal=True):
+    # 多年资料逐时间块流式计算，内存只占一个块加上max_lag帧的衔接，与记录长度无关。
+    # 第一遍求逐时平均；第二遍累计各滞后的交叉乘积：本块与上一块末尾max_lag帧拼成窗口，
+    # 窗口内全部配对减去只在尾部内部的配对(上一块已计入)，即为新增配对，仍用FFT一次得到所有滞后。
+    # 时次不连续(缺测时段)时不跨越间隔配对
+    means = hourly_means(catalog, x_name, y_name, start, end, chunk_hours, diurnal)
+    lags = np.arange(-max_lag, max_lag + 1)
+    products, pairs = 0.0, np.zeros(lags.size)
+    sum_squares, n = [0.0, 0.0], 0
+    tail_x = tail_y = None
+    last_time = None
+    for times, x, y in aligned_chunks(catalog, x_name, y_name, start, end, chunk_hours):
+        shape = x.shape[1:]
+        hours = times.hour.to_numpy()
+        xa = np.nan_to_num(x - means[0][hours]).reshape(len(times), -1)
+        ya = np.nan_to_num(y - means[1][hours]).reshape(len(times), -1)
+        if tail_x is None or times[0] - last_time != pd.Timedelta(hours=1):
+            tail_x, tail_y = xa[:0], ya[:0]
+        window_x = np.concatenate([tail_x, xa])
+        window_y = np.concatenate([tail_y, ya])
+        _, window_products = lagged_products(window_x, window_y, max_lag)
+        products = products + window_products
+        pairs += np.maximum(window_x.shape[0] - np.abs(lags), 0)
+        if tail_x.shape[0]:
+            products -= lagged_products(tail_x, tail_y, max_lag)[1]
+            pairs -= np.maximum(tail_x.shape[0] - np.abs(lags), 0)
+        sum_squares[0] += (xa ** 2).sum(axis=0)
+        sum_squares[1] += (ya ** 2).sum(axis=0)
+        n += len(times)
+        keep = max(0, window_x.shape[0] - max_lag)
+        tail_x, tail_y = window_x[keep:], window_y[keep:]
+        last_time = times[-1]
+
+    dataset = era5_catalog.load_dataset(era5_catalog.select_files(catalog, QUANTITIES[y_name]['source'])[0]['path'])
+    lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+    lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+    dataset.close()
+    cov = products / pairs[:, np.newaxis]
+    var_x, var_y = sum_squares[0] / n, sum_squares[1] / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = (cov / np.sqrt(var_x * var_y)).reshape((-1,) + shape)
+        slope = (cov / var_x).reshape((-1,) + shape)
+    return {'lags': lags, 'latitude': lats, 'longitude': lons, 'corr': corr, 'slope': slope,
+            'x': x_name, 'y': y_name}
+
+def region_weights(lats, lons, province=None, city=None):
+    # cos(纬度)面积权重，给定省/市时区域外为0
+    weights = np.repeat(np.cos(np.radians(np.asarray(lats, dtype=np.float64)))[:, np.newaxis], len(lons), axis=1)
+    if province is not None or city is not None:
+        weights *= era5_catalog.region_mask(lats, lons, province=province, city=city)
+    return weights
+
+def pattern_correlation(x, y, weights, lag=0):
+    # 逐时空间型相关：x[t]与y[t+lag]的加权中心化相关，返回长度为配对时次数的序列
+    if lag >= 0:
+        x, y = x[:x.shape[0] - lag], y[lag:]
+    else:
+        x, y = x[-lag:], y[:y.shape[0] + lag]
+    weights = np.where(np.isfinite(x) & np.isfinite(y), weights, 0.0)
+    total = weights.sum(axis=(1, 2))
+    xa = np.nan_to_num(x - ((np.nan_to_num(x) * weights).sum(axis=(1, 2)) / total)[:, None, None])
+    ya = np.nan_to_num(y - ((np.nan_to_num(y) * weights).sum(axis=(1, 2)) / total)[:, None, None])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (weights * xa * ya).sum(axis=(1, 2)) / np.sqrt((weights * xa ** 2).sum(axis=(1, 2)) *
+                                                             (weights * ya ** 2).sum(axis=(1, 2)))
+
+def pattern_from_catalog(catalog, weights, x_name='mfc', y_name='tp', lag=0, start=None, end=None, chunk_hours=744):
+    # 逐时间块计算空间型相关；跨块的配对用上一块末尾lag帧衔接，任何时段长度内存都只占一个块。
+    # 时次不连续(缺测时段、文件不衔接)时不跨越间隔配对
+    def chunks(name):
+        return era5_catalog.iter_variable_chunks(catalog, QUANTITIES[name]['source'], start, end,
+                                                 chunk_hours=chunk_hours)
+
+    leading, trailing = (x_name, y_name) if lag >= 0 else (y_name, x_name)
+    shift = abs(lag)
+    tail, tail_times = None, None
+    last_time = None
+    times_out, values = [], []
+    for (times, lead), (trail_times, trail) in zip(chunks(leading), chunks(trailing)):
+        if not times.equals(trail_times):
+            raise ValueError(f"{x_name} 与 {y_name} 的时次不一致")
+        lead = lead * QUANTITIES[leading]['scale']
+        trail = trail * QUANTITIES[trailing]['scale']
+        if tail is None or times[0] - last_time != pd.Timedelta(hours=1):
+            tail, tail_times = lead[:0], times[:0]
+        # 全局配对为lead[t]与trail[t+shift]；lead帧来自上一块尾部和本块，配对数为拼接长度减shift
+        pending = np.concatenate([tail, lead])
+        pending_times = tail_times.append(times)
+        count = max(0, pending.shape[0] - shift)
+        pairs_lead, pairs_trail = pending[:count], trail[trail.shape[0] - count:]
+        tail, tail_times = pending[count:], pending_times[count:]
+        last_time = times[-1]
+        if count:
+            x, y = (pairs_lead, pairs_trail) if lag >= 0 else (pairs_trail, pairs_lead)
+            values.append(pattern_correlation(x, y, weights, 0))
+            times_out.append(pending_times[:count].values)
+    # 结果按x的时次标注
+    index = pd.DatetimeIndex(np.concatenate(times_out))
+    if lag < 0:
+        index = index + pd.Timedelta(hours=shift)
+    return pd.Series(np.concatenate(values), index=index, name=f'pattern_corr_lag{lag}')
+
+def save_lagged(result, output_file):
+    dataset = nc.Dataset(output_file, 'w')
+    try:
+        dataset.createDimension('lag', result['lags'].size)
+        dataset.createDimension('latitude', result['latitude'].size)
+        dataset.createDimension('longitude', result['longitude'].size)
+        lag_var = dataset.createVariable('lag', 'i4', ('lag',))
+        lag_var[:] = result['lags']
+        lag_var.units = 'hours'
+        lag_var.long_name = f"{result['y']} 落后 {result['x']} 的小时数"
+        dataset.createVariable('latitude', 'f4', ('latitude',))[:] = result['latitude']
+        dataset.createVariable('longitude', 'f4', ('longitude',))[:] = result['longitude']
+        for name in ('corr', 'slope'):
+            var = dataset.createVariable(name, 'f4', ('lag', 'latitude', 'longitude'), zlib=True, complevel=4)
+            var[:] = result[name]
+    finally:
+        dataset.close()
+
+def plot_best_lag(result, output_file, extent=(110, 115, 32, 37)):
+    # 左：各格点相关系数绝对值最大的滞后时间；右：该滞后的相关系数
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+    corr = result['corr']
+    best = np.nanargmax(np.abs(np.nan_to_num(corr)), axis=0)
+    best_corr = np.take_along_axis(corr, best[np.newaxis], axis=0)[0]
+    best_lag = result['lags'][best]
+
+    fig, axes = plt.subplots(1, 2, figsize=(16, 7), subplot_kw={'projection': ccrs.PlateCarree()})
+    panels = [(best_lag, 'RdBu_r', '最优滞后 (小时)', '最优滞后时间'),
+              (best_corr, 'RdBu_r', '相关系数', '最优滞后相关系数')]
+    for ax, (data, cmap, label, title) in zip(axes, panels):
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        limit = np.nanmax(np.abs(data))
+        mesh = ax.pcolormesh(result['longitude'], result['latitude'], data, cmap=cmap, vmin=-limit, vmax=limit,
+                             shading='auto', transform=ccrs.PlateCarree())
+        fig.colorbar(mesh, ax=ax, orientation='horizontal', pad=0.05, label=label)
+        ax.set_title(title)
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+    fig.suptitle(f"{QUANTITIES[result['x']]['long_name']}与{QUANTITIES[result['y']]['long_name']}的滞后相关")
+    fig.savefig(output_file)
+    plt.close(fig)
+    print(f"Saved best-lag map as {output_file}")
+
+def plot_region_lags(result, weights, output_file):
+    # 区域加权平均的滞后相关曲线
+    curve = np.nansum(result['corr'] * weights, axis=(1, 2)) / weights.sum()
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.plot(result['lags'], curve, marker='o')
+    ax.axvline(0, color='gray', linewidth=0.8)
+    ax.set_xlabel(f"滞后 (小时，正值表示{QUANTITIES[result['y']]['long_name']}落后)")
+    ax.set_ylabel('区域平均相关系数')
+    ax.set_title('河南省区域平均滞后相关')
+    ax.grid(True)
+    fig.savefig(output_file)
+    plt.close(fig)
+    print(f"Saved regional lag curve as {output_file}")
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\single levels.nc"
+    output_dir = r"D:\新建文件夹\lag_correlation"
+    max_lag = 24
+
+    os.makedirs(output_dir, exist_ok=True)
+    data_dir = os.path.dirname(file_path) or '.'
+    catalog = era5_catalog.build_catalog(data_dir, pattern=os.path.basename(file_path))
+
+    result = lagged_from_catalog(catalog, 'mfc', 'tp', max_lag=max_lag)
+    save_lagged(result, os.path.join(output_dir, 'mfc_tp_lagged.nc'))
+    plot_best_lag(result, os.path.join(output_dir, 'mfc_tp_best_lag.png'))
+    weights = region_weights(result['latitude'], result['longitude'], province='河南省')
+    plot_region_lags(result, weights, os.path.join(output_dir, 'mfc_tp_region_lags.png'))
+
+    series = pd.concat([pattern_from_catalog(catalog, weights, 'mfc', 'tp', lag=lag) for lag in (0, 3, 6)], axis=1)
+    output_file = os.path.join(output_dir, 'mfc_tp_pattern_correlation.csv')
+    series.to_csv(output_file, encoding='utf-8-sig')
+    print(f"Saved hourly pattern correlation as {output_file}")
+
+if __name__ == "__main__":
+    main()
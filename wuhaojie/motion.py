@@ -0,0 +1,249 @@
+import netCDF4 as nc
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import os
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+from scipy import ndimage
+import era5_catalog
+import contour_cache
+import vector_layer
+import preview
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+EARTH_RADIUS = 6371000.0  # 地球半径 (m)
+MIN_SIZE = 8  # 金字塔最粗一层的最小格点数
+
+def _warp(frames, dy, dx):
+    # 对(时间, 纬度, 经度)的整块数据按位移双线性采样：结果[t, y, x] = frames[t, y+dy, x+dx]
+    t, y, x = np.meshgrid(np.arange(frames.shape[0]), np.arange(frames.shape[1]), np.arange(frames.shape[2]),
+                          indexing='ij')
+    return ndimage.map_coordinates(frames, [t, y + dy, x + dx], order=1, mode='nearest')
+
+def _downsample(frames):
+    ny, nx = frames.shape[1] // 2 * 2, frames.shape[2] // 2 * 2
+    return frames[:, :ny, :nx].reshape(frames.shape[0], ny // 2, 2, nx // 2, 2).mean(axis=(2, 4))
+
+def _upsample(dy, dx, shape):
+    # 位移场放大到上一层网格，行、列位移分别乘以各自方向的尺度比(格点数为奇数时两者不同)
+    factors = (1, shape[1] / dy.shape[1], shape[2] / dy.shape[2])
+    return (ndimage.zoom(dy, factors, order=1, mode='nearest') * factors[1],
+            ndimage.zoom(dx, factors, order=1, mode='nearest') * factors[2])
+
+def preprocess(precip, sigma=1.0):
+    # 降水强度对数变换并平滑，弱化强中心对匹配的支配
+    return ndimage.gaussian_filter(np.log1p(np.maximum(precip, 0.0)), sigma=(0, sigma, sigma))
+
+def optical_flow(cube, window=5, iterations=3, regularization=1e-3, smooth=1.0):
+    # 多尺度Lucas-Kanade：所有相邻时次对一次计算，返回(dy, dx)，单位为格点/小时，形状(时间-1, 纬度, 经度)。
+    # 每层从粗一层的结果出发，反复把后一帧按当前位移回采样，再求解窗口内的2x2最小二乘增量
+    first, second = cube[:-1], cube[1:]
+    pyramid = [(first, second)]
+    while min(pyramid[-1][0].shape[1:]) // 2 >= MIN_SIZE:
+        pyramid.append((_downsample(pyramid[-1][0]), _downsample(pyramid[-1][1])))
+
+    dy = dx = None
+    for level_first, level_second in reversed(pyramid):
+        if dy is None:
+            dy = np.zeros(level_first.shape)
+            dx = np.zeros(level_first.shape)
+        else:
+            dy, dx = _upsample(dy, dx, level_first.shape)
+        for _ in range(iterations):
+            warped = _warp(level_second, dy, dx)
+            gy, gx = np.gradient(0.5 * (level_first + warped), axis=(1, 2))
+            gt = warped - level_first
+            size = (1, window, window)
+            sxx = ndimage.uniform_filter(gx * gx, size) + regularization
+            syy = ndimage.uniform_filter(gy * gy, size) + regularization
+            sxy = ndimage.uniform_filter(gx * gy, size)
+            sxt = ndimage.uniform_filter(gx * gt, size)
+            syt = ndimage.uniform_filter(gy * gt, size)
+            det = sxx * syy - sxy ** 2
+            dx -= (syy * sxt - sxy * syt) / det
+            dy -= (sxx * syt - sxy * sxt) / det
+            dy = ndimage.gaussian_filter(dy, sigma=(0, smooth, smooth))
+            dx = ndimage.gaussian_filter(dx, sigma=(0, smooth, smooth))
+    return dy, dx
+
+def motion_velocity(dy, dx, lats, lons):
+    # 格点/小时换算为东向、北向移速 (m/s)；纬度降序时行号增加对应向南
+    lat_step = np.radians(np.gradient(np.asarray(lats, dtype=np.float64)))[:, np.newaxis]
+    lon_step = np.radians(np.gradient(np.asarray(lons, dtype=np.float64)))[np.newaxis, :]
+    cos_lat = np.cos(np.radians(np.asarray(lats, dtype=np.float64)))[:, np.newaxis]
+    u = dx * lon_step * EARTH_RADIUS * cos_lat / 3600.0
+    v = dy * lat_step * EARTH_RADIUS / 3600.0
+    return u, v
+
+def advect_interpolate(cube, dy, dx, n_sub=4):
+    # 平流插值：t与t+1之间的第k个子时刻a=k/n_sub，由前一帧沿位移前推a、后一帧回推1-a后加权合成。
+    # 全部由内存中的场计算，不重新读数据；返回(子帧数, 纬度, 经度)及每帧对应的小时偏移
+    first, second = cube[:-1], cube[1:]
+    frames = np.empty(((cube.shape[0] - 1) * n_sub + 1,) + cube.shape[1:])
+    frames[::n_sub] = cube
+    for k in range(1, n_sub):
+        a = k / n_sub
+        forward = _warp(first, -a * dy, -a * dx)
+        backward = _warp(second, (1 - a) * dy, (1 - a) * dx)
+        frames[k::n_sub] = (1 - a) * forward + a * backward
+    offsets = np.arange(frames.shape[0]) / n_sub
+    return frames, offsets
+
+def load_precipitation(file_path, start=None, end=None):
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        times = era5_catalog.read_times(dataset)
+        keep = np.ones(len(times), dtype=bool)
+        if start is not None:
+            keep &= times >= pd.Timestamp(start)
+        if end is not None:
+            keep &= times <= pd.Timestamp(end)
+        index = np.flatnonzero(keep)
+        time_slice = slice(index[0], index[-1] + 1)
+        try:
+            lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+            lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+        except KeyError as e:
+            raise KeyError(f"变量未找到: {e}")
+        if 'tp' not in dataset.variables:
+            raise KeyError("变量未找到: tp")
+        tp = era5_catalog.read_block(dataset, 'tp', time_slice) * 1000.0  # m -> mm
+    finally:
+        dataset.close()
+    return times[time_slice], lats, lons, np.nan_to_num(tp)
+
+def save_motion(times, lats, lons, u, v, output_file):
+    # 移动矢量按前一时次标注：第i个为times[i]到times[i+1]的移动
+    dataset = nc.Dataset(output_file, 'w')
+    try:
+        dataset.createDimension('time', u.shape[0])
+        dataset.createDimension('latitude', lats.size)
+        dataset.createDimension('longitude', lons.size)
+        time_var = dataset.createVariable('time', 'f8', ('time',))
+        time_var.units = 'hours since 1970-01-01 00:00:00'
+        time_var.calendar = 'standard'
+        time_var[:] = nc.date2num(pd.DatetimeIndex(times[:-1]).to_pydatetime(), time_var.units, 'standard')
+        dataset.createVariable('latitude', 'f4', ('latitude',))[:] = lats
+        dataset.createVariable('longitude', 'f4', ('longitude',))[:] = lons
+        for name, data, long_name in (('u_motion', u, '雨区东向移速'), ('v_motion', v, '雨区北向移速')):
+            var = dataset.createVariable(name, 'f4', ('time', 'latitude', 'longitude'), zlib=True, complevel=4)
+            var[:] = data
+            var.units = 'm s**-1'
+            var.long_name = long_name
+    finally:
+        dataset.close()
+    print(f"Saved motion vectors as {output_file}")
+
+def save_motion_frames(lon_grid, lat_grid, precip, u, v, time_points, output_dir, frames=None, min_rate=0.5,
+                       extent=(110, 115, 32, 37)):
+    # 逐时降水填色叠加雨区移动矢量，只在雨强超过min_rate的格点画箭头
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+
+    levels = contour_cache.contour_levels(precip)
+    frames = preview.selected_frames(u.shape[0], frames)
+    contour_files = dict(zip(frames, contour_cache.precompute_contours(lon_grid, lat_grid, precip[frames], levels)))
+
+    for frame in frames:
+        current_time = pd.to_datetime(time_points[frame])
+        raining = precip[frame] >= min_rate
+        fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        contour = contour_cache.draw_cached_contours(ax, contour_files[frame], levels, cmap='Blues')
+        plt.colorbar(contour, ax=ax, orientation='horizontal', pad=0.05, label='降水量 (mm)')
+        vector_layer.draw_vectors(ax, lon_grid[0, :], lat_grid[:, 0], np.where(raining, u[frame], np.nan),
+                                  np.where(raining, v[frame], np.nan), list(extent), (12, 8), color='red', scale=300)
+        ax.set_title(f'降水量及雨区移动 {current_time.strftime("%Y-%m-%d %H:%M")}')
+        ax.set_xlabel('经度')
+        ax.set_ylabel('纬度')
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+        fig.savefig(os.path.join(output_dir, f'motion_{current_time.strftime("%Y%m%d%H%M")}.png'))
+        plt.close(fig)
+
+def interpolated_selection(n_hours, n_sub, promote_frames=None):
+    # 逐时帧的升级选择换算为插值帧序号：选中的小时区间内的全部子帧(含两端整点)
+    hours = preview.selected_frames(n_hours - 1, promote_frames)
+    return preview.selected_frames((n_hours - 1) * n_sub + 1,
+                                   [hour * n_sub + k for hour in hours for k in range(n_sub + 1)])
+
+def save_interpolated_frames(lon_grid, lat_grid, frames, offsets, start_time, output_dir, levels=None,
+                             selected=None, extent=(110, 115, 32, 37)):
+    # 平流插值得到的子小时帧，色阶与逐时帧一致；selected为要出图的插值帧序号，None为全部
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+    if levels is None:
+        levels = contour_cache.contour_levels(frames)
+    selected = preview.selected_frames(len(offsets), selected)
+    contour_files = contour_cache.precompute_contours(lon_grid, lat_grid, frames[selected], levels)
+
+    for contour_file, offset in zip(contour_files, offsets[selected]):
+        current_time = pd.Timestamp(start_time) + pd.Timedelta(hours=offset)
+        fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        contour = contour_cache.draw_cached_contours(ax, contour_file, levels, cmap='Blues')
+        plt.colorbar(contour, ax=ax, orientation='horizontal', pad=0.05, label='降水量 (mm/h)')
+        ax.set_title(f'降水量图 {current_time.strftime("%Y-%m-%d %H:%M")}')
+        ax.set_xlabel('经度')
+        ax.set_ylabel('纬度')
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+        fig.savefig(os.path.join(output_dir, f'interp_{current_time.strftime("%Y%m%d%H%M")}.png'))
+        plt.close(fig)
+
+def create_animation_from_images(output_dir, output_file, fps=3):
+    fig, ax = plt.subplots(figsize=(12, 8))
+    images = []
+
+    for frame in sorted(os.listdir(output_dir)):
+        if frame.endswith('.png'):
+            img = plt.imread(os.path.join(output_dir, frame))
+            images.append([plt.imshow(img, animated=True)])
+
+    ani = animation.ArtistAnimation(fig, images, interval=200, repeat=False)
+    ani.save(output_file, writer='pillow', fps=fps)
+    plt.close(fig)
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\xiaochidu.nc"
+    output_dir = r"D:\新建文件夹\motion"
+    n_sub = 4  # 每小时插值为4帧(15分钟)
+    # 出图模式：'preview'只生成所有时次的缩略总览图；'full'出完整质量的帧，promote_frames指定只升级部分帧(None为全部)
+    render_mode = 'full'
+    promote_frames = None
+
+    motion_dir = os.path.join(output_dir, 'vectors')
+    interp_dir = os.path.join(output_dir, 'interpolated')
+    os.makedirs(motion_dir, exist_ok=True)
+    os.makedirs(interp_dir, exist_ok=True)
+
+    times, lats, lons, precip = load_precipitation(file_path)
+    dy, dx = optical_flow(preprocess(precip))
+    u, v = motion_velocity(dy, dx, lats, lons)
+    save_motion(times, lats, lons, u, v, os.path.join(output_dir, 'motion.nc'))
+
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    levels = contour_cache.contour_levels(precip)
+    if render_mode == 'preview':
+        preview.contact_sheet(lon_grid, lat_grid, precip, times, levels, 'Blues', '降水量', '降水量 (mm)',
+                              os.path.join(output_dir, 'precipitation_preview.png'))
+        return
+    save_motion_frames(lon_grid, lat_grid, precip, u, v, times, motion_dir, frames=promote_frames)
+    create_animation_from_images(motion_dir, os.path.join(output_dir, 'motion_animation.gif'))
+
+    frames, offsets = advect_interpolate(precip, dy, dx, n_sub)
+    save_interpolated_frames(lon_grid, lat_grid, frames, offsets, times[0], interp_dir, levels=levels,
+                             selected=interpolated_selection(len(times), n_sub, promote_frames))
+    create_animation_from_images(interp_dir, os.path.join(output_dir, 'interpolated_animation.gif'), fps=3 * n_sub)
+    print(f"Saved motion products in {output_dir}")
+
+if __name__ == "__main__":
+    main()
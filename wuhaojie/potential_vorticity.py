@@ -0,0 +1,248 @@
+import netCDF4 as nc
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import os
+import hashlib
+import json
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+import era5_catalog
+import contour_cache
+import vector_layer
+import preview
+from derived import P0, KAPPA
+from features import relative_vorticity
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+G0 = 9.80665  # 重力加速度 (m/s2)
+OMEGA = 7.292e-5  # 地球自转角速度 (rad/s)
+EARTH_RADIUS = 6371000.0  # 地球半径 (m)
+PVU = 1e-6  # 1 PVU = 1e-6 K m2 kg-1 s-1
+THETA_LEVELS = (320.0, 330.0, 340.0, 350.0)  # 默认等熵面 (K)
+
+# 插值到等熵面的变量及单位
+ISENTROPIC_VARIABLES = {
+    'pv': 'PVU',
+    'u': 'm s**-1',
+    'v': 'm s**-1',
+    'q': 'kg kg**-1',
+    'pressure': 'hPa',
+}
+
+def potential_temperature(t, levels):
+    # t: (时间, 层, 纬度, 经度)，levels单位Pa
+    return t * ((P0 / levels) ** KAPPA)[:, np.newaxis, np.newaxis]
+
+def ertel_pv(t, u, v, levels, lats, lons):
+    # 等压面上的Ertel位涡 (PVU)：PV = -g[(ζ+f)∂θ/∂p - ∂v/∂p·∂θ/∂x + ∂u/∂p·∂θ/∂y]
+    # 各导数对整块(时间, 层, 纬度, 经度)一次计算
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat_rad)[:, np.newaxis]
+    theta = potential_temperature(t, levels)
+
+    dtheta_dx = np.gradient(theta, lon_rad, axis=-1) / (EARTH_RADIUS * cos_lat)
+    dtheta_dy = np.gradient(theta, lat_rad, axis=-2) / EARTH_RADIUS
+    dtheta_dp = np.gradient(theta, levels, axis=1)
+    absolute_vorticity = relative_vorticity(u, v, lats, lons)
+    absolute_vorticity += (2 * OMEGA * np.sin(lat_rad))[:, np.newaxis]
+
+    pv = absolute_vorticity * dtheta_dp
+    pv -= np.gradient(v, levels, axis=1) * dtheta_dx
+    pv += np.gradient(u, levels, axis=1) * dtheta_dy
+    pv *= -G0 / PVU
+    return pv, theta
+
+def isentropic_search(theta, theta_levels):
+    # 垂直查找结构：每个等熵面在每一列中所在的层区间和线性权重，只算一次，所有变量共用。
+    # theta: (时间, 层, 纬度, 经度)，层自下而上(θ随高度增加)
+    theta_levels = np.asarray(theta_levels, dtype=np.float64)
+    n_levels = theta.shape[1]
+    # 位于目标θ以下的层数即区间下界，θ不单调的少数列取第一次穿越附近的区间
+    below = (theta[:, np.newaxis] < theta_levels[np.newaxis, :, np.newaxis, np.newaxis, np.newaxis]).sum(axis=2)
+    index = below - 1
+    valid = (index >= 0) & (index <= n_levels - 2)
+    index = np.clip(index, 0, n_levels - 2)
+    lower = np.take_along_axis(theta, index, axis=1)
+    upper = np.take_along_axis(theta, index + 1, axis=1)
+    weight = (theta_levels[np.newaxis, :, np.newaxis, np.newaxis] - lower) / np.where(upper != lower, upper - lower, np.nan)
+    return {'index': index, 'weight': weight, 'valid': valid}
+
+def to_isentropic(field, search):
+    # 用查找结构把(时间, 层, 纬度, 经度)的场插值到(时间, θ面, 纬度, 经度)
+    lower = np.take_along_axis(field, search['index'], axis=1)
+    upper = np.take_along_axis(field, search['index'] + 1, axis=1)
+    result = lower + search['weight'] * (upper - lower)
+    result[~search['valid']] = np.nan
+    return result
+
+def isentropic_chunk(t, u, v, q, levels, lats, lons, theta_levels=THETA_LEVELS):
+    # 一个时间块：先算等压面位涡，再用同一查找结构插值位涡、风、比湿和气压
+    pv, theta = ertel_pv(t, u, v, levels, lats, lons)
+    search = isentropic_search(theta, theta_levels)
+    pressure = np.broadcast_to(levels[:, np.newaxis, np.newaxis] / 100.0, t.shape)
+    fields = {'pv': pv, 'u': u, 'v': v, 'q': q, 'pressure': pressure}
+    return {name: to_isentropic(field, search) for name, field in fields.items()}
+
+def create_output(output_file, lats, lons, theta_levels, units):
+    dataset = nc.Dataset(output_file, 'w')
+    dataset.createDimension('time', None)
+    dataset.createDimension('theta', len(theta_levels))
+    dataset.createDimension('latitude', len(lats))
+    dataset.createDimension('longitude', len(lons))
+    time_var = dataset.createVariable('time', 'f8', ('time',))
+    time_var.units = units
+    time_var.calendar = 'standard'
+    dataset.createVariable('theta', 'f4', ('theta',))[:] = theta_levels
+    dataset.createVariable('latitude', 'f4', ('latitude',))[:] = lats
+    dataset.createVariable('longitude', 'f4', ('longitude',))[:] = lons
+    for name, unit in ISENTROPIC_VARIABLES.items():
+        var = dataset.createVariable(name, 'f4', ('time', 'theta', 'latitude', 'longitude'), zlib=True, complevel=4,
+                                     fill_value=np.float32(np.nan))
+        var.units = unit
+    return dataset
+
+def compute_isentropic(file_path, output_file, start=None, end=None, theta_levels=THETA_LEVELS,
+                       lon_range=None, lat_range=None, chunk=12):
+    # 逐时间块读取每个场一次，计算后追加写入等熵面文件，内存只占一个块
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        times = era5_catalog.read_times(dataset)
+        keep = np.ones(len(times), dtype=bool)
+        if start is not None:
+            keep &= times >= pd.Timestamp(start)
+        if end is not None:
+            keep &= times <= pd.Timestamp(end)
+        time_index = np.flatnonzero(keep)
+        try:
+            lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+            lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+            levels = np.asarray(dataset.variables['pressure_level'][:], dtype=np.float64)
+        except KeyError as e:
+            raise KeyError(f"变量未找到: {e}")
+        lat_slice, lon_slice = era5_catalog.mask_bounds(era5_catalog.region_mask(lats, lons, lon_range=lon_range, lat_range=lat_range))
+        order = np.argsort(-levels)  # 自下而上
+        pressure = levels[order] * 100.0
+        time_var = era5_catalog.get_time_variable(dataset)
+
+        output = create_output(output_file, lats[lat_slice], lons[lon_slice], theta_levels,
+                               'hours since 1970-01-01 00:00:00')
+        try:
+            for i in range(0, time_index.size, chunk):
+                block = time_index[i:i + chunk]
+                time_slice = slice(block[0], block[-1] + 1)
+                fields = {}
+                for name in ('t', 'u', 'v', 'q'):
+                    if name not in dataset.variables:
+                        raise KeyError(f"变量未找到: {name}")
+                    data = dataset.variables[name][time_slice, :, lat_slice, lon_slice]
+                    fields[name] = np.ma.filled(data.astype(np.float64), np.nan)[:, order]
+                result = isentropic_chunk(fields['t'], fields['u'], fields['v'], fields['q'], pressure,
+                                          lats[lat_slice], lons[lon_slice], theta_levels)
+                position = slice(i, i + block.size)
+                output.variables['time'][position] = nc.date2num(times[time_slice].to_pydatetime(),
+                                                                 output.variables['time'].units, 'standard')
+                for name, value in result.items():
+                    output.variables[name][position] = value.astype(np.float32)
+        finally:
+            output.close()
+    finally:
+        dataset.close()
+    print(f"Saved isentropic fields as {output_file}")
+
+def cache_file_name(file_path, start=None, end=None, theta_levels=THETA_LEVELS, lon_range=None, lat_range=None):
+    # 缓存键：源文件(路径、大小、修改时间)+等熵面+时段+区域
+    stat = os.stat(file_path)
+    signature = json.dumps([file_path, stat.st_size, stat.st_mtime, [float(theta) for theta in theta_levels],
+                            str(start), str(end), lon_range, lat_range])
+    return f'isentropic_{hashlib.sha1(signature.encode("utf-8")).hexdigest()[:12]}.nc'
+
+def get_isentropic(file_path, start=None, end=None, theta_levels=THETA_LEVELS, lon_range=None, lat_range=None,
+                   cache_dir='potential_vorticity'):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, cache_file_name(file_path, start, end, theta_levels, lon_range, lat_range))
+    if not os.path.exists(cache_file):
+        compute_isentropic(file_path, cache_file, start, end, theta_levels, lon_range, lat_range)
+    return load_isentropic(cache_file)
+
+def load_isentropic(file_path):
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        result = {
+            'times': era5_catalog.read_times(dataset),
+            'theta': dataset.variables['theta'][:].astype(np.float64),
+            'lats': dataset.variables['latitude'][:].astype(np.float64),
+            'lons': dataset.variables['longitude'][:].astype(np.float64),
+        }
+        for name in ISENTROPIC_VARIABLES:
+            result[name] = np.ma.filled(dataset.variables[name][:].astype(np.float32), np.nan)
+    finally:
+        dataset.close()
+    return result
+
+def save_pv_frames(lon_grid, lat_grid, pv, u, v, time_points, output_dir, theta, frames=None, extent=(110, 115, 32, 37)):
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+
+    levels = contour_cache.contour_levels(pv)
+    frames = preview.selected_frames(len(time_points), frames)
+    contour_files = dict(zip(frames, contour_cache.precompute_contours(lon_grid, lat_grid, pv[frames], levels)))
+
+    for frame in frames:
+        current_time = pd.to_datetime(time_points[frame])
+
+        fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+        ax.set_extent(extent, crs=ccrs.PlateCarree())  # 设置经纬度范围
+        pv_contour = contour_cache.draw_cached_contours(ax, contour_files[frame], levels, cmap='RdBu_r', alpha=0.7)
+        plt.colorbar(pv_contour, ax=ax, orientation='horizontal', pad=0.05, label='位涡 (PVU)')
+        vector_layer.draw_vectors(ax, lon_grid[0, :], lat_grid[:, 0], u[frame], v[frame], list(extent), (12, 8), scale=300)
+        ax.set_title(f'{theta:g} K 等熵面位涡 {current_time.strftime("%Y-%m-%d %H:%M")}')
+        ax.set_xlabel('经度')
+        ax.set_ylabel('纬度')
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+
+        fig.savefig(os.path.join(output_dir, f'pv_{current_time.strftime("%Y%m%d%H%M")}.png'))
+        plt.close(fig)
+
+def create_animation_from_images(output_dir, output_file):
+    fig, ax = plt.subplots(figsize=(12, 8))
+    images = []
+
+    for frame in sorted(os.listdir(output_dir)):
+        if frame.endswith('.png'):
+            img = plt.imread(os.path.join(output_dir, frame))
+            images.append([plt.imshow(img, animated=True)])
+
+    ani = animation.ArtistAnimation(fig, images, interval=200, repeat=False)
+    ani.save(output_file, writer='pillow', fps=3)
+    plt.close(fig)
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\ERA5 hourly data on pressure levels from 1940 to present.nc"
+    output_dir = r"D:\新建文件夹\potential_vorticity"
+    theta_levels = THETA_LEVELS
+    promote_frames = None
+
+    os.makedirs(output_dir, exist_ok=True)
+    data = get_isentropic(file_path, theta_levels=theta_levels, cache_dir=output_dir)
+    lon_grid, lat_grid = np.meshgrid(data['lons'], data['lats'])
+
+    for k, theta in enumerate(data['theta']):
+        frames_dir = os.path.join(output_dir, f'{theta:g}K')
+        os.makedirs(frames_dir, exist_ok=True)
+        save_pv_frames(lon_grid, lat_grid, data['pv'][:, k], data['u'][:, k], data['v'][:, k], data['times'],
+                       frames_dir, theta, frames=promote_frames)
+        output_file = os.path.join(output_dir, f'pv_{theta:g}K_animation.gif')
+        create_animation_from_images(frames_dir, output_file)
+        print(f"Saved {theta:g} K PV animation as {output_file}")
+
+if __name__ == "__main__":
+    main()
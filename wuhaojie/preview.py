@@ -0,0 +1,77 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import BoundaryNorm
+from functools import lru_cache
+import cnmaps
+import pandas as pd
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+
+# 草图模式的参数：每帧缩略图最多约60个格点宽、低dpi、边界简化
+DRAFT_MAX_CELLS = 60
+DRAFT_DPI = 60
+DRAFT_PANEL_SIZE = 1.6
+DRAFT_TOLERANCE = 0.05  # 边界简化容差 (度)
+
+@lru_cache(maxsize=None)
+def simplified_boundary(province=None, city=None, tolerance=DRAFT_TOLERANCE):
+    # 简化后的行政边界外环，只取一次
+    region = cnmaps.get_adm_maps(province=province, city=city, record='first', only_polygon=True)
+    geom = getattr(region, 'geom', region).simplify(tolerance)
+    polygons = getattr(geom, 'geoms', [geom])
+    return [np.asarray(polygon.exterior.xy) for polygon in polygons]
+
+def crop_to_extent(lon_grid, lat_grid, data, extent):
+    lons = lon_grid[0, :]
+    lats = lat_grid[:, 0]
+    cols = np.flatnonzero((lons >= extent[0]) & (lons <= extent[1]))
+    rows = np.flatnonzero((lats >= extent[2]) & (lats <= extent[3]))
+    return lons[cols], lats[rows], np.asarray(data)[..., rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+def decimate(lons, lats, data, max_cells=DRAFT_MAX_CELLS):
+    step = max(int(np.ceil(max(lons.size, lats.size) / max_cells)), 1)
+    return lons[::step], lats[::step], data[..., ::step, ::step]
+
+def contact_sheet(lon_grid, lat_grid, data, time_points, levels, cmap, title, label, output_file,
+                  extent=(110, 115, 32, 37), ncols=8):
+    # 所有时次的缩略总览图：抽稀数据+imshow+简化边界，一张图几秒内完成
+    lons, lats, data = crop_to_extent(lon_grid, lat_grid, data, extent)
+    lons, lats, data = decimate(lons, lats, data)
+    cmap = plt.get_cmap(cmap)
+    norm = BoundaryNorm(levels, cmap.N, extend='both')
+    image_extent = (lons.min(), lons.max(), lats.min(), lats.max())
+    origin = 'upper' if lats[0] > lats[-1] else 'lower'
+    henan = simplified_boundary(province='河南省')
+
+    n_frames = data.shape[0]
+    nrows = int(np.ceil(n_frames / ncols))
+    fig, axes = plt.subplots(nrows, ncols, figsize=(ncols * DRAFT_PANEL_SIZE, nrows * DRAFT_PANEL_SIZE + 0.8),
+                             squeeze=False)
+    for frame, ax in enumerate(axes.flat):
+        ax.set_xticks([])
+        ax.set_yticks([])
+        if frame >= n_frames:
+            ax.axis('off')
+            continue
+        ax.imshow(data[frame], extent=image_extent, origin=origin, cmap=cmap, norm=norm, interpolation='nearest')
+        for ring in henan:
+            ax.plot(ring[0], ring[1], color='black', linewidth=0.5)
+        ax.set_xlim(extent[0], extent[1])
+        ax.set_ylim(extent[2], extent[3])
+        ax.set_title(f'{frame:03d} {pd.to_datetime(time_points[frame]).strftime("%m-%d %H")}', fontsize=6)
+
+    fig.colorbar(ScalarMappable(norm=norm, cmap=cmap), ax=axes, orientation='horizontal',
+                 fraction=0.03, pad=0.02, label=label)
+    fig.suptitle(f'{title} (预览)')
+    fig.savefig(output_file, dpi=DRAFT_DPI)
+    plt.close(fig)
+    print(f"Saved preview contact sheet as {output_file}")
+
+def selected_frames(n_frames, promote_frames=None):
+    # 升级为完整质量的帧序号，None表示全部
+    if promote_frames is None:
+        return list(range(n_frames))
+    return sorted(set(int(frame) for frame in promote_frames if 0 <= frame < n_frames))
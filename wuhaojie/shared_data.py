@@ -0,0 +1,91 @@
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# 工作进程中已挂载的共享数组：名称 -> (SharedMemory, ndarray视图)
+_attached = {}
+
+class SharedArrayBroker:
+    # 在主进程中把数据块一次性载入共享内存，工作进程按名称拿到零拷贝的numpy视图；
+    # 无论开多少个工作进程，内存中都只有一份数据
+
+    def __init__(self):
+        self._segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def allocate(self, name, shape, dtype=np.float32):
+        if name in self._segments:
+            raise KeyError(f"共享数组已存在: {name}")
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        self._segments[name] = (shm, array)
+        return array
+
+    def put(self, name, data, dtype=None):
+        data = np.asarray(data)
+        array = self.allocate(name, data.shape, data.dtype if dtype is None else dtype)
+        array[...] = data
+        return array
+
+    def load_variable(self, name, variable, index=(), dtype=np.float32, chunk=24, time_slice=slice(None)):
+        # 从netCDF4/xarray变量按时间块读入共享内存，读取时的临时内存只有一个时间块
+        # index为时间维之后各维的下标，例如(level_index, lat_slice, lon_slice)；time_slice只读入部分时次
+        first_time, last_time, _ = time_slice.indices(variable.shape[0])
+        n_times = max(last_time - first_time, 0)
+        first = np.asarray(variable[(slice(first_time, first_time + 1),) + tuple(index)])
+        array = self.allocate(name, (n_times,) + first.shape[1:], dtype)
+        for start in range(0, n_times, chunk):
+            block = variable[(slice(first_time + start, min(first_time + start + chunk, last_time)),) + tuple(index)]
+            array[start:start + chunk] = np.ma.filled(np.ma.asarray(block, dtype=np.float64), np.nan)
+        return array
+
+    def get(self, name):
+        return self._segments[name][1]
+
+    def descriptors(self):
+        # 可传给工作进程的轻量描述：共享内存名、形状和数据类型
+        return {name: (shm.name, array.shape, array.dtype.str) for name, (shm, array) in self._segments.items()}
+
+    def pool(self, workers=None):
+        # 工作进程启动时挂载所有共享数组，任务函数中用shared_data.get(name)取视图
+        return ProcessPoolExecutor(max_workers=workers, initializer=attach_all, initargs=(self.descriptors(),))
+
+    def close(self):
+        # 运行结束时释放所有共享内存段
+        segments = [shm for shm, _ in self._segments.values()]
+        self._segments = {}
+        for shm in segments:
+            try:
+                shm.close()
+            except BufferError:
+                pass  # 调用方仍持有视图，映射随视图释放，段本身照常删除
+            shm.unlink()
+
+def attach(name, descriptor):
+    shm_name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=shm_name)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    array.flags.writeable = False
+    _attached[name] = (shm, array)
+    return array
+
+def attach_all(descriptors):
+    for name, descriptor in descriptors.items():
+        attach(name, descriptor)
+
+def get(name):
+    if name not in _attached:
+        raise KeyError(f"共享数组未挂载: {name}")
+    return _attached[name][1]
+
+def detach_all():
+    for shm, _ in _attached.values():
+        shm.close()
+    _attached.clear()
@@ -0,0 +1,219 @@
+import numpy as np
+import os
+from scipy import sparse
+from scipy.ndimage import gaussian_filter1d
+from cross_section import bilinear_weights
+
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+# 默认阈值：ERA5降水类变量单位为m，1e-5 m = 0.01 mm，低于此值视为0
+THRESHOLD = 1e-5
+# 非零格点占比超过此值的帧按稠密存储：稀疏每个非零点需4字节下标+4字节数值，过半时不再省空间
+DENSE_FRACTION = 0.5
+
+class SparseFrames:
+    # 降水类(时间, 纬度, 经度)场的紧凑存储：每帧只保存|值|>阈值的格点(按帧的CSR)，
+    # 雨区过大的帧退回稠密存储。累计、极值、区域统计和重网格都直接在稀疏数据上计算
+
+    def __init__(self, shape, indptr, indices, values, dense_frames, dense, threshold=THRESHOLD):
+        self.shape = tuple(shape)
+        self.indptr = indptr  # (时间+1,)，第t帧的非零点为indices[indptr[t]:indptr[t+1]]
+        self.indices = indices  # 一维展开的格点下标
+        self.values = values
+        self.dense_frames = dense_frames  # 稠密存储的帧号，这些帧在CSR中为空行
+        self.dense = dense  # (稠密帧数, 纬度*经度)
+        self.threshold = threshold
+
+    @classmethod
+    def from_dense(cls, data, threshold=THRESHOLD, dense_fraction=DENSE_FRACTION, dtype=np.float32):
+        data = np.ma.filled(np.ma.asarray(data, dtype=np.float64), 0.0)
+        flat = np.nan_to_num(data.reshape(data.shape[0], -1))
+        keep = np.abs(flat) > threshold
+        counts = keep.sum(axis=1)
+        dense_frames = np.flatnonzero(counts > dense_fraction * flat.shape[1])
+        keep[dense_frames] = False
+        rows, indices = np.nonzero(keep)
+        indptr = np.zeros(flat.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=flat.shape[0]), out=indptr[1:])
+        dense = np.where(np.abs(flat[dense_frames]) > threshold, flat[dense_frames], 0.0).astype(dtype)
+        return cls(data.shape, indptr, indices.astype(np.int32), flat[rows, indices].astype(dtype),
+                   dense_frames, dense, threshold)
+
+    @classmethod
+    def from_variable(cls, variable, index=(), time_slice=slice(None), chunk=24, scale=1.0, threshold=THRESHOLD,
+                      dense_fraction=DENSE_FRACTION, dtype=np.float32):
+        # 从netCDF4变量按时间块读取并压缩，读取时的临时内存只有一个时间块；scale在压缩后作用于非零值
+        first, last, _ = time_slice.indices(variable.shape[0])
+        parts = []
+        for start in range(first, last, chunk):
+            block = variable[(slice(start, min(start + chunk, last)),) + tuple(index)]
+            parts.append(cls.from_dense(block, threshold, dense_fraction, dtype))
+        frame_shape = variable[(slice(first, first),) + tuple(index)].shape[1:]
+        result = cls.concatenate(parts, frame_shape, dtype)
+        return result.scale(scale) if scale != 1.0 else result
+
+    @classmethod
+    def concatenate(cls, parts, frame_shape=None, dtype=np.float32):
+        # frame_shape、dtype只在parts为空(如时间范围内没有时次)时用于构造0帧的结果
+        if not parts:
+            if frame_shape is None:
+                raise ValueError("没有可拼接的帧，且未给出帧的形状")
+            n_cells = int(np.prod(frame_shape))
+            return cls((0,) + tuple(frame_shape), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                       np.zeros(0, dtype=dtype), np.zeros(0, dtype=np.int64), np.zeros((0, n_cells), dtype=dtype))
+        offsets = np.cumsum([0] + [part.values.size for part in parts])
+        frame_offsets = np.cumsum([0] + [part.shape[0] for part in parts])
+        indptr = np.concatenate([[0]] + [part.indptr[1:] + offset for part, offset in zip(parts, offsets)])
+        shape = (int(frame_offsets[-1]),) + parts[0].shape[1:]
+        return cls(shape, indptr,
+                   np.concatenate([part.indices for part in parts]),
+                   np.concatenate([part.values for part in parts]),
+                   np.concatenate([part.dense_frames + offset for part, offset in zip(parts, frame_offsets)]),
+                   np.concatenate([part.dense for part in parts]),
+                   parts[0].threshold)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def n_cells(self):
+        return int(np.prod(self.shape[1:]))
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes + self.dense_frames.nbytes + self.dense.nbytes
+
+    def frame_rows(self):
+        # 每个非零值所属的帧号
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def scale(self, factor):
+        # 单位换算只作用于存储的数值，不展开成稠密数组
+        return SparseFrames(self.shape, self.indptr, self.indices, self.values * self.values.dtype.type(factor),
+                            self.dense_frames, self.dense * self.dense.dtype.type(factor), self.threshold * abs(factor))
+
+    def select(self, frames):
+        # 取连续的若干帧，返回新的SparseFrames(共享数值数组)
+        start, stop, _ = frames.indices(self.shape[0])
+        lower, upper = self.indptr[start], self.indptr[stop]
+        in_range = (self.dense_frames >= start) & (self.dense_frames < stop)
+        return SparseFrames((stop - start,) + self.shape[1:], self.indptr[start:stop + 1] - lower,
+                            self.indices[lower:upper], self.values[lower:upper],
+                            self.dense_frames[in_range] - start, self.dense[in_range], self.threshold)
+
+    def to_dense(self, frames=slice(None), dtype=np.float32):
+        part = self.select(frames)
+        out = np.zeros((part.shape[0], part.n_cells), dtype=dtype)
+        out[part.frame_rows(), part.indices] = part.values
+        out[part.dense_frames] = part.dense
+        return out.reshape(part.shape)
+
+    def frame(self, t):
+        return self.to_dense(slice(t, t + 1))[0]
+
+    def value_range(self):
+        # 最小、最大值；有未存储(即为0)的格点时最小值至少为0
+        stored = [array for array in (self.values, self.dense.ravel()) if array.size]
+        low = min(float(array.min()) for array in stored) if stored else 0.0
+        high = max(float(array.max()) for array in stored) if stored else 0.0
+        if self.values.size + self.dense.size < self.shape[0] * self.n_cells:
+            low, high = min(low, 0.0), max(high, 0.0)
+        return low, high
+
+    def to_csr(self):
+        # 所有帧的scipy CSR矩阵(时间, 格点)，稠密帧的非零值也并入
+        matrix = sparse.csr_matrix((self.values, self.indices, self.indptr), shape=(self.shape[0], self.n_cells))
+        if self.dense_frames.size:
+            rows, cols = np.nonzero(self.dense)
+            extra = sparse.csr_matrix((self.dense[rows, cols], (self.dense_frames[rows], cols)), shape=matrix.shape)
+            matrix = matrix + extra
+        return matrix
+
+    def total(self):
+        # 逐格点时间累计
+        result = np.bincount(self.indices, weights=self.values, minlength=self.n_cells).astype(np.float64)
+        result += self.dense.sum(axis=0, dtype=np.float64)
+        return result.reshape(self.shape[1:])
+
+    def maximum(self):
+        # 逐格点时间最大值，未存储的格点按0计
+        result = np.zeros(self.n_cells)
+        np.maximum.at(result, self.indices, self.values)
+        if self.dense_frames.size:
+            np.maximum(result, self.dense.max(axis=0), out=result)
+        return result.reshape(self.shape[1:])
+
+    def clip(self, lower=0.0):
+        # 数值下限截断(如去掉GRIB打包产生的负值)，未存储的格点为0不受影响
+        return SparseFrames(self.shape, self.indptr, self.indices, np.maximum(self.values, lower), self.dense_frames,
+                            np.maximum(self.dense, lower), self.threshold)
+
+    def frame_maximum(self, mask=None):
+        # 逐帧最大值，可限定在(纬度, 经度)掩膜内；未存储的格点按0计
+        keep = np.ones(self.n_cells, dtype=bool) if mask is None else np.asarray(mask, dtype=bool).ravel()
+        result = np.zeros(self.shape[0])
+        selected = keep[self.indices]
+        np.maximum.at(result, self.frame_rows()[selected], self.values[selected])
+        if self.dense_frames.size:
+            result[self.dense_frames] = self.dense[:, keep].max(axis=1)
+        return result
+
+    def exceed_count(self, threshold):
+        # 逐格点超过阈值的时次数
+        result = np.bincount(self.indices[self.values > threshold], minlength=self.n_cells)
+        result += (self.dense > threshold).sum(axis=0)
+        return result.reshape(self.shape[1:])
+
+    def weighted_series(self, weights):
+        # 逐时加权平均，weights为(纬度, 经度)，如cos(纬度)×区域掩膜
+        weights = np.asarray(weights, dtype=np.float64).ravel()
+        series = np.bincount(self.frame_rows(), weights=self.values * weights[self.indices],
+                             minlength=self.shape[0]).astype(np.float64)
+        series[self.dense_frames] += self.dense @ weights
+        return series / weights.sum()
+
+    def regrid(self, operator):
+        # operator为(目标点数, 格点数)的稀疏线性算子(插值、平滑等)，一次稀疏矩阵乘得到所有帧，形状(时间, 目标点数)；
+        # 目标点多于源格点时结果比原数据大，逐帧使用时用regrid_frame
+        return np.asarray((self.to_csr() @ operator.T).todense())
+
+    def regrid_frame(self, operator, t):
+        # 单帧重网格，逐帧绘图时只展开当前一帧
+        return operator @ self.frame(t).ravel().astype(np.float64)
+
+    def save(self, file_path):
+        np.savez_compressed(file_path, shape=np.asarray(self.shape), indptr=self.indptr, indices=self.indices,
+                            values=self.values, dense_frames=self.dense_frames, dense=self.dense,
+                            threshold=self.threshold)
+
+    @classmethod
+    def load(cls, file_path):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"文件未找到: {file_path}")
+        with np.load(file_path) as data:
+            return cls(tuple(data['shape']), data['indptr'], data['indices'], data['values'],
+                       data['dense_frames'], data['dense'], float(data['threshold']))
+
+def smoothing_operator(shape, sigma=1.0):
+    # 与scipy.ndimage.gaussian_filter(默认reflect边界)等价的稀疏矩阵，可分离为两个一维算子的Kronecker积
+    rows = gaussian_filter1d(np.eye(shape[0]), sigma, axis=0)
+    cols = gaussian_filter1d(np.eye(shape[1]), sigma, axis=0)
+    rows[np.abs(rows) < 1e-8] = 0.0
+    cols[np.abs(cols) < 1e-8] = 0.0
+    return sparse.kron(sparse.csr_matrix(rows), sparse.csr_matrix(cols), format='csr')
+
+def interpolation_operator(lats, lons, target_lon, target_lat):
+    # 双线性插值到目标点的稀疏矩阵(目标点数, 格点数)，权重只算一次
+    target_lon = np.asarray(target_lon, dtype=np.float64).ravel()
+    target_lat = np.asarray(target_lat, dtype=np.float64).ravel()
+    index, weight = bilinear_weights(lats, lons, target_lon, target_lat)
+    rows = np.broadcast_to(np.arange(target_lon.size), index.shape)
+    return sparse.csr_matrix((weight.ravel(), (rows.ravel(), index.ravel())),
+                             shape=(target_lon.size, len(lats) * len(lons)))
+
+def regrid_operator(lats, lons, target_lon, target_lat, sigma=1.0):
+    # 先高斯平滑再插值的合成算子
+    operator = interpolation_operator(lats, lons, target_lon, target_lat)
+    if sigma:
+        operator = operator @ smoothing_operator((len(lats), len(lons)), sigma)
+    return operator.tocsr()
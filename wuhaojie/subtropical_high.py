@@ -0,0 +1,180 @@
+import xarray as xr
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import os
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import cnmaps
+import pandas as pd
+import era5_catalog
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+G0 = 9.80665  # 标准重力加速度 (m/s^2)
+EARTH_RADIUS = 6371.0  # 地球半径 (km)
+SH_CONTOUR = 5880  # 副高特征等值线 (gpm)
+
+# 副高指数的计算区域(参照国家气候中心74项环流指数的定义)
+AREA_DOMAIN = {'lon_range': [110, 180], 'lat_range': [10, 60]}
+RIDGE_DOMAIN = {'lon_range': [110, 150], 'lat_range': [10, 45]}
+WEST_DOMAIN = {'lon_range': [90, 180], 'lat_range': [10, 60]}
+
+def geopotential_height(z):
+    # ERA5的z为位势 (m^2/s^2)，除以g0得到位势高度 (gpm)
+    return z / G0
+
+def load_dataset(file_path):
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件未找到: {file_path}")
+    try:
+        dataset = xr.open_dataset(file_path)
+    except OSError as e:
+        raise RuntimeError(f"无法打开文件: {e}")
+    return dataset
+
+def extract_variable(dataset, level=500):
+    try:
+        z = dataset.sel(pressure_level=level).variables['z'][:]  # 指定层次的位势
+        time_var = dataset.variables['valid_time'][:]  # 时间变量
+        lats = dataset.variables['latitude'][:]
+        lons = dataset.variables['longitude'][:]
+    except KeyError as e:
+        raise KeyError(f"变量未找到: {e}")
+    return z, time_var, lats, lons
+
+def domain_mask(lats, lons, domain):
+    lat_ok = (lats >= domain['lat_range'][0]) & (lats <= domain['lat_range'][1])
+    lon_ok = (lons >= domain['lon_range'][0]) & (lons <= domain['lon_range'][1])
+    return lat_ok, lon_ok
+
+def subtropical_high_indices(hgt, lats, lons, contour=SH_CONTOUR):
+    # hgt: (time, lat, lon) 位势高度 (gpm)，所有时次一次性计算，无逐帧循环
+    hgt = np.asarray(hgt, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    inside = hgt >= contour
+
+    # 面积指数：区域内5880线包围的面积 (km^2)
+    lat_ok, lon_ok = domain_mask(lats, lons, AREA_DOMAIN)
+    dlat = np.deg2rad(np.abs(np.gradient(lats))) if lats.size > 1 else np.zeros(1)
+    dlon = np.deg2rad(np.abs(np.gradient(lons))) if lons.size > 1 else np.zeros(1)
+    cell_area = EARTH_RADIUS ** 2 * np.cos(np.deg2rad(lats))[:, None] * dlat[:, None] * dlon[None, :]
+    cell_area = cell_area * (lat_ok[:, None] & lon_ok[None, :])
+    area = (inside * cell_area).sum(axis=(1, 2))
+
+    # 脊线指数：各经度上5880线内高度极大值所在纬度，再做经向平均
+    lat_ok, lon_ok = domain_mask(lats, lons, RIDGE_DOMAIN)
+    ridge_hgt = np.where(lat_ok[None, :, None] & lon_ok[None, None, :], hgt, -np.inf)
+    ridge_lat = lats[ridge_hgt.argmax(axis=1)]
+    ridge_valid = ridge_hgt.max(axis=1) >= contour
+    with np.errstate(invalid='ignore'):
+        ridge = np.where(ridge_valid, ridge_lat, 0.0).sum(axis=1) / ridge_valid.sum(axis=1)
+
+    # 西伸脊点：区域内5880线最西端的经度
+    lat_ok, lon_ok = domain_mask(lats, lons, WEST_DOMAIN)
+    west_inside = (inside & lat_ok[None, :, None]).any(axis=1) & lon_ok[None, :]
+    lon_order = np.argsort(lons)
+    first = west_inside[:, lon_order].argmax(axis=1)
+    west = np.where(west_inside.any(axis=1), lons[lon_order][first], np.nan)
+
+    return pd.DataFrame({'area_km2': area, 'ridge_lat': ridge, 'west_lon': west})
+
+def indices_from_catalog(catalog, start=None, end=None, level=500, chunk_hours=744):
+    # 长时段：逐块读取z并计算指数，只保留指数序列
+    entry = era5_catalog.select_files(catalog, 'z', start, end)[0]
+    dataset = era5_catalog.load_dataset(entry['path'])
+    lats = dataset.variables['latitude'][:]
+    lons = dataset.variables['longitude'][:]
+    dataset.close()
+
+    parts = []
+    for times, block in era5_catalog.iter_variable_chunks(catalog, 'z', start, end, level=level,
+                                                          chunk_hours=chunk_hours):
+        indices = subtropical_high_indices(geopotential_height(block), lats, lons)
+        indices.index = times
+        parts.append(indices)
+    return pd.concat(parts)
+
+def save_height_frames(lon_grid, lat_grid, hgt, time_points, output_dir, level, extent):
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+    # 所有帧使用相同的等值线层次
+    levels = np.arange(np.floor(np.nanmin(hgt) / 20) * 20, np.nanmax(hgt) + 20, 20)
+
+    for frame in range(len(time_points)):
+        current_time = pd.to_datetime(time_points[frame])
+        hgt_frame = hgt[frame, :, :]
+
+        fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        height_contour = ax.contourf(lon_grid, lat_grid, hgt_frame, levels=levels, cmap='viridis', alpha=0.6, transform=ccrs.PlateCarree())
+        plt.colorbar(height_contour, ax=ax, orientation='horizontal', pad=0.05, label='位势高度 (gpm)')
+        if np.nanmax(hgt_frame) >= SH_CONTOUR:
+            sh_line = ax.contour(lon_grid, lat_grid, hgt_frame, levels=[SH_CONTOUR], colors='red', linewidths=2.0, transform=ccrs.PlateCarree())
+            ax.clabel(sh_line, fmt='%d', fontsize=9)
+        ax.set_title(f'{level} hPa 位势高度场与{SH_CONTOUR}线 {current_time.strftime("%Y-%m-%d %H:%M")}')
+        ax.set_xlabel('经度')
+        ax.set_ylabel('纬度')
+        ax.coastlines()
+        ax.add_feature(cfeature.BORDERS, linestyle=':')
+        ax.gridlines(draw_labels=True)
+
+        # 添加河南省和郑州市边界
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+
+        # 保存图像
+        output_file = os.path.join(output_dir, f'frame_{frame:03d}.png')
+        plt.savefig(output_file)
+        plt.close(fig)
+
+def create_animation_from_images(output_dir, output_file):
+    fig, ax = plt.subplots(figsize=(12, 8))
+    images = []
+
+    for frame in sorted(os.listdir(output_dir)):
+        if frame.endswith('.png'):
+            img = plt.imread(os.path.join(output_dir, frame))
+            images.append([plt.imshow(img, animated=True)])
+
+    ani = animation.ArtistAnimation(fig, images, interval=200, repeat=False)
+    ani.save(output_file, writer='pillow', fps=3)
+    plt.close(fig)
+
+def main():
+    file_path = r"D:\Git desktop\dongliqixiang\ERA5 hourly data on pressure levels from 1940 to present.nc"
+    output_dir = r"D:\新建文件夹\subtropical_high"
+    index_file = os.path.join(output_dir, 'subtropical_high_index.csv')
+    output_file = os.path.join(output_dir, 'subtropical_high_animation.gif')
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    dataset = load_dataset(file_path)
+    z, time_var, lats, lons = extract_variable(dataset, level=500)
+    hgt = geopotential_height(np.asarray(z))
+    lons = np.asarray(lons)
+    lats = np.asarray(lats)
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+
+    # 使用pandas处理时间变量
+    time_points = pd.to_datetime(time_var)
+
+    indices = subtropical_high_indices(hgt, lats, lons)
+    indices.index = time_points
+    indices.to_csv(index_file, index_label='time', encoding='utf-8-sig')
+    print(f"Saved subtropical high indices as {index_file}")
+
+    # 副高为大尺度系统，地图范围取数据全域
+    extent = [lons.min(), lons.max(), lats.min(), lats.max()]
+    save_height_frames(lon_grid, lat_grid, hgt, time_points, output_dir, '500', extent)
+    create_animation_from_images(output_dir, output_file)
+
+    dataset.close()
+    print(f"Saved subtropical high animation as {output_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import xarray as xr
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import BoundaryNorm
+from matplotlib.image import imsave
+import os
+import json
+import pandas as pd
+import shared_data
+import contour_cache
+from cross_section import bilinear_weights
+import derived
+
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+TILE_SIZE = 256
+MAX_LAT = 85.0511287798
+
+# 浏览器查看页面，Leaflet叠加在底图上，下拉框切换时次
+VIEWER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body, #map {{ height: 100%; margin: 0; }} #time {{ position: absolute; top: 10px; right: 10px; z-index: 1000; }}</style>
+</head>
+<body>
+<select id="time"></select>
+<div id="map"></div>
+<script>
+fetch('tiles.json').then(r => r.json()).then(meta => {{
+  const map = L.map('map').fitBounds([[meta.bounds[2], meta.bounds[0]], [meta.bounds[3], meta.bounds[1]]]);
+  L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{maxZoom: meta.max_zoom}}).addTo(map);
+  let layer = null;
+  const select = document.getElementById('time');
+  meta.times.forEach(t => select.add(new Option(t, t)));
+  function show(t) {{
+    if (layer) map.removeLayer(layer);
+    layer = L.tileLayer(t + '/{{z}}/{{x}}/{{y}}.' + meta.format, {{minZoom: meta.min_zoom, maxNativeZoom: meta.max_zoom, errorTileUrl: ''}}).addTo(map);
+  }}
+  select.onchange = () => show(select.value);
+  show(meta.times[0]);
+}});
+</script>
+</body>
+</html>
+"""
+
+def load_dataset(file_path):
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件未找到: {file_path}")
+    try:
+        dataset = xr.open_dataset(file_path)
+    except OSError as e:
+        raise RuntimeError(f"无法打开文件: {e}")
+    return dataset
+
+def lon_to_tile(lon, zoom):
+    return (lon + 180.0) / 360.0 * 2 ** zoom
+
+def lat_to_tile(lat, zoom):
+    lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+    return (1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * 2 ** zoom
+
+def tile_to_lon(x, zoom):
+    return x / 2 ** zoom * 360.0 - 180.0
+
+def tile_to_lat(y, zoom):
+    return np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * y / 2 ** zoom))))
+
+def tiles_for_extent(extent, zoom):
+    # 覆盖[lon_min, lon_max, lat_min, lat_max]的所有瓦片编号
+    x_min = int(np.floor(lon_to_tile(extent[0], zoom)))
+    x_max = int(np.ceil(lon_to_tile(extent[1], zoom))) - 1
+    y_min = int(np.floor(lat_to_tile(extent[3], zoom)))
+    y_max = int(np.ceil(lat_to_tile(extent[2], zoom))) - 1
+    return [(zoom, x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+def tile_pixel_coords(zoom, x, y):
+    # 瓦片内每个像素中心的经纬度，纬度按墨卡托非线性分布
+    offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lons = tile_to_lon(x + offsets, zoom)
+    lats = tile_to_lat(y + offsets, zoom)
+    return np.meshgrid(lons, lats)
+
+def tile_sampler(lats, lons, zoom, x, y):
+    # 瓦片像素在数据网格上的双线性插值下标和权重，同一瓦片所有时次共用；瓦片不在数据范围内时返回None
+    pixel_lon, pixel_lat = tile_pixel_coords(zoom, x, y)
+    inside = ((pixel_lon >= lons.min()) & (pixel_lon <= lons.max()) &
+              (pixel_lat >= lats.min()) & (pixel_lat <= lats.max())).ravel()
+    if not inside.any():
+        return None
+    index, weight = bilinear_weights(lats, lons, pixel_lon.ravel()[inside], pixel_lat.ravel()[inside])
+    return inside, index, weight
+
+def render_tile(field, sampler, cmap, norm, alpha=1.0, transparent_below=None):
+    # 直接由格点数据得到瓦片的RGBA像素，不经过整幅大图
+    inside, index, weight = sampler
+    values = np.full(TILE_SIZE * TILE_SIZE, np.nan)
+    values[inside] = np.sum(field.ravel()[index] * weight, axis=0)
+    rgba = cmap(norm(values))
+    visible = np.isfinite(values)
+    if transparent_below is not None:
+        visible &= values >= transparent_below
+    rgba[..., 3] = np.where(visible, alpha, 0.0)
+    return rgba.reshape(TILE_SIZE, TILE_SIZE, 4), visible.any()
+
+def _render_tile_frames(tile, levels, cmap_name, alpha, transparent_below, time_labels, output_dir, image_format):
+    # 工作进程：一个瓦片的所有时次，插值权重只算一次；全透明的瓦片不写文件
+    zoom, x, y = tile
+    lons = shared_data.get('lons')
+    lats = shared_data.get('lats')
+    frames = shared_data.get('frames')
+    sampler = tile_sampler(lats, lons, zoom, x, y)
+    if sampler is None:
+        return 0
+    cmap = plt.get_cmap(cmap_name)
+    norm = BoundaryNorm(levels, cmap.N, extend='both')
+    written = 0
+    for frame, time_label in enumerate(time_labels):
+        rgba, has_data = render_tile(frames[frame], sampler, cmap, norm, alpha, transparent_below)
+        if not has_data:
+            continue
+        tile_dir = os.path.join(output_dir, time_label, str(zoom), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        imsave(os.path.join(tile_dir, f'{y}.{image_format}'), rgba, format=image_format)
+        written += 1
+    return written
+
+def build_pyramid(lons, lats, frames, time_points, output_dir, zooms=range(5, 10), levels=None, cmap='viridis',
+                  alpha=0.7, transparent_below=None, image_format='png', extent=None, title='', workers=None):
+    # frames: (time, lat, lon)，每个时次输出output_dir/时次/z/x/y.png，色阶由全部时次统一确定
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    if levels is None:
+        levels = contour_cache.contour_levels(frames)
+    levels = np.asarray(levels, dtype=np.float64)
+    if extent is None:
+        extent = [lons.min(), lons.max(), lats.min(), lats.max()]
+    time_labels = [pd.Timestamp(t).strftime('%Y%m%d%H') for t in time_points]
+    tiles = [tile for zoom in zooms for tile in tiles_for_extent(extent, zoom)]
+    os.makedirs(output_dir, exist_ok=True)
+
+    with shared_data.SharedArrayBroker() as broker:
+        broker.put('lons', lons)
+        broker.put('lats', lats)
+        broker.put('frames', frames, dtype=np.float32)
+        with broker.pool(workers) as executor:
+            futures = [executor.submit(_render_tile_frames, tile, levels, cmap, alpha, transparent_below,
+                                       time_labels, output_dir, image_format) for tile in tiles]
+            written = sum(future.result() for future in futures)
+
+    metadata = {
+        'title': title,
+        'times': time_labels,
+        'levels': levels.tolist(),
+        'cmap': cmap,
+        'format': image_format,
+        'min_zoom': min(zooms),
+        'max_zoom': max(zooms),
+        'bounds': [float(value) for value in extent],
+    }
+    with open(os.path.join(output_dir, 'tiles.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(output_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(VIEWER_HTML.format(title=title))
+    print(f"Saved {written} tiles ({len(tiles)} tile positions x {len(time_labels)} times) to {output_dir}")
+    return written
+
+def main():
+    single_file = r"D:\pycharm\dongliqixiangxue\single levels.nc"
+    pressure_file = r"D:\pycharm\dongliqixiangxue\ERA5 hourly data on pressure levels from 1940 to present.nc"
+    output_dir = r"D:\新建文件夹\tiles"
+    zooms = range(5, 10)
+    level = 850
+
+    single = load_dataset(single_file)
+    pressure = load_dataset(pressure_file)
+    time_name = 'valid_time' if 'valid_time' in single.coords else 'time'
+    time_points = pd.to_datetime(single[time_name].values)
+    lats = single['latitude'].values
+    lons = single['longitude'].values
+
+    # 逐小时降水 (mm)，小于0.1 mm的像素透明
+    tp = single['tp'].values * 1000.0
+    build_pyramid(lons, lats, tp, time_points, os.path.join(output_dir, 'precip'), zooms,
+                  levels=[0.1, 1, 2, 5, 10, 20, 30, 50, 70, 100], cmap='Blues', transparent_below=0.1, title='逐小时降水')
+
+    # 水汽通量散度，与水汽通量散度.py的算法一致
+    tcwv = single['tcwv'].values
+    divQ = np.gradient(single['u10'].values * tcwv, axis=-1) + np.gradient(single['v10'].values * tcwv, axis=-2)
+    build_pyramid(lons, lats, divQ, time_points, os.path.join(output_dir, 'divergence'), zooms,
+                  cmap='coolwarm', title='水汽通量散度')
+
+    pressure_level = pressure.sel(pressure_level=level)
+    pressure_times = pd.to_datetime(pressure[time_name].values)
+    wind_speed = derived.evaluate('wind_speed', pressure_level, u='u', v='v')
+    build_pyramid(pressure['longitude'].values, pressure['latitude'].values, wind_speed, pressure_times,
+                  os.path.join(output_dir, f'wind_speed_{level}'), zooms, title=f'{level} hPa 风速')
+    build_pyramid(pressure['longitude'].values, pressure['latitude'].values, pressure_level['r'].values,
+                  pressure_times, os.path.join(output_dir, f'rh_{level}'), zooms, levels=np.arange(0, 101, 10),
+                  title=f'{level} hPa 相对湿度')
+
+    single.close()
+    pressure.close()
+
+if __name__ == "__main__":
+    main()
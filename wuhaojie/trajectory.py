@@ -0,0 +1,262 @@
+import xarray as xr
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+import era5_catalog
+import shared_data
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+EARTH_RADIUS = 6371000.0  # 地球半径 (m)
+VARIABLES = ('u', 'v', 'w', 'q')  # 插值的变量，依次存放在场数组的最后一维
+
+def load_fields(file_path, start, end, lon_range=None, lat_range=None, chunk=24, broker=None):
+    # 读取时段内的三维u/v/w/q，整理成(时间, 气压, 纬度, 经度, 变量)的float32数组，
+    # 各坐标均为升序，插值时一次取出一个格点上的全部变量。
+    # 给定broker时数组直接分配在共享内存中，逐块写入，不另留一份私有拷贝
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        times = era5_catalog.read_times(dataset)
+        time_index = np.flatnonzero((times >= pd.Timestamp(start)) & (times <= pd.Timestamp(end)))
+        if time_index.size < 2:
+            raise ValueError(f"时段内的时次不足: {start} - {end}")
+        try:
+            lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+            lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+            levels = np.asarray(dataset.variables['pressure_level'][:], dtype=np.float64)
+        except KeyError as e:
+            raise KeyError(f"变量未找到: {e}")
+        mask = era5_catalog.region_mask(lats, lons, lon_range=lon_range, lat_range=lat_range)
+        lat_slice, lon_slice = era5_catalog.mask_bounds(mask)
+        lats = lats[lat_slice]
+        lons = lons[lon_slice]
+        lat_order = np.argsort(lats)
+        lon_order = np.argsort(lons)
+        level_order = np.argsort(levels)
+
+        shape = (time_index.size, levels.size, lats.size, lons.size, len(VARIABLES))
+        if broker is not None:
+            fields = broker.allocate('fields', shape, np.float32)
+        else:
+            fields = np.empty(shape, dtype=np.float32)
+        for k, name in enumerate(VARIABLES):
+            if name not in dataset.variables:
+                raise KeyError(f"变量未找到: {name}")
+            for i in range(0, time_index.size, chunk):
+                time_slice = slice(time_index[i], time_index[min(i + chunk, time_index.size) - 1] + 1)
+                block = np.ma.filled(dataset.variables[name][time_slice, :, lat_slice, lon_slice].astype(np.float32), np.nan)
+                fields[i:i + chunk, ..., k] = block[:, level_order][:, :, lat_order][..., lon_order]
+    finally:
+        dataset.close()
+
+    return {
+        'fields': fields,
+        'times': times[time_index],
+        'levels': levels[level_order] * 100.0,  # hPa -> Pa
+        'lats': lats[lat_order],
+        'lons': lons[lon_order],
+    }
+
+def grid_meta(data):
+    # 插值所需的网格参数，体积小，可传给工作进程
+    return {
+        'start': data['times'][0],
+        'dt_hours': (data['times'][1] - data['times'][0]) / pd.Timedelta(hours=1),
+        'levels': data['levels'],
+        'lat0': data['lats'][0],
+        'dlat': data['lats'][1] - data['lats'][0],
+        'lon0': data['lons'][0],
+        'dlon': data['lons'][1] - data['lons'][0],
+    }
+
+def _split(position, size):
+    # 分数下标 -> (下界格点, 权重, 是否在范围内)；范围外的粒子取0号格点，结果随后置为NaN
+    valid = (position >= 0) & (position <= size - 1)
+    position = np.where(valid, position, 0.0)
+    index = np.minimum(position.astype(np.int64), size - 2)
+    return index, position - index, valid
+
+def interpolate(fields, meta, hours, lon, lat, p):
+    # 对所有粒子同时做时间+三维空间的四线性插值，返回(粒子, 变量)；离开数据范围的粒子为NaN
+    n_times, n_levels, n_lats, n_lons, n_vars = fields.shape
+    levels = meta['levels']
+    z_index = np.clip(np.searchsorted(levels, p) - 1, 0, n_levels - 2)
+    z_frac = np.clip((p - levels[z_index]) / (levels[z_index + 1] - levels[z_index]), 0.0, 1.0)
+    t_index, t_frac, t_valid = _split(hours / meta['dt_hours'], n_times)
+    y_index, y_frac, y_valid = _split((lat - meta['lat0']) / meta['dlat'], n_lats)
+    x_index, x_frac, x_valid = _split((lon - meta['lon0']) / meta['dlon'], n_lons)
+
+    flat = fields.reshape(-1, n_vars)
+    result = np.zeros((lon.size, n_vars))
+    for dt in (0, 1):
+        wt = t_frac if dt else 1.0 - t_frac
+        for dz in (0, 1):
+            wz = wt * (z_frac if dz else 1.0 - z_frac)
+            for dy in (0, 1):
+                wy = wz * (y_frac if dy else 1.0 - y_frac)
+                for dx in (0, 1):
+                    weight = wy * (x_frac if dx else 1.0 - x_frac)
+                    index = (((t_index + dt) * n_levels + z_index + dz) * n_lats + y_index + dy) * n_lons + x_index + dx
+                    result += weight[:, np.newaxis] * flat[index]
+    result[~(t_valid & y_valid & x_valid & np.isfinite(p))] = np.nan
+    return result
+
+def velocity(fields, meta, hours, lon, lat, p):
+    # 粒子移动速度：经度、纬度 (度/秒) 和气压 (Pa/秒)，同时返回插值得到的比湿
+    values = interpolate(fields, meta, hours, lon, lat, p)
+    dlon = np.degrees(values[:, 0] / (EARTH_RADIUS * np.cos(np.radians(lat))))
+    dlat = np.degrees(values[:, 1] / EARTH_RADIUS)
+    return dlon, dlat, values[:, 2], values[:, 3]
+
+def integrate(fields, meta, lon, lat, p, release_hours, n_steps, dt_hours=-1.0, output_every=1):
+    # 四阶龙格-库塔积分，dt为负时为后向轨迹；所有粒子一起推进，每步只做4次向量化插值
+    lon = np.array(lon, dtype=np.float64)
+    lat = np.array(lat, dtype=np.float64)
+    p = np.array(p, dtype=np.float64)
+    p_min, p_max = meta['levels'][0], meta['levels'][-1]
+    n_out = n_steps // output_every + 1
+    track = {name: np.full((n_out, lon.size), np.nan, dtype=np.float32) for name in ('lon', 'lat', 'p', 'q')}
+    dt = dt_hours * 3600.0
+    hours = float(release_hours)
+
+    for step in range(n_steps + 1):
+        k1 = velocity(fields, meta, hours, lon, lat, p)
+        if step % output_every == 0:
+            out = step // output_every
+            track['lon'][out] = lon
+            track['lat'][out] = lat
+            track['p'][out] = p
+            track['q'][out] = k1[3]
+        if step == n_steps:
+            break
+        k2 = velocity(fields, meta, hours + dt_hours / 2, lon + dt / 2 * k1[0], lat + dt / 2 * k1[1], p + dt / 2 * k1[2])
+        k3 = velocity(fields, meta, hours + dt_hours / 2, lon + dt / 2 * k2[0], lat + dt / 2 * k2[1], p + dt / 2 * k2[2])
+        k4 = velocity(fields, meta, hours + dt_hours, lon + dt * k3[0], lat + dt * k3[1], p + dt * k3[2])
+        lon = lon + dt / 6 * (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0])
+        lat = lat + dt / 6 * (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1])
+        # 触地或到达顶层的粒子停在边界层次上
+        p = np.clip(p + dt / 6 * (k1[2] + 2 * k2[2] + 2 * k3[2] + k4[2]), p_min, p_max)
+        hours += dt_hours
+    return track
+
+def _integrate_chunk(meta, lon, lat, p, release_hours, n_steps, dt_hours, output_every):
+    # 工作进程：场数组从共享内存读取，只积分分到的一组粒子
+    return integrate(shared_data.get('fields'), meta, lon, lat, p, release_hours, n_steps, dt_hours, output_every)
+
+def release_points(province='河南省', city=None, spacing=0.1, levels=(850, 700, 500)):
+    # 在区域内按spacing度的网格和给定气压层(hPa)释放粒子
+    region = cnmaps.get_adm_maps(province=province, city=city, record='first', only_polygon=True)
+    lon_min, lat_min, lon_max, lat_max = getattr(region, 'geom', region).bounds
+    lons = np.arange(lon_min, lon_max + spacing, spacing)
+    lats = np.arange(lat_min, lat_max + spacing, spacing)
+    mask = era5_catalog.region_mask(lats, lons, province=province, city=city)
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    lon = np.tile(lon_grid[mask], len(levels))
+    lat = np.tile(lat_grid[mask], len(levels))
+    p = np.repeat(np.asarray(levels, dtype=np.float64) * 100.0, mask.sum())
+    return lon, lat, p
+
+def run_trajectories(broker, data, lon, lat, p, release_time, hours=120, dt_hours=-1.0, output_every=1,
+                     workers=None, chunk_size=20000):
+    # 粒子分组交给多个工作进程；场数据由load_fields(broker=broker)直接读入共享内存，只有这一份
+    meta = grid_meta(data)
+    release_hours = (pd.Timestamp(release_time) - meta['start']) / pd.Timedelta(hours=1)
+    n_steps = int(round(hours / abs(dt_hours)))
+    chunks = [slice(i, i + chunk_size) for i in range(0, lon.size, chunk_size)]
+    with broker.pool(workers) as executor:
+        futures = [executor.submit(_integrate_chunk, meta, lon[c], lat[c], p[c], release_hours,
+                                   n_steps, dt_hours, output_every) for c in chunks]
+        parts = [future.result() for future in futures]
+
+    track = {name: np.concatenate([part[name] for part in parts], axis=1) for name in parts[0]}
+    track['time'] = pd.Timestamp(release_time) + pd.to_timedelta(
+        np.arange(track['lon'].shape[0]) * dt_hours * output_every, unit='h')
+    return track
+
+def save_trajectories(track, output_file):
+    dataset = xr.Dataset(
+        {
+            'lon': (('time', 'parcel'), track['lon'], {'units': 'degrees_east'}),
+            'lat': (('time', 'parcel'), track['lat'], {'units': 'degrees_north'}),
+            'p': (('time', 'parcel'), track['p'] / 100.0, {'units': 'hPa'}),
+            'q': (('time', 'parcel'), track['q'] * 1000.0, {'units': 'g kg**-1'}),
+        },
+        coords={'time': track['time'], 'parcel': np.arange(track['lon'].shape[1])},
+    )
+    dataset.to_netcdf(output_file)
+    print(f"Saved {track['lon'].shape[1]} trajectories as {output_file}")
+
+def source_density(track, lon_edges, lat_edges):
+    # 源地密度：粒子最终(最早时刻)位置的分布，以及沿途比湿增加(水汽吸收)按增量加权的分布
+    last = np.isfinite(track['lon']).cumsum(axis=0).argmax(axis=0)
+    parcels = np.arange(track['lon'].shape[1])
+    origin_lat = track['lat'][last, parcels]
+    origin_lon = track['lon'][last, parcels]
+    found = np.isfinite(origin_lat) & np.isfinite(origin_lon)
+    origin, _, _ = np.histogram2d(origin_lat[found], origin_lon[found], bins=[lat_edges, lon_edges])
+
+    # 时间倒序存储：第k+1步早于第k步，比湿由k+1到k增加即为吸收
+    uptake = track['q'][:-1] - track['q'][1:]
+    lat_mid = track['lat'][1:]
+    lon_mid = track['lon'][1:]
+    keep = np.isfinite(uptake) & (uptake > 0)
+    uptake_map, _, _ = np.histogram2d(lat_mid[keep], lon_mid[keep], bins=[lat_edges, lon_edges],
+                                      weights=uptake[keep] * 1000.0)
+    n_parcels = max(track['lon'].shape[1], 1)
+    return origin / n_parcels * 100.0, uptake_map / n_parcels
+
+def plot_density(lon_edges, lat_edges, density, track, title, label, output_file, n_tracks=200):
+    henan = cnmaps.get_adm_maps(province='河南省')
+    extent = [lon_edges[0], lon_edges[-1], lat_edges[0], lat_edges[-1]]
+
+    fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    masked = np.ma.masked_less_equal(density, 0)
+    mesh = ax.pcolormesh(lon_edges, lat_edges, masked, cmap='YlGnBu', transform=ccrs.PlateCarree())
+    plt.colorbar(mesh, ax=ax, orientation='horizontal', pad=0.05, label=label)
+    sample = np.linspace(0, track['lon'].shape[1] - 1, min(n_tracks, track['lon'].shape[1])).astype(int)
+    ax.plot(track['lon'][:, sample], track['lat'][:, sample], color='gray', linewidth=0.3, alpha=0.5,
+            transform=ccrs.PlateCarree())
+    ax.coastlines()
+    ax.set_title(title)
+    ax.set_xlabel('经度')
+    ax.set_ylabel('纬度')
+    ax.gridlines(draw_labels=True)
+    cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+    fig.savefig(output_file)
+    plt.close(fig)
+    print(f"Saved source density map as {output_file}")
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\ERA5 hourly data on pressure levels from 1940 to present.nc"
+    output_dir = r"D:\新建文件夹\trajectory"
+    release_time = '2021-07-20T08:00'
+    hours = 120  # 后向追踪时长 (小时)
+    release_levels = (850, 700, 500)
+    spacing = 0.1  # 释放间距 (度)
+
+    os.makedirs(output_dir, exist_ok=True)
+    start = pd.Timestamp(release_time) - pd.Timedelta(hours=hours + 1)
+    lon, lat, p = release_points(spacing=spacing, levels=release_levels)
+    print(f"释放 {lon.size} 个粒子，后向追踪 {hours} 小时")
+    with shared_data.SharedArrayBroker() as broker:
+        data = load_fields(file_path, start, release_time, broker=broker)
+        track = run_trajectories(broker, data, lon, lat, p, release_time, hours)
+    save_trajectories(track, os.path.join(output_dir, 'back_trajectories.nc'))
+
+    lon_edges = np.arange(data['lons'][0], data['lons'][-1] + 0.5, 0.5)
+    lat_edges = np.arange(data['lats'][0], data['lats'][-1] + 0.5, 0.5)
+    origin, uptake = source_density(track, lon_edges, lat_edges)
+    plot_density(lon_edges, lat_edges, origin, track, f'{hours}小时后向轨迹源地分布', '粒子比例 (%)',
+                 os.path.join(output_dir, 'origin_density.png'))
+    plot_density(lon_edges, lat_edges, uptake, track, f'{hours}小时后向轨迹水汽吸收分布', '水汽吸收 (g/kg, 每粒子)',
+                 os.path.join(output_dir, 'moisture_uptake.png'))
+
+if __name__ == "__main__":
+    main()
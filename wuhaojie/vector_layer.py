@@ -0,0 +1,99 @@
+import hashlib
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+import cartopy.crs as ccrs
+
+# 已计算的抽稀下标，键为(网格, 范围, 图幅, dpi, 间距)
+_index_cache = {}
+# 已计算的流线几何，键为(网格, 范围, 图幅, dpi, 密度, 抽稀后风场的摘要)；按插入顺序淘汰最早的
+_streamline_cache = {}
+MAX_STREAMLINES = 256
+
+# 默认子图在画布中的占比(与matplotlib默认subplot参数一致)
+AXES_FRACTION = (0.775, 0.77)
+
+def grid_key(lons, lats):
+    return (lons.size, float(lons[0]), float(lons[-1]), lats.size, float(lats[0]), float(lats[-1]))
+
+def stride_index(coords, lower, upper, spacing_degree):
+    # 范围内的格点按固定步长取样，步长取最接近目标间距的格距整数倍
+    inside = np.flatnonzero((coords >= lower) & (coords <= upper))
+    if inside.size < 2:
+        return inside
+    resolution = np.abs(coords[1] - coords[0])
+    step = max(int(round(spacing_degree / resolution)), 1)
+    return inside[::step]
+
+def subsample_index(lons, lats, extent, figsize, dpi=None, spacing=30):
+    # 在屏幕上按约spacing像素的均匀间隔取箭头位置，返回对应的格点行、列下标(要求规则经纬网格)
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    dpi = plt.rcParams['figure.dpi'] if dpi is None else dpi
+    key = grid_key(lons, lats) + (tuple(extent), tuple(figsize), dpi, spacing)
+    if key in _index_cache:
+        return _index_cache[key]
+
+    lon_span = extent[1] - extent[0]
+    lat_span = extent[3] - extent[2]
+    # PlateCarree等比例显示，地图框受宽、高中较紧的一边限制
+    pixels_per_degree = min(figsize[0] * dpi * AXES_FRACTION[0] / lon_span,
+                            figsize[1] * dpi * AXES_FRACTION[1] / lat_span)
+    spacing_degree = spacing / pixels_per_degree
+    cols = stride_index(lons, extent[0], extent[1], spacing_degree)
+    rows = stride_index(lats, extent[2], extent[3], spacing_degree)
+    _index_cache[key] = (rows, cols)
+    return rows, cols
+
+def subsample(lons, lats, fields, extent, figsize, dpi=None, spacing=30):
+    rows, cols = subsample_index(lons, lats, extent, figsize, dpi, spacing)
+    lons = np.asarray(lons)[cols]
+    lats = np.asarray(lats)[rows]
+    fields = [np.asarray(field)[..., rows, :][..., cols] for field in fields]
+    return lons, lats, fields
+
+def compute_streamlines(lons, lats, u, v, extent, figsize, dpi=None, density=1.5):
+    # 在抽稀网格上预先计算流线几何，返回线段列表，可在工作进程中计算后交给绘图。
+    # 同一网格、范围和风场(如动画重绘、多个区域请求同一时次)直接取缓存
+    dpi = plt.rcParams['figure.dpi'] if dpi is None else dpi
+    key = grid_key(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+    lons, lats, (u, v) = subsample(lons, lats, (u, v), extent, figsize, dpi, spacing=15)
+    digest = hashlib.sha1()
+    for field in (u, v):
+        digest.update(np.ascontiguousarray(np.ma.filled(field, np.nan), dtype=np.float64).tobytes())
+    key += (tuple(extent), tuple(figsize), dpi, density, digest.hexdigest())
+    if key in _streamline_cache:
+        return _streamline_cache[key]
+
+    lon_order = np.argsort(lons)
+    lat_order = np.argsort(lats)
+    u = u[np.ix_(lat_order, lon_order)]
+    v = v[np.ix_(lat_order, lon_order)]
+
+    fig = Figure(figsize=figsize)
+    ax = fig.add_subplot()
+    stream = ax.streamplot(lons[lon_order], lats[lat_order], u, v, density=density)
+    segments = stream.lines.get_segments()
+    if len(_streamline_cache) >= MAX_STREAMLINES:
+        del _streamline_cache[next(iter(_streamline_cache))]
+    _streamline_cache[key] = segments
+    return segments
+
+def draw_streamlines(ax, segments, color='black', linewidth=0.8):
+    lines = LineCollection(segments, colors=color, linewidths=linewidth, transform=ccrs.PlateCarree())
+    ax.add_collection(lines)
+    return lines
+
+def draw_vectors(ax, lons, lats, u, v, extent, figsize, style='quiver', dpi=None, spacing=30, **kwargs):
+    # 绘制矢量图层：箭头/风羽只画抽稀后的格点，流线使用预先计算的几何
+    if style == 'streamlines':
+        segments = compute_streamlines(lons, lats, u, v, extent, figsize, dpi)
+        return draw_streamlines(ax, segments, **kwargs)
+
+    sub_lons, sub_lats, fields = subsample(lons, lats, (u, v), extent, figsize, dpi, spacing)
+    if style == 'quiver':
+        return ax.quiver(sub_lons, sub_lats, fields[0], fields[1], transform=ccrs.PlateCarree(), **kwargs)
+    if style == 'barbs':
+        return ax.barbs(sub_lons, sub_lats, fields[0], fields[1], transform=ccrs.PlateCarree(), **kwargs)
+    raise ValueError(f"不支持的矢量绘制方式: {style}")
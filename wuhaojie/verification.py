@@ -0,0 +1,272 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import glob
+import pandas as pd
+import shapely
+import era5_catalog
+from cross_section import bilinear_weights
+from fanout import resolve_regions
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+THRESHOLDS = (0.1, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0)  # 逐时降水分级阈值 (mm)
+LEAD_WINDOWS = (0, 6, 12, 24, 48, 72)  # 预报时效分段 (小时)
+
+def load_stations(station_file):
+    # 站点表：station_id, lon, lat(其余列保留)
+    if not os.path.exists(station_file):
+        raise FileNotFoundError(f"文件未找到: {station_file}")
+    stations = pd.read_csv(station_file, dtype={'station_id': str})
+    missing = {'station_id', 'lon', 'lat'} - set(stations.columns)
+    if missing:
+        raise KeyError(f"变量未找到: {', '.join(sorted(missing))}")
+    return stations.drop_duplicates('station_id').reset_index(drop=True)
+
+def load_observations(obs_path, station_ids):
+    # 观测：长表CSV(station_id, time, precip)，或目录下每站一个<station_id>.csv(time, precip)。
+    # 返回(时间, 站点)的逐时雨量矩阵，时间为时段结束时刻，与ERA5 tp的valid_time一致
+    if os.path.isdir(obs_path):
+        frames = []
+        for file_path in sorted(glob.glob(os.path.join(obs_path, '*.csv'))):
+            frame = pd.read_csv(file_path)
+            frame['station_id'] = os.path.splitext(os.path.basename(file_path))[0]
+            frames.append(frame)
+        if not frames:
+            raise FileNotFoundError(f"文件未找到: {os.path.join(obs_path, '*.csv')}")
+        long = pd.concat(frames, ignore_index=True)
+    else:
+        if not os.path.exists(obs_path):
+            raise FileNotFoundError(f"文件未找到: {obs_path}")
+        long = pd.read_csv(obs_path, dtype={'station_id': str})
+    long['time'] = pd.to_datetime(long['time'])
+    # 缺测记录先去掉，pivot_table的sum会把全为NaN的组合当作0 mm，缺报变成有效的“无雨”观测
+    long = long.dropna(subset=['precip'])
+    # 同一站同一时次的重复报文只保留最后一条，否则sum会把雨量加倍
+    long = long.drop_duplicates(subset=['station_id', 'time'], keep='last')
+    table = long.pivot_table(index='time', columns='station_id', values='precip', aggfunc='sum')
+    return table.reindex(columns=list(station_ids)).sort_index()
+
+def station_weights(stations, lats, lons):
+    # 每站周围4个格点的下标和双线性权重，只算一次；网格范围外的站点标记为无效
+    lon = stations['lon'].to_numpy(dtype=np.float64)
+    lat = stations['lat'].to_numpy(dtype=np.float64)
+    inside = (lat >= np.min(lats)) & (lat <= np.max(lats)) & (lon >= np.min(lons)) & (lon <= np.max(lons))
+    index = np.zeros((4, lon.size), dtype=np.int64)
+    weight = np.zeros((4, lon.size))
+    if inside.any():
+        index[:, inside], weight[:, inside] = bilinear_weights(lats, lons, lon[inside], lat[inside])
+    return index, weight, inside
+
+def model_at_stations(catalog, stations, variable='tp', start=None, end=None, scale=1000.0, chunk_hours=744):
+    # 逐块读取站点外接范围内的格点场，只保留插值到站点的值，返回(times, (时间, 站点))
+    entry = era5_catalog.select_files(catalog, variable, start, end)[0]
+    dataset = era5_catalog.load_dataset(entry['path'])
+    lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+    lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+    dataset.close()
+    margin = np.abs(np.diff(lats[:2])).max()
+    lon_range = (stations['lon'].min() - margin, stations['lon'].max() + margin)
+    lat_range = (stations['lat'].min() - margin, stations['lat'].max() + margin)
+    lat_slice, lon_slice = era5_catalog.mask_bounds(era5_catalog.region_mask(lats, lons, lon_range=lon_range,
+                                                                             lat_range=lat_range))
+    index, weight, inside = station_weights(stations, lats[lat_slice], lons[lon_slice])
+
+    times, values = [], []
+    for chunk_times, block in era5_catalog.iter_variable_chunks(catalog, variable, start, end, None, lat_slice,
+                                                                lon_slice, chunk_hours):
+        flat = block.reshape(block.shape[0], -1)
+        sampled = (flat[:, index] * weight).sum(axis=1) * scale
+        sampled[:, ~inside] = np.nan
+        values.append(sampled)
+        times.append(chunk_times.values)
+    model = pd.DataFrame(np.concatenate(values), index=pd.DatetimeIndex(np.concatenate(times)),
+                         columns=stations['station_id'])
+    return model[~model.index.duplicated(keep='last')]
+
+def station_regions(stations, region_names):
+    # (区域, 站点)布尔归属矩阵；区域可以重叠(如河南省和郑州市)，一个站可属于多个区域
+    lon = stations['lon'].to_numpy(dtype=np.float64)
+    lat = stations['lat'].to_numpy(dtype=np.float64)
+    regions = resolve_regions(region_names)
+    membership = np.zeros((len(regions), lon.size), dtype=bool)
+    for i, region in enumerate(regions):
+        membership[i] = shapely.contains_xy(region['geometry'], lon, lat)
+    return membership
+
+def hourly_and_station_tables(forecast, observed, thresholds=THRESHOLDS):
+    # 对(时间, 站点)矩阵只做一次逐样本运算，得到逐时和逐站两组小表，之后任何分组(总体、区域、时效)
+    # 都只是把这些小表按组相加：
+    #   joint[i, a, b]：预报落在第a级、观测落在第b级的样本数(级别由阈值划分)，用一次bincount得到
+    #   moments[i, :]：n, Σf, Σo, Σf², Σo², Σfo, Σ|f-o|，用于连续评分
+    # 缺测(NaN)的样本不计入
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    n_levels = thresholds.size + 1
+    valid = np.isfinite(forecast) & np.isfinite(observed)
+    f = np.where(valid, forecast, 0.0)
+    o = np.where(valid, observed, 0.0)
+    level = (np.searchsorted(thresholds, f, side='right') * n_levels
+             + np.searchsorted(thresholds, o, side='right')).astype(np.int64)
+    rows, cols = np.nonzero(valid)
+    level = level[rows, cols]
+
+    tables = {}
+    for name, axis, index in (('hourly', 1, rows), ('station', 0, cols)):
+        size = forecast.shape[1 - axis]
+        joint = np.bincount(index * n_levels ** 2 + level, minlength=size * n_levels ** 2)
+        moments = np.stack([valid.sum(axis=axis), f.sum(axis=axis), o.sum(axis=axis), (f * f).sum(axis=axis),
+                            (o * o).sum(axis=axis), (f * o).sum(axis=axis), np.abs(f - o).sum(axis=axis)], axis=1)
+        tables[name] = {'joint': joint.reshape(size, n_levels, n_levels), 'moments': moments.astype(np.float64)}
+    return tables
+
+def group_tables(tables, groups, n_groups):
+    # 把逐时或逐站的小表按组号相加，组号小于0的不计入
+    keep = groups >= 0
+    result = {}
+    for name, table in tables.items():
+        summed = np.zeros((n_groups,) + table.shape[1:], dtype=table.dtype)
+        np.add.at(summed, groups[keep], table[keep])
+        result[name] = summed
+    return result
+
+def member_tables(tables, membership):
+    # 把逐站的小表按(组, 站点)归属矩阵相加，一个站可计入多个组
+    result = {}
+    for name, table in tables.items():
+        summed = membership.astype(table.dtype) @ table.reshape(table.shape[0], -1)
+        result[name] = summed.reshape((membership.shape[0],) + table.shape[1:])
+    return result
+
+def contingency(joint):
+    # 所有阈值的列联表：沿预报级和观测级两个方向做反向累加，得到每个阈值“≥阈值”的
+    # 命中、空报、漏报和正确否定，形状(组, 阈值)
+    n_levels = joint.shape[-1]
+    tail = joint[:, ::-1, ::-1].cumsum(axis=1).cumsum(axis=2)[:, ::-1, ::-1]  # 预报级≥i且观测级≥j的样本数
+    total = tail[:, 0, 0][:, None]
+    k = np.arange(1, n_levels)
+    hits = tail[:, k, k]
+    forecast_yes = tail[:, k, 0]
+    observed_yes = tail[:, 0, k]
+    return {
+        'hits': hits,
+        'false_alarms': forecast_yes - hits,
+        'misses': observed_yes - hits,
+        'correct_negatives': total - forecast_yes - observed_yes + hits,
+    }
+
+def categorical_scores(table):
+    hits = table['hits'].astype(np.float64)
+    false_alarms = table['false_alarms'].astype(np.float64)
+    misses = table['misses'].astype(np.float64)
+    total = hits + false_alarms + misses + table['correct_negatives']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        random_hits = (hits + false_alarms) * (hits + misses) / total
+        return {
+            'POD': hits / (hits + misses),
+            'FAR': false_alarms / (hits + false_alarms),
+            'CSI': hits / (hits + misses + false_alarms),
+            'ETS': (hits - random_hits) / (hits + misses + false_alarms - random_hits),
+            'FBI': (hits + false_alarms) / (hits + misses),
+        }
+
+def continuous_scores(moments):
+    # 平均误差、平均绝对误差、均方根误差和相关系数
+    n, sum_f, sum_o, sum_ff, sum_oo, sum_fo, sum_abs = moments.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sum_fo / n - sum_f * sum_o / n ** 2
+        var_f = sum_ff / n - (sum_f / n) ** 2
+        var_o = sum_oo / n - (sum_o / n) ** 2
+        return {
+            'n': n,
+            'ME': (sum_f - sum_o) / n,
+            'MAE': sum_abs / n,
+            'RMSE': np.sqrt(np.maximum(sum_ff - 2 * sum_fo + sum_oo, 0.0) / n),
+            'CORR': cov / np.sqrt(var_f * var_o),
+        }
+
+def score_table(table, labels, thresholds=THRESHOLDS, name='group'):
+    # 分组评分长表：每组每个阈值一行，连续评分按组重复
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    categorical = categorical_scores(contingency(table['joint']))
+    continuous = continuous_scores(table['moments'])
+    result = pd.DataFrame({
+        name: np.repeat(np.asarray(labels, dtype=object), thresholds.size),
+        'threshold': np.tile(thresholds, len(labels)),
+    })
+    for score, values in categorical.items():
+        result[score] = values.ravel()
+    for score, values in continuous.items():
+        result[score] = np.repeat(values, thresholds.size)
+    return result
+
+def verify(model, observed, stations, thresholds=THRESHOLDS, region_names=None, lead_hours=None,
+           lead_windows=LEAD_WINDOWS):
+    # model/observed: (时间, 站点)表。返回总体、逐时、分区域、分时效的评分表。
+    # lead_hours为与model时间等长的预报时效(小时)，再分析资料为None
+    times = model.index.intersection(observed.index)
+    columns = [station for station in stations['station_id'] if station in model.columns and station in observed.columns]
+    tables = hourly_and_station_tables(model.loc[times, columns].to_numpy(dtype=np.float64),
+                                       observed.loc[times, columns].to_numpy(dtype=np.float64), thresholds)
+    hourly = tables['hourly']
+
+    results = {}
+    results['overall'] = score_table(group_tables(hourly, np.zeros(len(times), dtype=np.int64), 1), ['全部'],
+                                     thresholds, 'group')
+    results['hourly'] = score_table(hourly, list(times), thresholds, 'time')
+
+    if region_names:
+        station_table = stations.set_index('station_id').loc[columns].reset_index()
+        membership = station_regions(station_table, region_names)
+        results['region'] = score_table(member_tables(tables['station'], membership), list(region_names),
+                                        thresholds, 'region')
+
+    if lead_hours is not None:
+        lead_hours = pd.Series(np.asarray(lead_hours), index=model.index).loc[times].to_numpy()
+        edges = np.asarray(lead_windows, dtype=np.float64)
+        window = np.searchsorted(edges, lead_hours, side='right') - 1
+        window[(window < 0) | (window >= edges.size - 1)] = -1
+        labels = [f'{int(lower)}-{int(upper)}h' for lower, upper in zip(edges[:-1], edges[1:])]
+        results['lead'] = score_table(group_tables(hourly, window, len(labels)), labels, thresholds, 'lead')
+    return results
+
+def plot_scores(overall, output_file):
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for score in ('POD', 'FAR', 'CSI', 'ETS'):
+        ax.plot(overall['threshold'], overall[score], marker='o', label=score)
+    ax.plot(overall['threshold'], overall['FBI'], marker='s', linestyle='--', label='FBI')
+    ax.axhline(1.0, color='gray', linewidth=0.8)
+    ax.set_xscale('log')
+    ax.set_xlabel('阈值 (mm/h)')
+    ax.set_ylabel('评分')
+    ax.set_title('ERA5逐时降水站点检验')
+    ax.legend()
+    ax.grid(True)
+    fig.savefig(output_file)
+    plt.close(fig)
+    print(f"Saved verification scores as {output_file}")
+
+def main():
+    data_dir = r"D:\pycharm\dongliqixiangxue"
+    station_file = r"D:\pycharm\dongliqixiangxue\stations\stations.csv"
+    obs_path = r"D:\pycharm\dongliqixiangxue\stations\hourly"
+    output_dir = r"D:\新建文件夹\verification"
+    region_names = ['河南省', '郑州市', '河北省', '湖北省']
+
+    os.makedirs(output_dir, exist_ok=True)
+    catalog = era5_catalog.build_catalog(data_dir, catalog_file=os.path.join(data_dir, 'era5_catalog.json'))
+    stations = load_stations(station_file)
+    observed = load_observations(obs_path, stations['station_id'])
+    model = model_at_stations(catalog, stations, start=observed.index.min(), end=observed.index.max())
+
+    results = verify(model, observed, stations, region_names=region_names)
+    for name, table in results.items():
+        output_file = os.path.join(output_dir, f'scores_{name}.csv')
+        table.to_csv(output_file, index=False, encoding='utf-8-sig')
+        print(f"Saved {name} scores as {output_file}")
+    plot_scores(results['overall'], os.path.join(output_dir, 'scores_overall.png'))
+
+if __name__ == "__main__":
+    main()
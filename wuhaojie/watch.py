@@ -0,0 +1,258 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import io
+import json
+import time
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+from PIL import Image
+import era5_catalog
+import contour_cache
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+FRAME_DELAY = 33  # 动图每帧时长 (1/100秒)，与fps=3一致
+
+# 监视的产品：源变量、换算系数、固定色标层次、色标标签、色表。
+# 层次按物理量固定，不随首批数据变化，之后出现更强的降水也能画出
+PRODUCTS = {
+    'tp': {'scale': 1000.0, 'levels': [0.1, 1, 2, 5, 10, 20, 30, 50, 70, 100], 'title': '降水量',
+           'label': '降水量 (mm)', 'cmap': 'Blues'},
+}
+
+def empty_accumulators(shape):
+    return {
+        'count': np.zeros(shape, dtype=np.int64),
+        'total': np.zeros(shape),
+        'sum_squares': np.zeros(shape),
+        'maximum': np.full(shape, -np.inf),
+        'max_time': np.zeros(shape, dtype='datetime64[s]'),
+    }
+
+def update_accumulators(acc, block, times):
+    # 只用新到的时次更新累计量、平方和、极值及其出现时刻
+    valid = np.isfinite(block)
+    values = np.where(valid, block, 0.0)
+    acc['count'] += valid.sum(axis=0)
+    acc['total'] += values.sum(axis=0)
+    acc['sum_squares'] += (values ** 2).sum(axis=0)
+    masked = np.where(valid, block, -np.inf)
+    peak = masked.argmax(axis=0)
+    block_max = np.take_along_axis(masked, peak[np.newaxis], axis=0)[0]
+    newer = block_max > acc['maximum']
+    acc['maximum'][newer] = block_max[newer]
+    acc['max_time'][newer] = np.asarray(times.values, dtype='datetime64[s]')[peak[newer]]
+    return acc
+
+def statistics(acc):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = acc['total'] / acc['count']
+        std = np.sqrt(np.maximum(acc['sum_squares'] / acc['count'] - mean ** 2, 0.0))
+    return {'total': acc['total'], 'mean': mean, 'std': std, 'maximum': acc['maximum'], 'max_time': acc['max_time']}
+
+def load_state(output_dir, variable):
+    # 状态：已处理到的时次、固定色标和累计量；不存在时返回None
+    state_file = os.path.join(output_dir, f'{variable}_state.json')
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    with np.load(os.path.join(output_dir, f'{variable}_accumulators.npz')) as data:
+        state['accumulators'] = {name: data[name] for name in data.files}
+    return state
+
+def save_state(output_dir, variable, state):
+    # 先写临时文件再改名，中途中断时保留上一次的完整状态
+    arrays_file = os.path.join(output_dir, f'{variable}_accumulators.npz')
+    np.savez(arrays_file + '.tmp.npz', **state['accumulators'])
+    os.replace(arrays_file + '.tmp.npz', arrays_file)
+    state_file = os.path.join(output_dir, f'{variable}_state.json')
+    meta = {key: value for key, value in state.items() if key != 'accumulators'}
+    with open(state_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(state_file + '.tmp', state_file)
+
+def draw_frame(ax, cache_file, levels, current_time, spec, boundaries, extent=(110, 115, 32, 37)):
+    # 一帧监视产品：增量出图和frame_server共用，保证同一时次的图完全一致
+    ax.set_extent(list(extent), crs=ccrs.PlateCarree())
+    contour = contour_cache.draw_cached_contours(ax, cache_file, levels, cmap=spec['cmap'])
+    ax.figure.colorbar(contour, ax=ax, orientation='horizontal', pad=0.05, label=spec['label'])
+    ax.set_title(f'{spec["title"]} {current_time.strftime("%Y-%m-%d %H:%M")}')
+    ax.set_xlabel('经度')
+    ax.set_ylabel('纬度')
+    ax.gridlines(draw_labels=True)
+    cnmaps.draw_maps(boundaries['henan'], ax=ax, linewidth=1.0, color='black')
+    cnmaps.draw_maps(boundaries['zhengzhou'], ax=ax, linewidth=1.0, color='red')
+
+def render_frame(cache_file, levels, current_time, spec, boundaries, extent=(110, 115, 32, 37)):
+    # 返回PNG字节，既写帧文件也直接追加进动图
+    fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+    draw_frame(ax, cache_file, levels, current_time, spec, boundaries, extent)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    plt.close(fig)
+    return buffer.getvalue()
+
+def _skip_sub_blocks(data, position):
+    while data[position]:
+        position += data[position] + 1
+    return position + 1
+
+def gif_frames(data):
+    # 拆分GIF：返回(文件头+逻辑屏幕描述, 全局色表, 各帧的(扩展块, 图像块))
+    packed = data[10]
+    table_size = 3 * 2 ** ((packed & 0x07) + 1) if packed & 0x80 else 0
+    header = data[:13]
+    global_table = data[13:13 + table_size]
+    position = 13 + table_size
+    frames = []
+    frame_start = position
+    while data[position] != 0x3B:
+        if data[position] == 0x21:  # 扩展块
+            position = _skip_sub_blocks(data, position + 2)
+        elif data[position] == 0x2C:  # 图像描述符
+            image_start = position
+            local_packed = data[position + 9]
+            position += 10
+            if local_packed & 0x80:
+                position += 3 * 2 ** ((local_packed & 0x07) + 1)
+            position = _skip_sub_blocks(data, position + 1)
+            frames.append((data[frame_start:image_start], data[image_start:position]))
+            frame_start = position
+        else:
+            raise ValueError("无法解析的GIF数据块")
+    return header, global_table, frames
+
+def standalone_frame(png_bytes, size):
+    # 单帧编码成带本地色表和帧时长的GIF图像块，可直接接在已有动图末尾
+    image = Image.open(io.BytesIO(png_bytes)).convert('RGB')
+    if image.size != size:
+        image = image.resize(size)
+    buffer = io.BytesIO()
+    image.save(buffer, format='GIF')
+    header, global_table, frames = gif_frames(buffer.getvalue())
+    image_block = frames[-1][1]
+    control = b'\x21\xf9\x04\x00' + FRAME_DELAY.to_bytes(2, 'little') + b'\x00\x00'
+    if image_block[9] & 0x80:
+        return control + image_block
+    descriptor = bytearray(image_block[:10])
+    descriptor[9] = 0x80 | (header[10] & 0x07)
+    return control + bytes(descriptor) + global_table + image_block[10:]
+
+def append_to_animation(animation_file, png_frames, n_existing=0):
+    # 已有动图只在结尾追加新帧，不解码旧帧；首次运行时新建。
+    # n_existing为状态文件记录的帧数：上次在追加之后、保存状态之前中断时，动图里多出的帧先截掉再追加，避免重复
+    if not png_frames:
+        return
+    if not os.path.exists(animation_file) or n_existing == 0:
+        images = [Image.open(io.BytesIO(frame)).convert('RGB') for frame in png_frames]
+        images[0].save(animation_file, format='GIF', save_all=True, append_images=images[1:],
+                       duration=FRAME_DELAY * 10)
+        return
+    with open(animation_file, 'rb') as f:
+        data = f.read()
+    header, global_table, frames = gif_frames(data)
+    if len(frames) > n_existing:
+        data = header + global_table + b''.join(extensions + image for extensions, image in frames[:n_existing]) + b'\x3b'
+    size = (int.from_bytes(data[6:8], 'little'), int.from_bytes(data[8:10], 'little'))
+    blocks = b''.join(standalone_frame(frame, size) for frame in png_frames)
+    with open(animation_file + '.tmp', 'wb') as f:
+        f.write(data[:-1])
+        f.write(blocks)
+        f.write(b'\x3b')
+    os.replace(animation_file + '.tmp', animation_file)
+
+def update(file_path, output_dir, variable='tp', extent=(110, 115, 32, 37), levels=None):
+    # 一次增量更新：检测新时次，只读取、累计和绘制这些时次。返回新增时次数
+    spec = PRODUCTS[variable]
+    frames_dir = os.path.join(output_dir, variable)
+    os.makedirs(frames_dir, exist_ok=True)
+    state = load_state(output_dir, variable)
+
+    dataset = era5_catalog.load_dataset(file_path)
+    try:
+        times = era5_catalog.read_times(dataset)
+        # ERA5T对已处理时次的修订不回溯，只处理最后处理时次之后的数据
+        last_time = pd.Timestamp(state['last_time']) if state is not None else None
+        new = np.flatnonzero(times > last_time) if last_time is not None else np.arange(len(times))
+        if new.size == 0:
+            return 0
+        try:
+            lats = np.asarray(dataset.variables['latitude'][:], dtype=np.float64)
+            lons = np.asarray(dataset.variables['longitude'][:], dtype=np.float64)
+        except KeyError as e:
+            raise KeyError(f"变量未找到: {e}")
+        time_slice = slice(new[0], new[-1] + 1)
+        block = era5_catalog.read_block(dataset, variable, time_slice) * spec['scale']
+    finally:
+        dataset.close()
+    new_times = times[time_slice]
+
+    if state is None:
+        # 色标在首次运行时保存，之后的帧沿用，已有帧无需重绘
+        if levels is None:
+            levels = spec['levels']
+        state = {'variable': variable, 'levels': [float(level) for level in levels], 'n_frames': 0,
+                 'accumulators': empty_accumulators(block.shape[1:])}
+    levels = np.asarray(state['levels'])
+    update_accumulators(state['accumulators'], block, new_times)
+
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    # 超过最高层次的值归入最高一档，不会因为没有开口色段而不显示
+    cache_files = contour_cache.precompute_contours(lon_grid, lat_grid, np.minimum(block, levels[-1]), levels)
+    boundaries = {'henan': cnmaps.get_adm_maps(province='河南省'), 'zhengzhou': cnmaps.get_adm_maps(city='郑州市')}
+    png_frames = []
+    for cache_file, current_time in zip(cache_files, new_times):
+        png = render_frame(cache_file, levels, current_time, spec, boundaries, extent)
+        with open(os.path.join(frames_dir, f'{variable}_{current_time.strftime("%Y%m%d%H%M")}.png'), 'wb') as f:
+            f.write(png)
+        png_frames.append(png)
+    append_to_animation(os.path.join(output_dir, f'{variable}_animation.gif'), png_frames, state['n_frames'])
+
+    # 区域平均逐时序列追加写入；上次中断留下的、晚于已保存状态的行先去掉
+    weights = np.cos(np.radians(lats))[:, np.newaxis] * era5_catalog.region_mask(lats, lons, province='河南省')
+    series = pd.DataFrame({'time': new_times, 'henan_mean': np.nansum(block * weights, axis=(1, 2)) / weights.sum(),
+                           'max': np.nanmax(block, axis=(1, 2))})
+    series_file = os.path.join(output_dir, f'{variable}_hourly.csv')
+    if os.path.exists(series_file):
+        existing = pd.read_csv(series_file, parse_dates=['time'], encoding='utf-8')
+        if last_time is None or (existing['time'] > last_time).any():
+            kept = existing[existing['time'] <= last_time] if last_time is not None else existing.iloc[:0]
+            kept.to_csv(series_file, index=False, encoding='utf-8')
+    series.to_csv(series_file, mode='a', header=not os.path.exists(series_file), index=False, encoding='utf-8')
+
+    stats = statistics(state['accumulators'])
+    np.savez(os.path.join(output_dir, f'{variable}_statistics.npz'), latitude=lats, longitude=lons, **stats)
+    state['last_time'] = str(new_times[-1])
+    state['n_frames'] += int(new.size)
+    save_state(output_dir, variable, state)
+    print(f"Appended {new.size} new hours ({new_times[0]} - {new_times[-1]}) to {output_dir}")
+    return int(new.size)
+
+def watch(file_path, output_dir, variables=('tp',), interval=600, once=False):
+    # 定时检查源文件，有新时次就增量更新；文件正在被下载覆盖时等下一轮再试
+    while True:
+        for variable in variables:
+            try:
+                update(file_path, output_dir, variable)
+            except (OSError, RuntimeError) as e:
+                print(f"跳过本轮更新: {e}")
+        if once:
+            break
+        time.sleep(interval)
+
+def main():
+    file_path = r"D:\pycharm\dongliqixiangxue\single levels.nc"
+    output_dir = r"D:\新建文件夹\watch"
+    interval = 600  # 检查间隔 (秒)
+
+    os.makedirs(output_dir, exist_ok=True)
+    watch(file_path, output_dir, interval=interval)
+
+if __name__ == "__main__":
+    main()
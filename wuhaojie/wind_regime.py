@@ -0,0 +1,253 @@
+import xarray as xr
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+from matplotlib.colors import ListedColormap, BoundaryNorm
+import os
+import cartopy.crs as ccrs
+import cnmaps
+import pandas as pd
+import derived
+import era5_catalog
+import preview
+
+# 设置matplotlib支持中文显示
+plt.rcParams["font.sans-serif"] = ["SimHei"]
+plt.rcParams["axes.unicode_minus"] = False
+os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+SECTOR_NAMES = {
+    8: ['北', '东北', '东', '东南', '南', '西南', '西', '西北'],
+    16: ['北', '北东北', '东北', '东东北', '东', '东东南', '东南', '南东南',
+         '南', '南西南', '西南', '西西南', '西', '西西北', '西北', '北西北'],
+}
+SPEED_BINS = (2.0, 4.0, 6.0, 8.0, 10.0, 12.0)  # 风速分档边界 (m/s)
+CALM = 0.5  # 小于该风速记为静风 (m/s)
+
+def load_dataset(file_path):
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件未找到: {file_path}")
+    try:
+        dataset = xr.open_dataset(file_path)
+    except OSError as e:
+        raise RuntimeError(f"无法打开文件: {e}")
+    return dataset
+
+def sector_names(n_sectors=8):
+    return SECTOR_NAMES[n_sectors] + ['静风']
+
+def classify(u, v, n_sectors=8, speed_bins=SPEED_BINS, calm=CALM, chunk=24):
+    # 一次向量化计算所有格点、所有时次的风向扇区和风速档；静风的扇区号为n_sectors
+    speed = derived.evaluate('wind_speed', u=u, v=v, chunk=chunk)
+    direction = derived.evaluate('wind_direction', u=u, v=v, chunk=chunk)
+    width = 360.0 / n_sectors
+    np.add(direction, width / 2, out=direction)
+    np.floor_divide(direction, width, out=direction)
+    np.mod(direction, n_sectors, out=direction)
+    sector = direction.astype(np.int8)
+    sector[~(speed >= calm)] = n_sectors
+    speed_bin = np.digitize(speed, speed_bins).astype(np.int8)
+    return sector, speed_bin
+
+def empty_state(shape, n_sectors=8, speed_bins=SPEED_BINS, regions=()):
+    # 累计计数：每个格点各扇区出现次数，以及各区域的扇区-风速联合计数(风玫瑰)
+    return {
+        'n_sectors': n_sectors,
+        'speed_bins': np.asarray(speed_bins, dtype=np.float64),
+        'n_times': 0,
+        'sector_counts': np.zeros((n_sectors + 1,) + tuple(shape), dtype=np.int64),
+        'roses': {name: np.zeros((n_sectors + 1, len(speed_bins) + 1), dtype=np.int64) for name in regions},
+    }
+
+def region_masks(lats, lons):
+    # 风玫瑰统计的区域掩膜，按各数据集自己的网格构建
+    return {
+        '河南省': era5_catalog.region_mask(lats, lons, province='河南省'),
+        '郑州市': era5_catalog.region_mask(lats, lons, city='郑州市'),
+    }
+
+def update_state(state, sector, speed_bin, masks=None):
+    # 用bincount一次统计整块数据，不按扇区循环
+    n_classes = state['n_sectors'] + 1
+    n_cells = sector[0].size
+    cells = np.arange(n_cells, dtype=np.int64)
+    flat = sector.reshape(len(sector), n_cells).astype(np.int64) * n_cells + cells
+    state['sector_counts'] += np.bincount(flat.ravel(), minlength=n_classes * n_cells).reshape(state['sector_counts'].shape)
+
+    n_speed = len(state['speed_bins']) + 1
+    for name, mask in (masks or {}).items():
+        joint = sector[:, mask].astype(np.int64) * n_speed + speed_bin[:, mask]
+        state['roses'][name] += np.bincount(joint.ravel(), minlength=n_classes * n_speed).reshape(n_classes, n_speed)
+    state['n_times'] += len(sector)
+    return state
+
+def sector_frequency(state):
+    # 各扇区出现频率 (%)，形状为(扇区+静风, 纬度, 经度)
+    return state['sector_counts'] / max(state['n_times'], 1) * 100.0
+
+def accumulate(catalog, start=None, end=None, level=None, masks=None, lat_slice=slice(None), lon_slice=slice(None),
+               n_sectors=8, speed_bins=SPEED_BINS, chunk_hours=744):
+    # 在目录上逐块统计，可用于整个过程或多年气候态；level为None时使用10米风
+    names = ('u10', 'v10') if level is None else ('u', 'v')
+    masks = {name: mask[lat_slice, lon_slice] for name, mask in (masks or {}).items()}
+    chunks = zip(era5_catalog.iter_variable_chunks(catalog, names[0], start, end, level, lat_slice, lon_slice, chunk_hours),
+                 era5_catalog.iter_variable_chunks(catalog, names[1], start, end, level, lat_slice, lon_slice, chunk_hours))
+    state = None
+    for (times, u), (_, v) in chunks:
+        sector, speed_bin = classify(u, v, n_sectors, speed_bins)
+        if state is None:
+            state = empty_state(u.shape[1:], n_sectors, speed_bins, masks.keys())
+        update_state(state, sector, speed_bin, masks)
+    if state is None:
+        raise ValueError("所选时段内没有风场数据")
+    return state
+
+def plot_frequency_maps(lon_grid, lat_grid, frequency, title, output_file, extent=(110, 115, 32, 37)):
+    # 每个扇区一幅频率图，色标统一
+    names = sector_names(frequency.shape[0] - 1)
+    ncols = 3 if len(names) <= 9 else 6
+    nrows = int(np.ceil(len(names) / ncols))
+    levels = np.linspace(0, max(float(np.nanmax(frequency)), 1.0), 11)
+    henan = preview.simplified_boundary(province='河南省')
+    fig, axes = plt.subplots(nrows, ncols, figsize=(ncols * 4, nrows * 3.6), squeeze=False,
+                             subplot_kw={'projection': ccrs.PlateCarree()})
+    for ax, name, field in zip(axes.flat, names, frequency):
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        contour = ax.contourf(lon_grid, lat_grid, field, levels=levels, cmap='YlOrRd', transform=ccrs.PlateCarree())
+        for ring in henan:
+            ax.plot(ring[0], ring[1], color='black', linewidth=0.8, transform=ccrs.PlateCarree())
+        ax.set_title(name)
+    for ax in axes.flat[len(names):]:
+        ax.axis('off')
+    fig.colorbar(contour, ax=axes, orientation='horizontal', fraction=0.03, pad=0.04, label='频率 (%)')
+    fig.suptitle(title)
+    fig.savefig(output_file)
+    plt.close(fig)
+    print(f"Saved sector frequency maps as {output_file}")
+
+def plot_wind_rose(rose, speed_bins, title, output_file):
+    # 风玫瑰：各扇区频率按风速档堆叠，静风频率写在图中
+    n_sectors = rose.shape[0] - 1
+    total = max(rose.sum(), 1)
+    frequency = rose[:n_sectors] / total * 100.0
+    angles = np.radians(np.arange(n_sectors) * 360.0 / n_sectors)
+    width = 2 * np.pi / n_sectors * 0.9
+    labels = [f'<{speed_bins[0]:g}'] + [f'{low:g}-{high:g}' for low, high in zip(speed_bins[:-1], speed_bins[1:])] + [f'≥{speed_bins[-1]:g}']
+    colors = plt.get_cmap('viridis')(np.linspace(0, 1, len(labels)))
+
+    fig = plt.figure(figsize=(8, 8))
+    ax = fig.add_subplot(projection='polar')
+    ax.set_theta_zero_location('N')
+    ax.set_theta_direction(-1)
+    bottom = np.zeros(n_sectors)
+    for i, label in enumerate(labels):
+        ax.bar(angles, frequency[:, i], width=width, bottom=bottom, color=colors[i], edgecolor='white', label=f'{label} m/s')
+        bottom += frequency[:, i]
+    ax.set_xticks(angles)
+    ax.set_xticklabels(SECTOR_NAMES[n_sectors])
+    ax.set_title(f'{title}\n静风 {rose[n_sectors].sum() / total * 100.0:.1f}%')
+    ax.legend(loc='lower left', bbox_to_anchor=(1.0, 0.0), title='风速')
+    fig.savefig(output_file, bbox_inches='tight')
+    plt.close(fig)
+    print(f"Saved wind rose as {output_file}")
+
+def save_sector_frames(lon_grid, lat_grid, sector, time_points, output_dir, title, n_sectors=8, frames=None,
+                       extent=(110, 115, 32, 37)):
+    # 逐时风向扇区分类图
+    names = sector_names(n_sectors)
+    cmap = ListedColormap(list(plt.get_cmap('hsv')(np.linspace(0, 1, n_sectors, endpoint=False))) + [(0.85, 0.85, 0.85, 1.0)])
+    norm = BoundaryNorm(np.arange(n_sectors + 2) - 0.5, cmap.N)
+    henan = cnmaps.get_adm_maps(province='河南省')
+    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
+
+    for frame in preview.selected_frames(len(time_points), frames):
+        current_time = pd.to_datetime(time_points[frame])
+
+        fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
+        ax.set_extent(extent, crs=ccrs.PlateCarree())  # 设置经纬度范围
+        mesh = ax.pcolormesh(lon_grid, lat_grid, sector[frame], cmap=cmap, norm=norm, alpha=0.7,
+                             shading='nearest', transform=ccrs.PlateCarree())
+        cbar = plt.colorbar(mesh, ax=ax, orientation='horizontal', pad=0.05, ticks=np.arange(n_sectors + 1))
+        cbar.ax.set_xticklabels(names)
+        ax.set_title(f'{title} {current_time.strftime("%Y-%m-%d %H:%M")}')
+        ax.set_xlabel('经度')
+        ax.set_ylabel('纬度')
+        ax.gridlines(draw_labels=True)
+        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
+        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+
+        fig.savefig(os.path.join(output_dir, f'sector_{current_time.strftime("%Y%m%d%H%M")}.png'))
+        plt.close(fig)
+
+def create_animation_from_images(output_dir, output_file):
+    fig, ax = plt.subplots(figsize=(12, 8))
+    images = []
+
+    for frame in sorted(os.listdir(output_dir)):
+        if frame.endswith('.png'):
+            img = plt.imread(os.path.join(output_dir, frame))
+            images.append([plt.imshow(img, animated=True)])
+
+    ani = animation.ArtistAnimation(fig, images, interval=200, repeat=False)
+    ani.save(output_file, writer='pillow', fps=3)
+    plt.close(fig)
+
+def main():
+    single_file = r"D:\pycharm\dongliqixiangxue\single levels.nc"
+    pressure_file = r"D:\pycharm\dongliqixiangxue\ERA5 hourly data on pressure levels from 1940 to present.nc"
+    output_dir = r"D:\新建文件夹\wind_regime"
+    # 多年目录(era5_catalog)，给出时统计该时段的气候态风玫瑰和扇区频率
+    climatology_dir = None
+    climatology_period = ('1991-01-01', '2020-12-31')
+    n_sectors = 8
+
+    os.makedirs(output_dir, exist_ok=True)
+    single = load_dataset(single_file)
+    pressure = load_dataset(pressure_file)
+
+    cases = [('10m', single, None), ('850hPa', pressure.sel(pressure_level=850), 850)]
+    for name, dataset, level in cases:
+        # 单层与气压层文件的网格可能不同，坐标和区域掩膜按各自数据集构建
+        lats = dataset['latitude'].values
+        lons = dataset['longitude'].values
+        lon_grid, lat_grid = np.meshgrid(lons, lats)
+        masks = region_masks(lats, lons)
+        u, v = (dataset['u10'], dataset['v10']) if level is None else (dataset['u'], dataset['v'])
+        time_name = 'valid_time' if 'valid_time' in dataset.coords else 'time'
+        time_points = pd.to_datetime(dataset[time_name].values)
+        sector, speed_bin = classify(u, v, n_sectors)
+        state = update_state(empty_state(sector.shape[1:], n_sectors, regions=masks.keys()), sector, speed_bin, masks)
+
+        plot_frequency_maps(lon_grid, lat_grid, sector_frequency(state), f'{name} 风向扇区频率',
+                            os.path.join(output_dir, f'{name}_sector_frequency.png'))
+        for region, rose in state['roses'].items():
+            plot_wind_rose(rose, state['speed_bins'], f'{region} {name} 风玫瑰',
+                           os.path.join(output_dir, f'{name}_{region}_wind_rose.png'))
+
+        frames_dir = os.path.join(output_dir, f'{name}_frames')
+        os.makedirs(frames_dir, exist_ok=True)
+        save_sector_frames(lon_grid, lat_grid, sector, time_points, frames_dir, f'{name} 风向扇区', n_sectors)
+        output_file = os.path.join(output_dir, f'{name}_sector_animation.gif')
+        create_animation_from_images(frames_dir, output_file)
+        print(f"Saved sector animation as {output_file}")
+
+    if climatology_dir is not None:
+        catalog = era5_catalog.build_catalog(climatology_dir, catalog_file=os.path.join(climatology_dir, 'era5_catalog.json'))
+        dataset = era5_catalog.load_dataset(era5_catalog.select_files(catalog, 'u10', *climatology_period)[0]['path'])
+        lats = dataset.variables['latitude'][:]
+        lons = dataset.variables['longitude'][:]
+        dataset.close()
+        lon_grid, lat_grid = np.meshgrid(lons, lats)
+        masks = region_masks(lats, lons)
+        state = accumulate(catalog, climatology_period[0], climatology_period[1], masks=masks, n_sectors=n_sectors)
+        plot_frequency_maps(lon_grid, lat_grid, sector_frequency(state), '10m 风向扇区频率 (气候态)',
+                            os.path.join(output_dir, '10m_sector_frequency_climatology.png'))
+        for region, rose in state['roses'].items():
+            plot_wind_rose(rose, state['speed_bins'], f'{region} 10m 风玫瑰 (气候态)',
+                           os.path.join(output_dir, f'10m_{region}_wind_rose_climatology.png'))
+
+    single.close()
+    pressure.close()
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,10 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import os
-from scipy.ndimage import gaussian_filter
-from scipy.interpolate import griddata
 import cnmaps
 import cartopy.crs as ccrs
 import cartopy.mpl.ticker as cticker
+from sparse_precip import SparseFrames, regrid_operator
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -27,10 +26,10 @@ try:
 except OSError as e:
     raise RuntimeError(f"无法打开文件: {e}")
 
-# 提取对流降水和大尺度降水变量数据
+# 提取对流降水和大尺度降水变量数据：按时间块读取并只保存有降水的格点
 try:
-    cp = dataset.variables['cp'][:] * 100  # 转换为厘米
-    lsp = dataset.variables['lsp'][:] * 100  # 转换为厘米
+    cp = SparseFrames.from_variable(dataset.variables['cp'], scale=100)  # 转换为厘米
+    lsp = SparseFrames.from_variable(dataset.variables['lsp'], scale=100)  # 转换为厘米
     valid_time_var = dataset.variables['valid_time']  # 时间变量
     print(f"cp shape: {cp.shape}")
     print(f"lsp shape: {lsp.shape}")
@@ -57,22 +56,16 @@ os.makedirs(output_dir, exist_ok=True)
 fig, axs = plt.subplots(2, 1, figsize=(12, 16), subplot_kw={'projection': ccrs.PlateCarree()})
 
 # 设置固定的颜色范围
-vmin = min(cp.min(), lsp.min())
-vmax = max(cp.max(), lsp.max())
+vmin = min(cp.value_range()[0], lsp.value_range()[0])
+vmax = max(cp.value_range()[1], lsp.value_range()[1])
 
-# 初始化图像
-initial_cp = cp[0, :, :]
-initial_lsp = lsp[0, :, :]
-smoothed_cp = gaussian_filter(initial_cp, sigma=1)
-smoothed_lsp = gaussian_filter(initial_lsp, sigma=1)
-
-# 插值
-points = np.array([lon_grid.ravel(), lat_grid.ravel()]).T
-cp_values = smoothed_cp.ravel()
-lsp_values = smoothed_lsp.ravel()
+# 平滑+插值合成为一个稀疏算子，绘制时逐帧作用，不展开全部时次
 grid_lon, grid_lat = np.meshgrid(np.linspace(110, 115, 100), np.linspace(32, 37, 100))
-interpolated_cp = griddata(points, cp_values, (grid_lon, grid_lat), method='cubic')
-interpolated_lsp = griddata(points, lsp_values, (grid_lon, grid_lat), method='cubic')
+operator = regrid_operator(lats, lons, grid_lon, grid_lat, sigma=1)
+
+# 初始化图像
+interpolated_cp = cp.regrid_frame(operator, 0).reshape(grid_lon.shape)
+interpolated_lsp = lsp.regrid_frame(operator, 0).reshape(grid_lon.shape)
 
 # 绘制对流降水图
 mesh_cp = axs[0].pcolormesh(grid_lon, grid_lat, interpolated_cp, cmap='Blues', shading='auto', transform=ccrs.PlateCarree(), vmin=vmin, vmax=vmax)
@@ -110,16 +103,8 @@ for ax in axs:
 # 动画更新函数
 def update(frame):
     current_time = time_points[frame]
-    cp_data = cp[frame, :, :]
-    lsp_data = lsp[frame, :, :]
-    smoothed_cp = gaussian_filter(cp_data, sigma=1)
-    smoothed_lsp = gaussian_filter(lsp_data, sigma=1)
-
-    # 插值
-    cp_values = smoothed_cp.ravel()
-    lsp_values = smoothed_lsp.ravel()
-    interpolated_cp = griddata(points, cp_values, (grid_lon, grid_lat), method='cubic')
-    interpolated_lsp = griddata(points, lsp_values, (grid_lon, grid_lat), method='cubic')
+    interpolated_cp = cp.regrid_frame(operator, frame)
+    interpolated_lsp = lsp.regrid_frame(operator, frame)
 
     mesh_cp.set_array(interpolated_cp.ravel())
     mesh_lsp.set_array(interpolated_lsp.ravel())
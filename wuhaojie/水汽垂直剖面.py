@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import os
 import pandas as pd  # 导入pandas库
+import cross_section
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -73,13 +74,14 @@ def main():
     dataset = load_dataset(file_path)
     q, pressure, time_var, lats, lons = extract_variables(dataset)
 
-    # 选择北纬35度的剖面
-    q_profile = q.sel(latitude=35, method='nearest')
+    # 北纬35度的剖面：插值权重只计算一次，所有时次一次性提取
+    section = cross_section.build_section(lats, lons, [(float(lons.min()), 35.0), (float(lons.max()), 35.0)], n_points=lons.size)
+    q_profile = cross_section.extract(section, q.values)
 
     # 使用pandas处理时间变量
     time_points = pd.to_datetime(time_var)
 
-    save_vertical_profile_frames(lons, pressure, q_profile, time_points, output_dir)
+    save_vertical_profile_frames(section['lon'], pressure, q_profile, time_points, output_dir)
     create_animation_from_images(output_dir, output_file)
 
     dataset.close()
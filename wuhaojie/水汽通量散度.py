@@ -7,6 +7,8 @@ import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import cnmaps
 import pandas as pd  # 导入pandas库
+import contour_cache
+import preview
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -34,21 +36,26 @@ def extract_variables(dataset):
         raise KeyError(f"变量未找到: {e}")
     return u10, v10, tcwv, time_var, lats, lons
 
-def save_frames(lon_grid, lat_grid, u10, v10, tcwv, time_points, output_dir, vmin, vmax):
+def save_frames(lon_grid, lat_grid, u10, v10, tcwv, time_points, output_dir, vmin, vmax, frames=None):
     henan = cnmaps.get_adm_maps(province='河南省')
     zhengzhou = cnmaps.get_adm_maps(city='郑州市')
 
-    for frame in range(len(time_points)):
-        current_time = time_points[frame]
-        qu = u10[frame, :, :] * tcwv[frame, :, :]  # 东向水汽通量
-        qv = v10[frame, :, :] * tcwv[frame, :, :]  # 北向水汽通量
+    # 所有时次一次性计算水汽通量散度
+    qu = np.asarray(u10) * np.asarray(tcwv)  # 东向水汽通量
+    qv = np.asarray(v10) * np.asarray(tcwv)  # 北向水汽通量
+    divQ = np.gradient(qu, axis=-1) + np.gradient(qv, axis=-2)
 
-        # 计算水汽通量散度
-        divQ = np.gradient(qu, axis=-1) + np.gradient(qv, axis=-2)
+    # 固定层次的等值线在工作进程中预先生成并缓存，只改配色或标题时不再重新计算
+    levels = contour_cache.contour_levels(np.array([vmin, vmax]))
+    frames = preview.selected_frames(len(time_points), frames)
+    contour_files = dict(zip(frames, contour_cache.precompute_contours(lon_grid, lat_grid, divQ[frames], levels)))
+
+    for frame in frames:
+        current_time = time_points[frame]
 
         fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
         ax.set_extent([110, 115, 32, 37], crs=ccrs.PlateCarree())  # 设置经纬度范围
-        contour = ax.contourf(lon_grid, lat_grid, divQ, cmap='coolwarm', transform=ccrs.PlateCarree(), vmin=vmin, vmax=vmax)
+        contour = contour_cache.draw_cached_contours(ax, contour_files[frame], levels, cmap='coolwarm')
         plt.colorbar(contour, ax=ax, orientation='horizontal', pad=0.05, label='水汽通量散度')
         ax.set_title(f'水汽通量散度的空间分布 {current_time.strftime("%Y-%m-%d %H:%M")}')
         ax.set_xlabel('经度')
@@ -83,6 +90,9 @@ def main():
     file_path = r"D:\pycharm\dongliqixiangxue\single levels.nc"
     output_dir = r"D:\新建文件夹\850hpa"
     output_file = os.path.join(output_dir, '850hpa_divergence_animation.gif')
+    # 出图模式：'preview'只生成所有时次的缩略总览图；'full'出完整质量的帧，promote_frames指定只升级部分帧(None为全部)
+    render_mode = 'full'
+    promote_frames = None
 
     os.makedirs(output_dir, exist_ok=True)
 
@@ -100,7 +110,14 @@ def main():
     vmin = divQ.min()
     vmax = divQ.max()
 
-    save_frames(lon_grid, lat_grid, u10, v10, tcwv, time_points, output_dir, vmin, vmax)
+    if render_mode == 'preview':
+        levels = contour_cache.contour_levels(np.array([vmin, vmax]))
+        preview.contact_sheet(lon_grid, lat_grid, divQ, time_points, levels, 'coolwarm', '水汽通量散度',
+                              '水汽通量散度', os.path.join(output_dir, '850hpa_divergence_preview.png'))
+        dataset.close()
+        return
+
+    save_frames(lon_grid, lat_grid, u10, v10, tcwv, time_points, output_dir, vmin, vmax, frames=promote_frames)
     create_animation_from_images(output_dir, output_file)
 
     dataset.close()
@@ -7,6 +7,9 @@ import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import cnmaps
 import pandas as pd  # 导入pandas库
+import climatology
+import contour_cache
+import preview
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -32,28 +35,48 @@ def extract_variable(dataset, level):
         raise KeyError(f"变量未找到: {e}")
     return rh, time_var, lats, lons
 
-def save_humidity_frames(lon_grid, lat_grid, rh, time_points, output_dir, level):
-    henan = cnmaps.get_adm_maps(province='河南省')
-    zhengzhou = cnmaps.get_adm_maps(city='郑州市')
-
-    for frame in range(len(time_points)):
+def humidity_levels(rh, anomaly=False):
+    # 预览与完整出图共用同一组层次，完整出图可直接复用等值线缓存
+    if anomaly:
+        bound = np.nanmax(np.abs(rh))
+        return np.linspace(-bound, bound, 21)
+    return contour_cache.contour_levels(rh)
+
+def draw_frame(ax, cache_file, levels, current_time, level, boundaries, anomaly=False, extent=(110, 115, 32, 37)):
+    # 一帧相对湿度：脚本出图和frame_server共用，保证同一时次的图完全一致
+    ax.set_extent(list(extent), crs=ccrs.PlateCarree())  # 设置经纬度范围
+    if anomaly:
+        rh_contour = contour_cache.draw_cached_contours(ax, cache_file, levels, cmap='BrBG', alpha=0.6)
+        ax.figure.colorbar(rh_contour, ax=ax, orientation='horizontal', pad=0.05, label='相对湿度距平 (%)')
+        ax.set_title(f'{level} hPa 相对湿度距平 {current_time.strftime("%Y-%m-%d %H:%M")}')
+    else:
+        rh_contour = contour_cache.draw_cached_contours(ax, cache_file, levels, cmap='viridis', alpha=0.6)
+        ax.figure.colorbar(rh_contour, ax=ax, orientation='horizontal', pad=0.05, label='相对湿度 (%)')
+        ax.set_title(f'{level} hPa 相对湿度 {current_time.strftime("%Y-%m-%d %H:%M")}')
+    ax.set_xlabel('经度')
+    ax.set_ylabel('纬度')
+    ax.coastlines()
+    ax.add_feature(cfeature.BORDERS, linestyle=':')
+    ax.gridlines(draw_labels=True)
+
+    # 添加河南省和郑州市边界
+    cnmaps.draw_maps(boundaries['henan'], ax=ax, linewidth=1.0, color='black')
+    cnmaps.draw_maps(boundaries['zhengzhou'], ax=ax, linewidth=1.0, color='red')
+
+def save_humidity_frames(lon_grid, lat_grid, rh, time_points, output_dir, level, anomaly=False, frames=None):
+    boundaries = {'henan': cnmaps.get_adm_maps(province='河南省'), 'zhengzhou': cnmaps.get_adm_maps(city='郑州市')}
+
+    # 固定层次的等值线在工作进程中预先生成并缓存，只改配色或标题时不再重新计算
+    rh = np.asarray(rh)
+    levels = humidity_levels(rh, anomaly)
+    frames = preview.selected_frames(len(time_points), frames)
+    contour_files = dict(zip(frames, contour_cache.precompute_contours(lon_grid, lat_grid, rh[frames], levels)))
+
+    for frame in frames:
         current_time = pd.to_datetime(time_points[frame])
-        rh_frame = rh[frame, :, :]  # 当前时间帧的相对湿度
 
         fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': ccrs.PlateCarree()})
-        ax.set_extent([110, 115, 32, 37], crs=ccrs.PlateCarree())  # 设置经纬度范围
-        rh_contour = ax.contourf(lon_grid, lat_grid, rh_frame, cmap='viridis', alpha=0.6, transform=ccrs.PlateCarree())
-        plt.colorbar(rh_contour, ax=ax, orientation='horizontal', pad=0.05, label='相对湿度 (%)')
-        ax.set_title(f'{level} hPa 相对湿度 {current_time.strftime("%Y-%m-%d %H:%M")}')
-        ax.set_xlabel('经度')
-        ax.set_ylabel('纬度')
-        ax.coastlines()
-        ax.add_feature(cfeature.BORDERS, linestyle=':')
-        ax.gridlines(draw_labels=True)
-
-        # 添加河南省和郑州市边界
-        cnmaps.draw_maps(henan, ax=ax, linewidth=1.0, color='black')
-        cnmaps.draw_maps(zhengzhou, ax=ax, linewidth=1.0, color='red')
+        draw_frame(ax, contour_files[frame], levels, current_time, level, boundaries, anomaly)
 
         # 保存图像
         output_file = os.path.join(output_dir, f'frame_{frame:03d}.png')
@@ -77,6 +100,11 @@ def main():
     file_path = r"D:\Git desktop\dongliqixiang\ERA5 hourly data on pressure levels from 1940 to present.nc"
     rh_output_dir = r"D:\新建文件夹\500hpa_rh"
     rh_output_file = os.path.join(rh_output_dir, '500hpa_rh_animation.gif')
+    # 距平模式：指定climatology.py生成的逐日气候态文件，设为None则绘制原始场
+    climatology_file = None
+    # 出图模式：'preview'只生成所有时次的缩略总览图；'full'出完整质量的帧，promote_frames指定只升级部分帧(None为全部)
+    render_mode = 'full'
+    promote_frames = None
 
     os.makedirs(rh_output_dir, exist_ok=True)
 
@@ -87,7 +115,19 @@ def main():
     # 使用pandas处理时间变量
     time_points = pd.to_datetime(time_var)
 
-    save_humidity_frames(lon_grid, lat_grid, rh, time_points, rh_output_dir, level='500')
+    if climatology_file is not None:
+        clim = climatology.load_climatology(climatology_file)
+        rh = climatology.anomaly(rh, time_points, clim, lats, lons)
+
+    anomaly = climatology_file is not None
+    if render_mode == 'preview':
+        levels = humidity_levels(np.asarray(rh), anomaly)
+        preview.contact_sheet(lon_grid, lat_grid, rh, time_points, levels, 'BrBG' if anomaly else 'viridis', '500 hPa 相对湿度',
+                              '相对湿度 (%)', os.path.join(rh_output_dir, '500hpa_rh_preview.png'))
+        dataset.close()
+        return
+
+    save_humidity_frames(lon_grid, lat_grid, rh, time_points, rh_output_dir, level='500', anomaly=anomaly, frames=promote_frames)
     create_animation_from_images(rh_output_dir, rh_output_file)
 
     dataset.close()
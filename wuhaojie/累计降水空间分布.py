@@ -2,11 +2,10 @@ import netCDF4 as nc
 import numpy as np
 import matplotlib.pyplot as plt
 import os
-from scipy.ndimage import gaussian_filter
-from scipy.interpolate import griddata
 import cnmaps
 import cartopy.crs as ccrs
 import cartopy.mpl.ticker as cticker
+from sparse_precip import SparseFrames, regrid_operator
 
 # 设置matplotlib支持中文显示
 plt.rcParams["font.sans-serif"] = ["SimHei"]
@@ -26,11 +25,11 @@ try:
 except OSError as e:
     raise RuntimeError(f"无法打开文件: {e}")
 
-# 提取降水变量数据
+# 提取降水变量数据：按时间块读取并只保存有降水的格点
 try:
-    tp = dataset.variables['tp']
+    tp = SparseFrames.from_variable(dataset.variables['tp'])
     time_var = dataset.variables['time']  # 时间变量
-    print(f"tp dimensions: {tp.dimensions}, shape: {tp.shape}")
+    print(f"tp shape: {tp.shape}")
 except KeyError as e:
     raise KeyError(f"变量未找到: {e}")
 
@@ -38,20 +37,13 @@ except KeyError as e:
 lats = dataset.variables['latitude'][:]
 lons = dataset.variables['longitude'][:]
 
-# 创建网格
-lon_grid, lat_grid = np.meshgrid(lons, lats)
-
 # 累加所有时间步长的降水量数据
-cumulative_precipitation = np.sum(tp[:], axis=0)
-
-# 平滑数据
-smoothed_data = gaussian_filter(cumulative_precipitation, sigma=1)
+cumulative_precipitation = tp.total()
 
-# 插值
-points = np.array([lon_grid.ravel(), lat_grid.ravel()]).T
-values = smoothed_data.ravel()
+# 平滑+插值合成为一个稀疏算子，直接作用于累计场
 grid_lon, grid_lat = np.meshgrid(np.linspace(110, 115, 100), np.linspace(32, 37, 100))
-interpolated_data = griddata(points, values, (grid_lon, grid_lat), method='cubic')
+operator = regrid_operator(lats, lons, grid_lon, grid_lat, sigma=1)
+interpolated_data = (operator @ cumulative_precipitation.ravel()).reshape(grid_lon.shape)
 
 # 创建保存图片的文件夹
 output_dir = r"降水"